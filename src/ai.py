@@ -2,34 +2,51 @@
 communicating with the OpenAI API and parsing the response."""
 
 import json
-from typing import List, Set
-from prompts.prompts import SYSTEM_MESSAGE_BASE_V1
+import threading
+from enum import Enum
+from typing import AsyncGenerator, Generator, List, Optional, Set, Tuple
+from prompts.prompts import DEFAULT_PROMPT, PROMPTS
 from utils.openai_wrapper import (
     OpenAIMessageFactory,
     OpenAIMessage,
     OpenAIChat,
     OpenAIChatBuilder,
+    ResponseFormat,
 )
+from utils.candidate_scoring import (
+    get_candidate_groups_content,
+    parse_candidate_scores,
+)
+from utils.guess_parser import IncrementalGuessParser, parse_text_groups
+from utils.timing import timed
 from game_state import GameState
+from game_types.game_types import AttemptResult, AttemptResultStatus
 
 
-def get_system_message_content(remaining_words: Set[str]) -> str:
-    """Get the content of the system message."""
+def get_system_message_content(
+    remaining_words: Set[str], prompt: str = DEFAULT_PROMPT
+) -> str:
+    """Get the content of the system message, starting with the named prompt."""
     number_of_groups_to_provide = len(remaining_words) // 4
-    message = SYSTEM_MESSAGE_BASE_V1
+    message = PROMPTS[prompt]
     message += f"\nProvide {number_of_groups_to_provide} groups of 4 words each."
     return message
 
 
-def get_system_message(game_state: GameState) -> OpenAIMessage:
+def get_system_message(
+    game_state: GameState, prompt: str = DEFAULT_PROMPT
+) -> OpenAIMessage:
     """Get the system message."""
-    message = get_system_message_content(game_state.get_remaining_words())
+    message = get_system_message_content(game_state.get_remaining_words(), prompt)
     return OpenAIMessageFactory.get_system_message(message)
 
 
 def get_initial_user_message_content(remaining_words: Set[str]) -> str:
-    """Get the content of the initial user message."""
-    message = json.dumps(list(remaining_words))
+    """Get the content of the initial user message.
+
+    Words are sorted, so the same game always makes the same request.
+    """
+    message = json.dumps(sorted(remaining_words))
     return message
 
 
@@ -39,6 +56,30 @@ def get_initial_user_message(game_state: GameState) -> OpenAIMessage:
     return OpenAIMessageFactory.get_user_message(message)
 
 
+ATTEMPT_FEEDBACK = {
+    AttemptResultStatus.SUCCESS: "Correct",
+    AttemptResultStatus.ONE_AWAY: "One away",
+    AttemptResultStatus.FAILURE: "Incorrect",
+}
+
+
+def get_attempt_feedback_content(
+    attempts: List[AttemptResult], remaining_words: Set[str]
+) -> str:
+    """Get the content of the message reporting attempts back to the AI."""
+    lines = [
+        f"{ATTEMPT_FEEDBACK[attempt.result]}: {', '.join(sorted(attempt.words))}"
+        for attempt in attempts
+    ]
+    number_of_groups_to_provide = len(remaining_words) // 4
+    lines.append(
+        f"Provide {number_of_groups_to_provide} groups of 4 words each"
+        " from the remaining words:"
+    )
+    lines.append(json.dumps(sorted(remaining_words)))
+    return "\n".join(lines)
+
+
 CONVERT_TO_JSON_MESSAGE_CONTENT = """
 Convert your response to JSON where the response has an array of objects, each of which have a words string array, and a theme string. Every group must have 4 words.
 If I were to type the JSON in typescript it'd be `{groups: {words: string[]; theme: string;}[];}`.
@@ -47,6 +88,78 @@ CONVERT_TO_JSON_MESSAGE = OpenAIMessageFactory.get_system_message(
     CONVERT_TO_JSON_MESSAGE_CONTENT
 )
 
+STRUCTURED_RESPONSE_MESSAGE_CONTENT = """
+Respond in JSON where the response has an array of objects, each of which have a words string array, and a theme string. Every group must have 4 words. List the groups in order of confidence.
+If I were to type the JSON in typescript it'd be `{groups: {words: string[]; theme: string;}[];}`.
+"""
+STRUCTURED_RESPONSE_MESSAGE = OpenAIMessageFactory.get_system_message(
+    STRUCTURED_RESPONSE_MESSAGE_CONTENT
+)
+
+
+SCORE_CANDIDATES_MESSAGE_CONTENT = """
+You will be given the results of the attempts made so far, candidate groups of 4 words, one per line, and the remaining words. For each candidate, estimate the probability from 0 to 1 that it is exactly one of the correct groups.
+Respond in JSON with one score per candidate, in the order the candidates were given. If I were to type the JSON in typescript it'd be `{scores: number[];}`.
+"""
+SCORE_CANDIDATES_MESSAGE = OpenAIMessageFactory.get_system_message(
+    SCORE_CANDIDATES_MESSAGE_CONTENT
+)
+
+
+def get_candidate_scoring_content(
+    candidates: List[Set[str]],
+    attempts: List[AttemptResult],
+    remaining_words: Set[str],
+) -> str:
+    """Get the content of the message asking for the candidates' scores."""
+    lines = [
+        f"{ATTEMPT_FEEDBACK[attempt.result]}: {', '.join(sorted(attempt.words))}"
+        for attempt in attempts
+    ]
+    lines.append(get_candidate_groups_content(candidates, remaining_words))
+    return "\n".join(lines)
+
+
+class GuessResponseMode(Enum):
+    """Enum for representing how the AI is asked for its guesses."""
+
+    # Free text, parsed locally, converted to JSON by the model if that fails
+    TEXT = "text"
+    # A single JSON response. Needs a model that supports JSON mode.
+    STRUCTURED = "structured"
+
+
+class GuessParseStats:
+    """Counts how guesses were parsed, to see how often the fallback fires."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.structured = 0
+        self.local_parses = 0
+        self.json_conversion_fallbacks = 0
+
+    def record(self, counter_name: str):
+        """Increment the named counter."""
+        with self.lock:
+            setattr(self, counter_name, getattr(self, counter_name) + 1)
+
+    def get_fallback_rate(self) -> float:
+        """Return the fraction of text responses that needed a conversion call."""
+        text_responses = self.local_parses + self.json_conversion_fallbacks
+        if text_responses == 0:
+            return 0.0
+        return self.json_conversion_fallbacks / text_responses
+
+    def __str__(self):
+        return (
+            f"structured={self.structured} local_parses={self.local_parses} "
+            f"json_conversion_fallbacks={self.json_conversion_fallbacks} "
+            f"fallback_rate={self.get_fallback_rate():.2%}"
+        )
+
+
+guess_parse_stats = GuessParseStats()
+
 
 class AIGuess:
     """Class for representing a guess from the AI."""
@@ -63,39 +176,282 @@ class AIGuess:
         return self.words
 
 
+@timed("ai.parse.json")
+def parse_json_guesses(json_string: str) -> List[AIGuess]:
+    """Parse the `{groups: {words, theme}[]}` JSON response into guesses."""
+    json_object = json.loads(json_string)
+    guesses: List[AIGuess] = []
+    for group in json_object["groups"]:
+        words = set(group["words"])
+        theme = group["theme"]
+        guesses.append(AIGuess(words, theme))
+    return guesses
+
+
+@timed("ai.parse.text")
+def parse_text_guesses(
+    text: str, remaining_words: Set[str]
+) -> Optional[List[AIGuess]]:
+    """Parse a free-text response into guesses, or None if it can't be parsed."""
+    groups = parse_text_groups(text, remaining_words)
+    if groups is None:
+        return None
+    return [AIGuess(words, theme) for theme, words in groups]
+
+
+def get_streamed_guesses(
+    parser: IncrementalGuessParser, groups: List[Tuple[str, Set[str]]]
+) -> List[AIGuess]:
+    """Return the guesses for the streamed groups.
+
+    The local parse is counted as soon as the groups complete the response,
+    since the player may close the stream once it has the last guess.
+    """
+    if groups and parser.get_number_of_missing_groups() == 0:
+        guess_parse_stats.record("local_parses")
+    return [AIGuess(words, theme) for theme, words in groups]
+
+
 class AI:
     """Class for representing the AI."""
 
-    def __init__(self, game_state: GameState, model: str):
+    def __init__(
+        self,
+        game_state: GameState,
+        model: str,
+        response_mode: GuessResponseMode = GuessResponseMode.TEXT,
+        prompt: str = DEFAULT_PROMPT,
+    ):
         self.game_state = game_state
         self.model = model
+        self.response_mode = response_mode
+        # Name of the system prompt in PROMPTS
+        self.prompt = prompt
+        # Chat carried across calls to continue_conversation
+        self.conversation: Optional[OpenAIChatBuilder] = None
+        self.reported_attempts = 0
 
-    def __convert_to_json_and_parse(
+    def __get_convert_to_json_chat(
         self, chat_builder_input: OpenAIChatBuilder
-    ) -> List[AIGuess]:
-        """Add on the JSON system message, get assistant response, and parse it."""
+    ) -> OpenAIChat:
+        """Add on the JSON system message to the given chat."""
         chat_builder = OpenAIChatBuilder(chat_builder_input).with_message(
             CONVERT_TO_JSON_MESSAGE
         )
-        chat = OpenAIChat(chat_builder)
+        return OpenAIChat(chat_builder)
+
+    def __convert_to_json_and_parse(
+        self, chat_builder_input: OpenAIChatBuilder
+    ) -> List[AIGuess]:
+        """Add on the JSON system message, get assistant response, and parse it."""
+        chat = self.__get_convert_to_json_chat(chat_builder_input)
         assistant_response = chat.get_json_response()
-        json_string = assistant_response.get_content()
-        json_object = json.loads(json_string)
-        guesses: List[AIGuess] = []
-        for group in json_object["groups"]:
-            words = set(group["words"])
-            theme = group["theme"]
-            guesses.append(AIGuess(words, theme))
-        return guesses
+        return parse_json_guesses(assistant_response.get_content())
 
-    def get_initial_guesses(self) -> List[AIGuess]:
-        """Get the initial guesses from the AI."""
-        system_message = get_system_message(self.game_state)
+    async def __convert_to_json_and_parse_async(
+        self, chat_builder_input: OpenAIChatBuilder
+    ) -> List[AIGuess]:
+        """Async version of __convert_to_json_and_parse."""
+        chat = self.__get_convert_to_json_chat(chat_builder_input)
+        assistant_response = await chat.get_json_response_async()
+        return parse_json_guesses(assistant_response.get_content())
+
+    def __get_initial_chat_builder(self) -> OpenAIChatBuilder:
+        """Get the chat with the system message and the remaining words."""
+        system_message = get_system_message(self.game_state, self.prompt)
         user_message = get_initial_user_message(self.game_state)
         chat_builder = OpenAIChatBuilder()
         chat_builder = chat_builder.with_message(system_message)
+        if self.response_mode == GuessResponseMode.STRUCTURED:
+            chat_builder = chat_builder.with_message(STRUCTURED_RESPONSE_MESSAGE)
         chat_builder = chat_builder.with_message(user_message)
+        return chat_builder
+
+    def __parse_text_guesses(self, text: str) -> Optional[List[AIGuess]]:
+        """Parse the free-text response locally, recording the outcome."""
+        guesses = parse_text_guesses(text, self.game_state.get_remaining_words())
+        if guesses is None:
+            guess_parse_stats.record("json_conversion_fallbacks")
+        else:
+            guess_parse_stats.record("local_parses")
+        return guesses
+
+    def __request_guesses(
+        self, chat_builder: OpenAIChatBuilder
+    ) -> Tuple[List[AIGuess], OpenAIChatBuilder]:
+        """Get and parse guesses, returning them and the chat with the response."""
         chat = OpenAIChat(chat_builder)
+        if self.response_mode == GuessResponseMode.STRUCTURED:
+            assistant_response = chat.get_json_response(self.model)
+            guess_parse_stats.record("structured")
+            guesses = parse_json_guesses(assistant_response.get_content())
+            return guesses, chat_builder.with_message(assistant_response)
         assistant_response = chat.get_response(self.model)
         chat_builder = chat_builder.with_message(assistant_response)
-        return self.__convert_to_json_and_parse(chat_builder)
+        guesses = self.__parse_text_guesses(assistant_response.get_content())
+        if guesses is None:
+            guesses = self.__convert_to_json_and_parse(chat_builder)
+        return guesses, chat_builder
+
+    async def __request_guesses_async(
+        self, chat_builder: OpenAIChatBuilder
+    ) -> Tuple[List[AIGuess], OpenAIChatBuilder]:
+        """Async version of __request_guesses."""
+        chat = OpenAIChat(chat_builder)
+        if self.response_mode == GuessResponseMode.STRUCTURED:
+            assistant_response = await chat.get_json_response_async(self.model)
+            guess_parse_stats.record("structured")
+            guesses = parse_json_guesses(assistant_response.get_content())
+            return guesses, chat_builder.with_message(assistant_response)
+        assistant_response = await chat.get_response_async(self.model)
+        chat_builder = chat_builder.with_message(assistant_response)
+        guesses = self.__parse_text_guesses(assistant_response.get_content())
+        if guesses is None:
+            guesses = await self.__convert_to_json_and_parse_async(chat_builder)
+        return guesses, chat_builder
+
+    def get_initial_guesses(self) -> List[AIGuess]:
+        """Get the initial guesses from the AI."""
+        guesses, _ = self.__request_guesses(self.__get_initial_chat_builder())
+        return guesses
+
+    async def get_initial_guesses_async(self) -> List[AIGuess]:
+        """Get the initial guesses from the AI without blocking the event loop."""
+        chat_builder = self.__get_initial_chat_builder()
+        guesses, _ = await self.__request_guesses_async(chat_builder)
+        return guesses
+
+    def prefetch_initial_guesses(self):
+        """Send the request for the initial guesses before they are asked for.
+
+        Every player's first request is for the initial guesses, so a game
+        prepared ahead by the async game runner has its response in flight.
+        """
+        response_format = ResponseFormat.TEXT
+        if self.response_mode == GuessResponseMode.STRUCTURED:
+            response_format = ResponseFormat.JSON
+        chat = OpenAIChat(self.__get_initial_chat_builder())
+        chat.prefetch_response(response_format, self.model)
+
+    def __get_scoring_chat(self, candidates: List[Set[str]]) -> OpenAIChat:
+        """Get the chat asking for a score for each of the candidates."""
+        content = get_candidate_scoring_content(
+            candidates,
+            self.game_state.get_attempts(),
+            self.game_state.get_remaining_words(),
+        )
+        chat_builder = (
+            OpenAIChatBuilder()
+            .with_message(OpenAIMessageFactory.get_system_message(PROMPTS[self.prompt]))
+            .with_message(SCORE_CANDIDATES_MESSAGE)
+            .with_message(OpenAIMessageFactory.get_user_message(content))
+        )
+        return OpenAIChat(chat_builder)
+
+    def score_candidate_groups(self, candidates: List[Set[str]]) -> List[float]:
+        """Get the AI's confidence in each candidate group, in one request.
+
+        Candidates can be, for example, the neighbours of a one away attempt or
+        the groups of earlier responses, so the player can pick its next
+        attempt locally instead of asking for new guesses.
+        """
+        if len(candidates) == 0:
+            return []
+        chat = self.__get_scoring_chat(candidates)
+        assistant_response = chat.get_json_response(self.model)
+        return parse_candidate_scores(assistant_response.get_content(), len(candidates))
+
+    async def score_candidate_groups_async(
+        self, candidates: List[Set[str]]
+    ) -> List[float]:
+        """Async version of score_candidate_groups."""
+        if len(candidates) == 0:
+            return []
+        chat = self.__get_scoring_chat(candidates)
+        assistant_response = await chat.get_json_response_async(self.model)
+        return parse_candidate_scores(assistant_response.get_content(), len(candidates))
+
+    def __get_conversation_chat_builder(self) -> OpenAIChatBuilder:
+        """Return the conversation with feedback on the latest attempts added."""
+        attempts = self.game_state.get_attempts()
+        new_attempts = attempts[self.reported_attempts :]
+        self.reported_attempts = len(attempts)
+        if self.conversation is None:
+            return self.__get_initial_chat_builder()
+        feedback = get_attempt_feedback_content(
+            new_attempts, self.game_state.get_remaining_words()
+        )
+        return self.conversation.with_message(
+            OpenAIMessageFactory.get_user_message(feedback)
+        )
+
+    def continue_conversation(self) -> List[AIGuess]:
+        """Get guesses for the remaining words, continuing the earlier chat.
+
+        Only the results of the attempts made since the last call are sent as
+        new content, so the provider can reuse the cached prompt prefix.
+        """
+        chat_builder = self.__get_conversation_chat_builder()
+        guesses, self.conversation = self.__request_guesses(chat_builder)
+        return guesses
+
+    async def continue_conversation_async(self) -> List[AIGuess]:
+        """Async version of continue_conversation."""
+        chat_builder = self.__get_conversation_chat_builder()
+        guesses, self.conversation = await self.__request_guesses_async(chat_builder)
+        return guesses
+
+    def __get_streamed_chat_builder(
+        self, chat_builder: OpenAIChatBuilder, parser: IncrementalGuessParser
+    ) -> Optional[OpenAIChatBuilder]:
+        """Return the chat to convert to JSON if the stream missed groups."""
+        if parser.get_number_of_missing_groups() == 0:
+            return None
+        guess_parse_stats.record("json_conversion_fallbacks")
+        assistant_response = OpenAIMessageFactory.get_assistant_message(parser.text)
+        return chat_builder.with_message(assistant_response)
+
+    def stream_initial_guesses(self) -> Generator[AIGuess, None, None]:
+        """Yield each guess as soon as the streamed response completes it.
+
+        If the streamed text is missing groups once it ends, the rest come from
+        the JSON conversion call.
+        """
+        if self.response_mode == GuessResponseMode.STRUCTURED:
+            yield from self.get_initial_guesses()
+            return
+        chat_builder = self.__get_initial_chat_builder()
+        parser = IncrementalGuessParser(self.game_state.get_remaining_words())
+        for content in OpenAIChat(chat_builder).get_response_stream(self.model):
+            for guess in get_streamed_guesses(parser, parser.feed(content)):
+                yield guess
+        for guess in get_streamed_guesses(parser, parser.finish()):
+            yield guess
+        conversion_chat_builder = self.__get_streamed_chat_builder(chat_builder, parser)
+        if conversion_chat_builder is None:
+            return
+        for guess in self.__convert_to_json_and_parse(conversion_chat_builder):
+            if not guess.get_words() & parser.used_words:
+                yield guess
+
+    async def stream_initial_guesses_async(self) -> AsyncGenerator[AIGuess, None]:
+        """Async version of stream_initial_guesses."""
+        if self.response_mode == GuessResponseMode.STRUCTURED:
+            for guess in await self.get_initial_guesses_async():
+                yield guess
+            return
+        chat_builder = self.__get_initial_chat_builder()
+        parser = IncrementalGuessParser(self.game_state.get_remaining_words())
+        chat = OpenAIChat(chat_builder)
+        async for content in chat.get_response_stream_async(self.model):
+            for guess in get_streamed_guesses(parser, parser.feed(content)):
+                yield guess
+        for guess in get_streamed_guesses(parser, parser.finish()):
+            yield guess
+        conversion_chat_builder = self.__get_streamed_chat_builder(chat_builder, parser)
+        if conversion_chat_builder is None:
+            return
+        guesses = await self.__convert_to_json_and_parse_async(conversion_chat_builder)
+        for guess in guesses:
+            if not guess.get_words() & parser.used_words:
+                yield guess
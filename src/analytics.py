@@ -0,0 +1,208 @@
+"""Compare result sets from the results store.
+
+Every run is loaded into NumPy arrays, one per column, so that summaries and
+bootstrap confidence intervals stay fast with tens of thousands of games.
+
+    PYTHONPATH=src python src/analytics.py --baseline gpt-4/single_guess
+"""
+
+import argparse
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from results_store import DEFAULT_PROMPT, RESULTS_DATABASE_FILE, ResultKey, ResultsStore
+
+GROUPS_PER_GAME = 4
+BOOTSTRAP_SAMPLES = 10000
+CONFIDENCE = 0.95
+
+
+class RunResults:
+    """Class for representing the results of one run as columnar arrays."""
+
+    def __init__(
+        self,
+        key: ResultKey,
+        game_ids: np.ndarray,
+        groups_identified: np.ndarray,
+        total_attempts: np.ndarray,
+    ):
+        self.key = key
+        self.game_ids = game_ids
+        self.groups_identified = groups_identified
+        self.total_attempts = total_attempts
+
+    def get_name(self) -> str:
+        """Return the name of the run as model/run, plus the prompt if set."""
+        run, model, prompt = self.key
+        name = f"{model}/{run}"
+        return name if prompt == DEFAULT_PROMPT else f"{name}/{prompt}"
+
+    def get_solved(self) -> np.ndarray:
+        """Return whether each game was solved."""
+        return self.groups_identified == GROUPS_PER_GAME
+
+    def get_mistakes(self) -> np.ndarray:
+        """Return the number of mistakes made in each game."""
+        return self.total_attempts - self.groups_identified
+
+    def get_summary(self) -> Dict:
+        """Return the solve rate, averages and groups identified distribution."""
+        games = max(len(self.game_ids), 1)
+        groups_counts = np.bincount(
+            self.groups_identified, minlength=GROUPS_PER_GAME + 1
+        )
+        return {
+            "games": len(self.game_ids),
+            "solve_rate": float(self.get_solved().sum() / games),
+            "average_groups_identified": float(self.groups_identified.sum() / games),
+            "average_mistakes": float(self.get_mistakes().sum() / games),
+            "average_total_attempts": float(self.total_attempts.sum() / games),
+            "groups_identified_distribution": (groups_counts / games).tolist(),
+        }
+
+
+def load_runs(store: ResultsStore) -> List[RunResults]:
+    """Load every run in the store, ordered by run, model and prompt."""
+    rows = store.get_rows(
+        "SELECT run, model, prompt, game_id, groups_identified, total_attempts"
+        " FROM results ORDER BY run, model, prompt, game_id"
+    )
+    if len(rows) == 0:
+        return []
+    keys = [(row[0], row[1], row[2]) for row in rows]
+    columns = np.array([row[3:] for row in rows], dtype=np.int64)
+    # Index of the first row of each run
+    starts = [0] + [i for i in range(1, len(keys)) if keys[i] != keys[i - 1]]
+    ends = starts[1:] + [len(keys)]
+    return [
+        RunResults(
+            keys[start],
+            columns[start:end, 0],
+            columns[start:end, 1],
+            columns[start:end, 2],
+        )
+        for start, end in zip(starts, ends)
+    ]
+
+
+def bootstrap_mean_interval(
+    values: np.ndarray,
+    samples: int = BOOTSTRAP_SAMPLES,
+    confidence: float = CONFIDENCE,
+    rng: Optional[np.random.Generator] = None,
+) -> Tuple[float, float]:
+    """Return the percentile bootstrap confidence interval of the mean.
+
+    Resampling with replacement only changes how often each distinct value is
+    drawn, so each resample is drawn as multinomial counts of the distinct
+    values. Per-game deltas take only a handful of values, which makes this
+    independent of the number of games.
+    """
+    if len(values) == 0:
+        return (0.0, 0.0)
+    rng = rng or np.random.default_rng(0)
+    distinct_values, counts = np.unique(values, return_counts=True)
+    draws = rng.multinomial(len(values), counts / len(values), size=samples)
+    means = draws @ distinct_values / len(values)
+    tail = (1 - confidence) / 2 * 100
+    low, high = np.percentile(means, [tail, 100 - tail])
+    return (float(low), float(high))
+
+
+def compare_runs(
+    baseline: RunResults,
+    candidate: RunResults,
+    samples: int = BOOTSTRAP_SAMPLES,
+    confidence: float = CONFIDENCE,
+    seed: int = 0,
+) -> Dict:
+    """Return paired per-game deltas between the runs on their shared games.
+
+    Each delta is the candidate minus the baseline, with a bootstrap
+    confidence interval of its mean.
+    """
+    game_ids, baseline_indices, candidate_indices = np.intersect1d(
+        baseline.game_ids, candidate.game_ids, return_indices=True
+    )
+    rng = np.random.default_rng(seed)
+    comparison: Dict = {"shared_games": len(game_ids)}
+    deltas = {
+        "solve_rate": candidate.get_solved()[candidate_indices].astype(float)
+        - baseline.get_solved()[baseline_indices],
+        "groups_identified": candidate.groups_identified[candidate_indices]
+        - baseline.groups_identified[baseline_indices],
+        "mistakes": candidate.get_mistakes()[candidate_indices]
+        - baseline.get_mistakes()[baseline_indices],
+        "total_attempts": candidate.total_attempts[candidate_indices]
+        - baseline.total_attempts[baseline_indices],
+    }
+    for name, delta in deltas.items():
+        low, high = bootstrap_mean_interval(delta, samples, confidence, rng)
+        comparison[name] = {
+            "delta": float(delta.mean()) if len(delta) else 0.0,
+            "low": low,
+            "high": high,
+        }
+    return comparison
+
+
+def print_summaries(runs: List[RunResults]):
+    """Print the summary of each run."""
+    print(
+        f"{'run':<45}{'games':>7}{'solved':>8}{'groups':>8}{'mistakes':>10}"
+        f"{'attempts':>10}  groups identified 0-4"
+    )
+    for run in runs:
+        summary = run.get_summary()
+        distribution = " ".join(
+            f"{share:.2f}" for share in summary["groups_identified_distribution"]
+        )
+        print(
+            f"{run.get_name():<45}{summary['games']:>7}"
+            f"{summary['solve_rate']:>8.1%}"
+            f"{summary['average_groups_identified']:>8.2f}"
+            f"{summary['average_mistakes']:>10.2f}"
+            f"{summary['average_total_attempts']:>10.2f}  {distribution}"
+        )
+
+
+def print_comparison(baseline: RunResults, candidate: RunResults, comparison: Dict):
+    """Print the deltas of the candidate run against the baseline."""
+    print(
+        f"{candidate.get_name()} vs {baseline.get_name()} "
+        f"({comparison['shared_games']} shared games)"
+    )
+    for name in ("solve_rate", "groups_identified", "mistakes", "total_attempts"):
+        delta = comparison[name]
+        print(
+            f"  {name:<20}{delta['delta']:>+8.3f}"
+            f"  [{delta['low']:+.3f}, {delta['high']:+.3f}]"
+        )
+
+
+def main(args: argparse.Namespace):
+    runs = load_runs(ResultsStore(args.database))
+    if len(runs) == 0:
+        print("No results found.")
+        return
+    print_summaries(runs)
+    names = [run.get_name() for run in runs]
+    if args.baseline is not None and args.baseline not in names:
+        raise ValueError(f"Unknown baseline {args.baseline}, expected one of {names}")
+    baseline = runs[names.index(args.baseline)] if args.baseline else runs[0]
+    for run in runs:
+        if run is baseline:
+            continue
+        comparison = compare_runs(baseline, run, args.samples, args.confidence)
+        print_comparison(baseline, run, comparison)
+
+
+if __name__ == "__main__":
+    argument_parser = argparse.ArgumentParser(description=__doc__)
+    argument_parser.add_argument("--database", default=RESULTS_DATABASE_FILE)
+    argument_parser.add_argument(
+        "--baseline", help="run to compare against, as printed in the summary"
+    )
+    argument_parser.add_argument("--samples", type=int, default=BOOTSTRAP_SAMPLES)
+    argument_parser.add_argument("--confidence", type=float, default=CONFIDENCE)
+    main(argument_parser.parse_args())
@@ -0,0 +1,279 @@
+"""Run many games concurrently on a single asyncio event loop."""
+
+import asyncio
+import sys
+from contextlib import ExitStack, nullcontext
+from typing import Callable, ContextManager, Dict, List, Optional, Sequence, Union
+from game_types.game_types import ConnectionsBackend
+from ai import AI
+from conversational_player import ConversationalPlayer
+from player import Player
+from results_tracker import GameResult, ResultsTracker
+from single_ai_guess_player import SingleAiGuessPlayer
+from solver_player import SolverPlayer
+from utils.journal import Journal, current_game_journal
+from utils.metrics import record_failed_game
+from utils.transcripts import TranscriptRecorder
+from utils.openai_wrapper import (
+    PrefetchedResponses,
+    api_semaphore,
+    current_prefetched_responses,
+)
+from work_queue import WorkQueue
+
+DEFAULT_GAME_CONCURRENCY = 16
+DEFAULT_API_CONCURRENCY = 8
+DEFAULT_LOOKAHEAD = 0
+
+ConnectionsFactory = Callable[[int], ContextManager[ConnectionsBackend]]
+GamePlayer = Union[Player, SingleAiGuessPlayer, SolverPlayer, ConversationalPlayer]
+PlayerFactory = Callable[..., GamePlayer]
+
+
+def prefetch_initial_guesses(player: GamePlayer):
+    """Send the player's first request, which is for the initial guesses."""
+    game_state = player.game.get_game_state()
+    ai = AI(game_state, player.model, player.response_mode, player.prompt)
+    ai.prefetch_initial_guesses()
+
+
+class AsyncGameRunner:
+    """Plays games concurrently, with separate limits on games and API calls.
+
+    `create_connections` returns a context manager that provides the backend
+    for a game, such as `BrowserPool.connections`, and releases it when the
+    game ends. It is entered and exited from a worker thread so that page
+    loads of live games do not block the event loop. Without a results
+    tracker no game is skipped and no result is saved. With a journal, every
+    turn is journaled and unfinished games are resumed from it. With both, a
+    game the journal has finished is not played again, its result coming
+    from the journal instead. With a
+    transcript recorder, the transcript of every finished game is saved. A
+    game that raises is recorded in `failed_games` without stopping the others.
+
+    With a lookahead, up to that many games beyond those being played are
+    prepared ahead: their page is loaded and the request for their initial
+    guesses is sent, so a game is ready to play as soon as a slot frees up.
+    """
+
+    def __init__(
+        self,
+        create_connections: ConnectionsFactory,
+        player_class: PlayerFactory,
+        model: str,
+        results_tracker: Optional[ResultsTracker],
+        game_concurrency: int = DEFAULT_GAME_CONCURRENCY,
+        api_concurrency: int = DEFAULT_API_CONCURRENCY,
+        journal: Optional[Journal] = None,
+        lookahead: int = DEFAULT_LOOKAHEAD,
+        transcripts: Optional[TranscriptRecorder] = None,
+    ):
+        self.create_connections = create_connections
+        self.player_class = player_class
+        self.model = model
+        self.results_tracker = results_tracker
+        self.game_concurrency = game_concurrency
+        self.api_concurrency = api_concurrency
+        self.journal = journal
+        self.lookahead = lookahead
+        self.transcripts = transcripts
+        # Error of each game that raised, by game id
+        self.failed_games: Dict[int, str] = {}
+
+    async def run_game(
+        self,
+        game_id: int,
+        game_semaphore: asyncio.Semaphore,
+        preparation_semaphore: asyncio.Semaphore,
+    ) -> Optional[GameResult]:
+        """Play a single game and save its result."""
+        tracker = self.results_tracker
+        if tracker is not None and tracker.already_has_result(game_id):
+            print(f"Game {game_id} already has result. Skipping.")
+            return None
+        async with preparation_semaphore:
+            try:
+                game_result = await self.play_journaled_game(game_id, game_semaphore)
+            except Exception as error:  # pylint: disable=broad-except
+                self.record_failure(game_id, error)
+                return None
+        if tracker is not None and game_result is not None:
+            tracker.save_result(game_result)
+        return game_result
+
+    def record_failure(self, game_id: int, error: Exception):
+        """Log and record a game that raised, so the other games carry on."""
+        print(f"Game {game_id} failed: {error!r}")
+        self.failed_games[game_id] = repr(error)
+        record_failed_game(error)
+
+    async def play_journaled_game(
+        self, game_id: int, game_semaphore: Optional[asyncio.Semaphore] = None
+    ) -> Optional[GameResult]:
+        """Play a game, journaling and recording it if the runner does."""
+        if self.journal is not None and self.results_tracker is not None:
+            # Finished, but the run stopped before its result was saved
+            finished_result = self.journal.get_finished_result(game_id)
+            if finished_result is not None:
+                print(f"Game {game_id} was finished in the journal. Not playing it.")
+                return finished_result
+        print(f"Running game {game_id}")
+        with ExitStack() as stack:
+            game_journal = None
+            if self.journal is not None:
+                game_journal = stack.enter_context(self.journal.track_game(game_id))
+            game_transcript = None
+            if self.transcripts is not None:
+                game_transcript = stack.enter_context(
+                    self.transcripts.track_game(game_id)
+                )
+            game_result = await self.play_game(game_id, game_semaphore)
+            if game_result is None:
+                return None
+            if game_journal is not None:
+                game_journal.record_finished(
+                    game_result.groups_identified, game_result.total_attempts
+                )
+            if self.transcripts is not None and game_transcript is not None:
+                self.transcripts.save(
+                    game_transcript,
+                    game_result.groups_identified,
+                    game_result.total_attempts,
+                )
+        return game_result
+
+    async def play_game(
+        self, game_id: int, game_semaphore: Optional[asyncio.Semaphore] = None
+    ) -> Optional[GameResult]:
+        """Play a game with connections from the factory, then release them.
+
+        The game is loaded, and with a lookahead its first request is sent,
+        before waiting for the game semaphore.
+        """
+        prefetched_responses = PrefetchedResponses()
+        token = current_prefetched_responses.set(prefetched_responses)
+        try:
+            return await self.__play_game(game_id, game_semaphore)
+        finally:
+            prefetched_responses.cancel()
+            current_prefetched_responses.reset(token)
+
+    async def __play_game(
+        self, game_id: int, game_semaphore: Optional[asyncio.Semaphore]
+    ) -> Optional[GameResult]:
+        connections_context = self.create_connections(game_id)
+        connections = await asyncio.to_thread(connections_context.__enter__)
+        try:
+            player = await asyncio.to_thread(
+                self.player_class, game_id, connections, self.model
+            )
+            game_journal = current_game_journal.get()
+            if self.lookahead > 0 and (
+                game_journal is None or not game_journal.is_resuming()
+            ):
+                prefetch_initial_guesses(player)
+            async with game_semaphore or nullcontext():
+                game_result = await player.play_game_async()
+        except BaseException:
+            suppressed = await asyncio.to_thread(
+                connections_context.__exit__, *sys.exc_info()
+            )
+            if not suppressed:
+                raise
+            return None
+        await asyncio.to_thread(connections_context.__exit__, None, None, None)
+        return game_result
+
+    async def run_games(self, game_ids: Sequence[int]) -> List[GameResult]:
+        """Play all the given games and return the results of those played.
+
+        Games that raise are left out of the results and recorded in
+        `failed_games`. If the run is aborted, games not yet finished are
+        cancelled along with their prefetched requests.
+        """
+        game_semaphore = asyncio.Semaphore(self.game_concurrency)
+        # Games being prepared or played, lookahead more than are played at once
+        preparation_semaphore = asyncio.Semaphore(
+            self.game_concurrency + self.lookahead
+        )
+        token = api_semaphore.set(asyncio.Semaphore(self.api_concurrency))
+        tasks = [
+            asyncio.ensure_future(
+                self.run_game(game_id, game_semaphore, preparation_semaphore)
+            )
+            for game_id in game_ids
+        ]
+        try:
+            results = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            api_semaphore.reset(token)
+        return [result for result in results if result is not None]
+
+    async def run_queued_games(self, work_queue: WorkQueue) -> List[GameResult]:
+        """Claim and play games from the queue until none are left.
+
+        Results are saved through the queue rather than the results tracker,
+        so that workers sharing the queue never save a game twice. Returns
+        the results this worker saved.
+        """
+        game_semaphore = asyncio.Semaphore(self.game_concurrency)
+        token = api_semaphore.set(asyncio.Semaphore(self.api_concurrency))
+        results: List[GameResult] = []
+        workers = [
+            asyncio.ensure_future(
+                self.__play_queued_games(work_queue, game_semaphore, results)
+            )
+            for _ in range(self.game_concurrency + self.lookahead)
+        ]
+        try:
+            await asyncio.gather(*workers)
+        except BaseException:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            raise
+        finally:
+            api_semaphore.reset(token)
+        return results
+
+    async def __play_queued_games(
+        self,
+        work_queue: WorkQueue,
+        game_semaphore: asyncio.Semaphore,
+        results: List[GameResult],
+    ):
+        while True:
+            game_id = await asyncio.to_thread(work_queue.claim)
+            if game_id is None:
+                return
+            heartbeat = asyncio.ensure_future(self.__heartbeat(work_queue, game_id))
+            try:
+                game_result = await self.play_journaled_game(game_id, game_semaphore)
+            except Exception as error:  # pylint: disable=broad-except
+                # One failing game must not stop the other workers
+                self.record_failure(game_id, error)
+                game_result = None
+            except BaseException:
+                await asyncio.to_thread(work_queue.release, game_id)
+                raise
+            finally:
+                heartbeat.cancel()
+            if game_result is None:
+                await asyncio.to_thread(work_queue.release, game_id)
+            elif await asyncio.to_thread(work_queue.complete, game_result):
+                results.append(game_result)
+            else:
+                print(f"Lease on game {game_id} was lost. Discarding its result.")
+
+    async def __heartbeat(self, work_queue: WorkQueue, game_id: int):
+        """Extend the lease on the game until cancelled."""
+        while True:
+            await asyncio.sleep(work_queue.lease_seconds / 3)
+            if not await asyncio.to_thread(work_queue.heartbeat, game_id):
+                print(f"Lease on game {game_id} was lost.")
+                return
@@ -0,0 +1,180 @@
+"""Benchmark games end to end against the offline game and the mock API.
+
+Reports games per minute and latency percentiles for every phase of a game,
+and writes them to a JSON file so runs can be compared across commits.
+
+    PYTHONPATH=src python src/benchmark.py --games 200 --latency 0.5
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import subprocess
+import time
+from functools import partial
+from typing import List, Optional
+from ai import GuessResponseMode, guess_parse_stats
+from async_runner import AsyncGameRunner
+from offline_connections import PUZZLES_FILE, OfflineConnections, load_puzzles
+from players import PLAYER_CLASSES
+from utils.metrics import metrics
+from utils.mock_openai import MockChatCompletion, lognormal_latency
+from utils.openai_wrapper import set_chat_completion_backend, set_request_scheduler
+from utils.request_scheduler import add_arguments as add_request_arguments
+from utils.request_scheduler import get_request_scheduler
+from utils.timing import phase_timings
+
+BENCHMARK_OUTPUT_FOLDER = "output/benchmarks"
+
+
+def get_commit() -> str:
+    """Return the current git commit, or "unknown" outside a git checkout."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def get_game_ids(args: argparse.Namespace) -> List[int]:
+    """Return the game ids to play, cycling through the puzzles in the file."""
+    puzzle_ids = args.game_ids or sorted(load_puzzles(args.puzzles_file))
+    return [puzzle_ids[i % len(puzzle_ids)] for i in range(args.games)]
+
+
+def run_benchmark(args: argparse.Namespace) -> dict:
+    """Play the benchmark games and return the report."""
+    set_chat_completion_backend(
+        MockChatCompletion(
+            load_puzzles(args.puzzles_file),
+            latency=lognormal_latency(args.latency),
+            accuracy=args.accuracy,
+            error_rate=args.error_rate,
+            rate_limit_rate=args.rate_limit_rate,
+            seed=args.seed,
+        )
+    )
+    set_request_scheduler(get_request_scheduler(args))
+    player_class = partial(
+        PLAYER_CLASSES[args.player],
+        response_mode=GuessResponseMode(args.response_mode),
+    )
+    if args.stream:
+        if args.player != "single":
+            raise ValueError("Only the single guess player can stream guesses.")
+        player_class = partial(player_class, stream_guesses=True)
+    if args.score_one_away:
+        if args.player != "solver":
+            raise ValueError("Only the solver player can score one away neighbours.")
+        player_class = partial(player_class, score_one_away=True)
+    runner = AsyncGameRunner(
+        lambda game_id: contextlib.nullcontext(
+            OfflineConnections(game_id, puzzles_file=args.puzzles_file)
+        ),
+        player_class,
+        args.model,
+        None,
+        game_concurrency=args.concurrency,
+        api_concurrency=args.api_concurrency,
+        lookahead=args.lookahead,
+    )
+    game_ids = get_game_ids(args)
+    phase_timings.reset()
+    start = time.perf_counter()
+    output = contextlib.nullcontext() if args.verbose else io.StringIO()
+    with contextlib.redirect_stdout(output):  # type: ignore
+        results = asyncio.run(runner.run_games(game_ids))
+    elapsed_seconds = time.perf_counter() - start
+    return {
+        "commit": get_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": vars(args),
+        "games": len(results),
+        "elapsed_seconds": elapsed_seconds,
+        "games_per_minute": len(results) / elapsed_seconds * 60,
+        "groups_identified": sum(result.groups_identified for result in results),
+        "json_conversion_fallback_rate": guess_parse_stats.get_fallback_rate(),
+        "phases": phase_timings.get_summary(),
+        "metrics": metrics.get_snapshot(),
+    }
+
+
+def save_report(report: dict, output_file: Optional[str]) -> str:
+    """Write the report as JSON, by default to a file named after the commit."""
+    if output_file is None:
+        os.makedirs(BENCHMARK_OUTPUT_FOLDER, exist_ok=True)
+        timestamp = report["timestamp"].replace(":", "")
+        output_file = f"{BENCHMARK_OUTPUT_FOLDER}/{report['commit']}-{timestamp}.json"
+    with open(output_file, "w") as report_file:
+        json.dump(report, report_file, indent=2)
+    return output_file
+
+
+def print_report(report: dict):
+    """Print the headline numbers and the per-phase latencies."""
+    print(
+        f"{report['games']} games in {report['elapsed_seconds']:.2f}s "
+        f"({report['games_per_minute']:.0f} games/minute)"
+    )
+    print(f"{'phase':<45}{'count':>8}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for name, stats in report["phases"].items():
+        print(
+            f"{name:<45}{stats['count']:>8}{stats['p50'] * 1000:>8.1f}ms"
+            f"{stats['p95'] * 1000:>8.1f}ms{stats['p99'] * 1000:>8.1f}ms"
+        )
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """Add the benchmark options to the parser."""
+    parser.add_argument("--games", type=int, default=100, help="games to play")
+    parser.add_argument(
+        "--game-ids", type=int, nargs="*", help="puzzles to cycle through"
+    )
+    parser.add_argument("--puzzles-file", default=PUZZLES_FILE)
+    parser.add_argument("--player", choices=PLAYER_CLASSES, default="single")
+    parser.add_argument(
+        "--response-mode",
+        choices=[mode.value for mode in GuessResponseMode],
+        default=GuessResponseMode.TEXT.value,
+    )
+    parser.add_argument("--stream", action="store_true", help="stream guesses")
+    parser.add_argument(
+        "--score-one-away",
+        action="store_true",
+        help="score one away neighbours in one request, with the solver player",
+    )
+    parser.add_argument("--model", default="gpt-4-1106-preview")
+    parser.add_argument(
+        "--latency", type=float, default=0.5, help="median mock API seconds"
+    )
+    parser.add_argument("--accuracy", type=float, default=0.7)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--api-concurrency", type=int, default=8)
+    parser.add_argument(
+        "--lookahead", type=int, default=0, help="games prepared ahead of play"
+    )
+    add_request_arguments(parser)
+    parser.add_argument("--output", help="report file, by default under output/")
+    parser.add_argument("--verbose", action="store_true", help="show game output")
+
+
+def main(args: argparse.Namespace):
+    report = run_benchmark(args)
+    print_report(report)
+    print(f"Report written to {save_report(report, args.output)}")
+
+
+if __name__ == "__main__":
+    argument_parser = argparse.ArgumentParser(description=__doc__)
+    add_arguments(argument_parser)
+    main(argument_parser.parse_args())
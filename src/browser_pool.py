@@ -0,0 +1,197 @@
+"""Pool of Chrome WebDriver sessions shared by concurrently played live games."""
+
+import atexit
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Optional
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.remote.webdriver import WebDriver
+from connections import Connections
+
+DEFAULT_POOL_SIZE = 4
+DEFAULT_MAX_GAMES_PER_SESSION = 25
+
+
+# Resources the game never needs: images, fonts, media, analytics and ads
+BLOCKED_URL_PATTERNS = [
+    "*.png",
+    "*.jpg",
+    "*.jpeg",
+    "*.gif",
+    "*.webp",
+    "*.ico",
+    "*.woff",
+    "*.woff2",
+    "*.ttf",
+    "*.otf",
+    "*.mp3",
+    "*.mp4",
+    "*.webm",
+    "*google-analytics.com*",
+    "*googletagmanager.com*",
+    "*googlesyndication.com*",
+    "*doubleclick.net*",
+    "*adservice.google.com*",
+    "*facebook.net*",
+    "*hotjar.com*",
+    "*/_vercel/insights/*",
+]
+FAST_BROWSER_ARGUMENTS = [
+    "--blink-settings=imagesEnabled=false",
+    "--disable-extensions",
+    "--disable-background-networking",
+    "--disable-gpu",
+    "--mute-audio",
+    "--no-first-run",
+]
+
+
+def create_browser(headless: bool = True, fast: bool = False) -> WebDriver:
+    """Create a new Chrome browser.
+
+    A fast browser is always headless, blocks BLOCKED_URL_PATTERNS and stops
+    waiting for page loads at DOMContentLoaded, since Connections waits for
+    the word buttons anyway.
+    """
+    options = webdriver.ChromeOptions()
+    if headless or fast:
+        options.add_argument("--headless=new")
+    if fast:
+        options.page_load_strategy = "eager"
+        for argument in FAST_BROWSER_ARGUMENTS:
+            options.add_argument(argument)
+    browser = webdriver.Chrome(options=options)
+    if fast:
+        browser.execute_cdp_cmd("Network.enable", {})
+        browser.execute_cdp_cmd(
+            "Network.setBlockedURLs", {"urls": BLOCKED_URL_PATTERNS}
+        )
+    return browser
+
+
+def is_browser_healthy(browser: WebDriver) -> bool:
+    """Return if the browser still responds to commands."""
+    try:
+        browser.current_url  # pylint: disable=pointless-statement
+        return len(browser.window_handles) > 0
+    except WebDriverException:
+        return False
+
+
+def quit_browser(browser: WebDriver):
+    """Quit the browser, ignoring errors from an already dead session."""
+    try:
+        browser.quit()
+    except WebDriverException:
+        pass
+
+
+class BrowserSession:
+    """Class for representing a browser leased out by the pool."""
+
+    def __init__(self, browser: WebDriver):
+        self.browser = browser
+        self.games_played = 0
+
+
+class BrowserPool:
+    """Class for leasing browser sessions to workers.
+
+    Sessions are created lazily, health checked before every lease, recycled
+    after `max_games_per_session` games, and discarded if a game raises while
+    holding them. All remaining sessions are quit when the process exits.
+    """
+
+    def __init__(
+        self,
+        size: int = DEFAULT_POOL_SIZE,
+        max_games_per_session: int = DEFAULT_MAX_GAMES_PER_SESSION,
+        headless: bool = True,
+        browser_factory: Optional[Callable[[], WebDriver]] = None,
+        fast: bool = False,
+    ):
+        self.size = size
+        self.max_games_per_session = max_games_per_session
+        self.browser_factory = browser_factory or (
+            lambda: create_browser(headless, fast)
+        )
+        # Fast sessions also reuse the app already loaded for the next game
+        self.fast = fast
+        # None marks a free slot that has no browser yet
+        self.idle_sessions: "queue.Queue[Optional[BrowserSession]]" = queue.Queue()
+        for _ in range(size):
+            self.idle_sessions.put(None)
+        self.leased_sessions: List[BrowserSession] = []
+        self.lock = threading.Lock()
+        self.closed = False
+        atexit.register(self.close)
+
+    def acquire(self) -> BrowserSession:
+        """Lease a healthy session, blocking until one is free."""
+        if self.closed:
+            raise RuntimeError("Browser pool is closed.")
+        session = self.idle_sessions.get()
+        try:
+            if session is not None and not is_browser_healthy(session.browser):
+                print("Browser session is unhealthy. Replacing it.")
+                quit_browser(session.browser)
+                session = None
+            if session is None:
+                session = BrowserSession(self.browser_factory())
+        except BaseException:
+            self.idle_sessions.put(None)
+            raise
+        with self.lock:
+            self.leased_sessions.append(session)
+        return session
+
+    def release(self, session: BrowserSession, crashed: bool = False):
+        """Return a leased session to the pool."""
+        with self.lock:
+            self.leased_sessions.remove(session)
+        session.games_played += 1
+        recycle = crashed or session.games_played >= self.max_games_per_session
+        if recycle or self.closed:
+            quit_browser(session.browser)
+            self.idle_sessions.put(None)
+        else:
+            self.idle_sessions.put(session)
+
+    @contextmanager
+    def connections(
+        self, game_id: int, batch_attempts: bool = False
+    ) -> Iterator[Connections]:
+        """Open the given game in a browser leased for the with block.
+
+        The browser is always returned, and is recycled if the block raised or
+        was not exited.
+        """
+        session = self.acquire()
+        crashed = True
+        try:
+            yield Connections(
+                session.browser,
+                game_id,
+                batch_attempts,
+                client_side_navigation=self.fast,
+            )
+            crashed = False
+        finally:
+            self.release(session, crashed)
+
+    def close(self):
+        """Quit every browser in the pool."""
+        self.closed = True
+        with self.lock:
+            sessions = list(self.leased_sessions)
+        while True:
+            try:
+                session = self.idle_sessions.get_nowait()
+            except queue.Empty:
+                break
+            if session is not None:
+                sessions.append(session)
+        for session in sessions:
+            quit_browser(session.browser)
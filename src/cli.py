@@ -0,0 +1,406 @@
+"""Command line interface for playing, benchmarking and reporting on games.
+
+    python src/cli.py run --game-ids 58-152
+    python src/cli.py run --offline --mock --player solver
+    python src/cli.py bench --games 200
+    python src/cli.py replay --game-ids 58-152
+    python src/cli.py regress output/transcripts/gpt-4-1106-preview_single_guess.jsonl
+    python src/cli.py matrix experiments/prompt_comparison.json --processes 4
+    python src/cli.py report --baseline gpt-4/single_guess
+
+Each subcommand imports what it needs when it runs, so offline and mock runs
+never import selenium or openai, and a browser is only started for live games.
+"""
+
+import argparse
+import os
+import sys
+from typing import List, Optional
+
+DEFAULT_MODEL = "gpt-4-1106-preview"
+DEFAULT_GAME_IDS = "58-152"
+PLAYER_NAMES = ["single", "player", "solver", "conversational"]
+# Run names used before the CLI existed. Their results are skipped once imported
+# into results.db with `results_store.py import output` or `report --import-output`.
+DEFAULT_RUN_NAMES = {"single": "single_guess"}
+DEFAULT_OFFLINE_GAME_CONCURRENCY = 16
+METRICS_FILE = "output/metrics.prom"
+
+
+def parse_game_ids(value: str) -> List[int]:
+    """Parse game ids given as ranges and single ids, like `1,5,9-12`."""
+    game_ids: List[int] = []
+    for part in value.split(","):
+        first, _, last = part.partition("-")
+        game_ids.extend(range(int(first), int(last or first) + 1))
+    return game_ids
+
+
+def get_backend_suffix(args: argparse.Namespace) -> str:
+    """Return the suffix of runs played offline or against the mock API.
+
+    Their results are saved apart from those of live runs, so that they are
+    never mixed into the same run.
+    """
+    suffix = "_offline" if args.offline else ""
+    return suffix + ("_mock" if args.mock else "")
+
+
+def get_game_ids(
+    args: argparse.Namespace, default_game_ids: Optional[str] = None
+) -> List[int]:
+    """Return the games to play, checking that offline games have puzzles.
+
+    Without `--game-ids` or other defaults, offline runs play every game in the
+    puzzles file and live runs play DEFAULT_GAME_IDS.
+    """
+    value = args.game_ids or default_game_ids
+    if not args.offline:
+        return parse_game_ids(value or DEFAULT_GAME_IDS)
+    from offline_connections import load_puzzles
+
+    puzzles = load_puzzles(args.puzzles_file)
+    if value is None:
+        return sorted(puzzles)
+    game_ids = parse_game_ids(value)
+    unknown_game_ids = [game_id for game_id in game_ids if game_id not in puzzles]
+    if unknown_game_ids:
+        raise ValueError(f"Games {unknown_game_ids} are not in {args.puzzles_file}.")
+    return game_ids
+
+
+def configure_api(args: argparse.Namespace):
+    """Answer requests with the mock, or set the API key from the environment."""
+    if args.mock:
+        from offline_connections import load_puzzles
+        from utils.mock_openai import MockChatCompletion, lognormal_latency
+        from utils.openai_wrapper import set_chat_completion_backend
+
+        set_chat_completion_backend(
+            MockChatCompletion(
+                load_puzzles(args.puzzles_file),
+                latency=lognormal_latency(args.mock_latency),
+            )
+        )
+        return
+    from dotenv import load_dotenv
+    import openai
+
+    load_dotenv()
+    openai_api_key = os.getenv("OPENAI_API_KEY")
+    if openai_api_key is None:
+        raise Exception("OPENAI_API_KEY environment variable not set.")
+    openai.api_key = openai_api_key
+
+
+def play_games(args: argparse.Namespace, replay: bool = False):
+    """Play the games, calling the API only for responses that are not cached.
+
+    When replaying, every response must come from the journal or the response
+    cache, and no results are saved.
+    """
+    import asyncio
+    from contextlib import nullcontext
+    from functools import partial
+    from ai import GuessResponseMode, guess_parse_stats
+    from async_runner import AsyncGameRunner, ConnectionsFactory
+    from players import PLAYER_CLASSES
+    from prompts.prompts import DEFAULT_PROMPT
+    from results_tracker import ResultsTracker
+    from utils.journal import JOURNAL_FOLDER, Journal
+    from utils.metrics import metrics
+    from utils.openai_wrapper import set_request_scheduler, set_response_cache
+    from utils.request_scheduler import get_request_scheduler
+    from utils.response_cache import (
+        DEFAULT_CACHE_DIRECTORY,
+        MOCK_CACHE_DIRECTORY,
+        ResponseCache,
+    )
+
+    game_ids = get_game_ids(args)
+    if not replay:
+        configure_api(args)
+    set_request_scheduler(get_request_scheduler(args))
+    if replay or not args.no_cache:
+        set_response_cache(
+            ResponseCache(
+                MOCK_CACHE_DIRECTORY if args.mock else DEFAULT_CACHE_DIRECTORY,
+                replay=replay or args.replay_only,
+            )
+        )
+    player_class = partial(
+        PLAYER_CLASSES[args.player],
+        response_mode=GuessResponseMode(args.response_mode),
+        prompt=args.prompt,
+    )
+    if args.player == "single":
+        player_class = partial(player_class, stream_guesses=args.stream)
+    if args.player == "solver":
+        player_class = partial(player_class, score_one_away=args.score_one_away)
+    run_name = args.run_name or DEFAULT_RUN_NAMES.get(args.player, args.player)
+    run_name += get_backend_suffix(args)
+    file_name = f"{args.model}_{run_name}"
+    if args.prompt != DEFAULT_PROMPT:
+        file_name += f"_{args.prompt}"
+    journal: Optional[Journal] = None
+    if replay or not args.no_journal:
+        journal = Journal(f"{JOURNAL_FOLDER}/{file_name}.jsonl")
+    transcripts = None
+    if args.record_transcripts:
+        from utils.transcripts import TRANSCRIPT_FOLDER, TranscriptRecorder
+
+        transcripts = TranscriptRecorder(f"{TRANSCRIPT_FOLDER}/{file_name}.jsonl")
+
+    browser_pool = None
+    create_connections: ConnectionsFactory
+    if args.offline:
+        from offline_connections import OfflineConnections
+
+        def create_offline_connections(game_id: int):
+            return nullcontext(
+                OfflineConnections(game_id, puzzles_file=args.puzzles_file)
+            )
+
+        create_connections = create_offline_connections
+
+        game_concurrency = args.concurrency or DEFAULT_OFFLINE_GAME_CONCURRENCY
+    else:
+        from browser_pool import BrowserPool
+
+        # Games prepared ahead need a browser of their own
+        browser_pool = BrowserPool(
+            args.browsers + args.lookahead,
+            args.games_per_session,
+            fast=args.fast_browser,
+        )
+
+        def create_live_connections(game_id: int):
+            return browser_pool.connections(game_id, args.batch_attempts)
+
+        create_connections = create_live_connections
+
+        game_concurrency = args.concurrency or args.browsers
+
+    runner = AsyncGameRunner(
+        create_connections,
+        player_class,
+        args.model,
+        None if replay else ResultsTracker(run_name, args.model, args.prompt),
+        game_concurrency=game_concurrency,
+        api_concurrency=args.api_concurrency,
+        journal=journal,
+        lookahead=args.lookahead,
+        transcripts=transcripts,
+    )
+    try:
+        if args.queue:
+            from work_queue import WorkQueue
+
+            work_queue = WorkQueue(
+                (run_name, args.model, args.prompt),
+                lease_seconds=args.lease_seconds,
+            )
+            work_queue.add_games(game_ids)
+            results = asyncio.run(runner.run_queued_games(work_queue))
+            print(f"Work queue: {work_queue.get_counts()}")
+        else:
+            results = asyncio.run(runner.run_games(game_ids))
+        groups_identified = sum(result.groups_identified for result in results)
+        print(f"Played {len(results)} games, identified {groups_identified} groups")
+        print(f"Guess parsing: {guess_parse_stats}")
+        if runner.failed_games:
+            print(f"Failed games: {sorted(runner.failed_games)}")
+    finally:
+        if journal is not None:
+            journal.close()
+        if browser_pool is not None:
+            browser_pool.close()
+        metrics_directory = os.path.dirname(args.metrics_file)
+        if metrics_directory:
+            os.makedirs(metrics_directory, exist_ok=True)
+        metrics.write_prometheus(args.metrics_file)
+
+
+def run(args: argparse.Namespace):
+    play_games(args)
+
+
+def replay(args: argparse.Namespace):
+    if args.queue:
+        raise ValueError("Replays play every game, so they take no work queue.")
+    play_games(args, replay=True)
+
+
+def bench(args: argparse.Namespace):
+    import benchmark
+
+    benchmark.main(args)
+
+
+def regress(args: argparse.Namespace):
+    import regression
+
+    regression.main(args)
+
+
+def matrix(args: argparse.Namespace):
+    import experiments
+
+    experiments.main(args)
+
+
+def report(args: argparse.Namespace):
+    import analytics
+    from results_store import ResultsStore
+
+    if args.import_output is not None:
+        store = ResultsStore(args.database)
+        for folder_name, count in store.import_output(args.import_output).items():
+            print(f"Imported {count} results from {folder_name}")
+    analytics.main(args)
+
+
+def add_play_arguments(parser: argparse.ArgumentParser):
+    """Add the options shared by run and replay."""
+    from offline_connections import PUZZLES_FILE
+    from prompts.prompts import DEFAULT_PROMPT, PROMPTS
+    from utils.request_scheduler import add_arguments as add_request_arguments
+    from work_queue import DEFAULT_LEASE_SECONDS
+
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--run-name", help="name results are saved under")
+    parser.add_argument("--player", choices=PLAYER_NAMES, default="single")
+    parser.add_argument("--prompt", choices=PROMPTS, default=DEFAULT_PROMPT)
+    parser.add_argument(
+        "--response-mode", choices=["text", "structured"], default="text"
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="attempt each guess as soon as it is streamed in",
+    )
+    parser.add_argument(
+        "--score-one-away",
+        action="store_true",
+        help="have the solver player score every one-swap neighbour of a one away"
+        " attempt in one request",
+    )
+    parser.add_argument(
+        "--game-ids",
+        help=f"ids and ranges, like 1,5,9-12. By default {DEFAULT_GAME_IDS}, or"
+        " every game in the puzzles file when offline",
+    )
+    parser.add_argument(
+        "--offline", action="store_true", help="play the puzzles file, not the site"
+    )
+    parser.add_argument("--puzzles-file", default=PUZZLES_FILE)
+    parser.add_argument(
+        "--mock", action="store_true", help="answer requests with the mock API"
+    )
+    parser.add_argument("--mock-latency", type=float, default=2.0)
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        help="games played at once, by default one per browser",
+    )
+    parser.add_argument("--api-concurrency", type=int, default=8)
+    parser.add_argument(
+        "--lookahead",
+        type=int,
+        default=0,
+        help="games to load and send the first request for ahead of playing",
+    )
+    parser.add_argument("--browsers", type=int, default=1)
+    parser.add_argument("--games-per-session", type=int, default=25)
+    parser.add_argument(
+        "--fast-browser",
+        action="store_true",
+        help="block unneeded resources and switch games without reloading",
+    )
+    parser.add_argument(
+        "--batch-attempts",
+        action="store_true",
+        help="click every word of an attempt in one script",
+    )
+    add_request_arguments(parser)
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument(
+        "--replay-only",
+        action="store_true",
+        help="fail instead of calling the API on a cache miss",
+    )
+    parser.add_argument("--no-journal", action="store_true")
+    parser.add_argument(
+        "--queue",
+        action="store_true",
+        help="claim games from the queue in the results database, shared by"
+        " every worker playing the same run and model",
+    )
+    parser.add_argument("--lease-seconds", type=float, default=DEFAULT_LEASE_SECONDS)
+    parser.add_argument(
+        "--record-transcripts",
+        action="store_true",
+        help="save every finished game for replaying with regress",
+    )
+    parser.add_argument("--metrics-file", default=METRICS_FILE)
+
+
+def get_argument_parser() -> argparse.ArgumentParser:
+    """Return the parser for every subcommand."""
+    import benchmark
+    import experiments
+    import regression
+    from results_store import RESULTS_DATABASE_FILE
+
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run", help="play games")
+    add_play_arguments(run_parser)
+    replay_parser = subparsers.add_parser(
+        "replay", help="play games again from the journal and cache, without the API"
+    )
+    add_play_arguments(replay_parser)
+    bench_parser = subparsers.add_parser(
+        "bench", help="benchmark games against the mock API"
+    )
+    benchmark.add_arguments(bench_parser)
+    regress_parser = subparsers.add_parser(
+        "regress", help="replay recorded games against the current code"
+    )
+    regression.add_arguments(regress_parser)
+    matrix_parser = subparsers.add_parser(
+        "matrix", help="play every combination of models, prompts and players"
+    )
+    experiments.add_arguments(matrix_parser)
+    report_parser = subparsers.add_parser("report", help="compare saved runs")
+    report_parser.add_argument("--database", default=RESULTS_DATABASE_FILE)
+    report_parser.add_argument("--baseline", help="run to compare against")
+    report_parser.add_argument("--samples", type=int, default=10000)
+    report_parser.add_argument("--confidence", type=float, default=0.95)
+    report_parser.add_argument(
+        "--import-output",
+        metavar="FOLDER",
+        help="import per-game CSV folders from an older version first",
+    )
+    return parser
+
+
+COMMANDS = {
+    "run": run,
+    "replay": replay,
+    "bench": bench,
+    "regress": regress,
+    "matrix": matrix,
+    "report": report,
+}
+
+
+def main(argv: Optional[List[str]] = None):
+    args = get_argument_parser().parse_args(argv)
+    COMMANDS[args.command](args)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
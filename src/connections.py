@@ -1,99 +1,454 @@
 """Module for interacting with the Connections game via Selenium."""
 
+import json
 import time
-from typing import Dict, Set
+from typing import Dict, List, Optional, Set
+from urllib.parse import urlparse
 from selenium.webdriver.remote.webdriver import WebDriver
 from selenium.webdriver.remote.webelement import WebElement
 from selenium.webdriver.common.by import By
 from game_state import AttemptResultStatus
+from offline_connections import Puzzle, PuzzleGroup
+from utils.metrics import record_browser_wait, record_page_load
+from utils.timing import LatencyRecorder, timed
 
 URL_PREFIX = "https://connections.swellgarfo.com/nyt/"
-SECONDS_TO_WAIT_AFTER_CLICK = 0.3
 VALID_WORDS_PARENT_CLASS_PREFIX = "HomePage_words-wrap"
+CORRECT_ANSWERS_CLASS_SUBSTRING = "HomePage_correct-answers-wrap"
+TOASTIFY_CLASS_SUBSTRING = "Toastify"
+# Matched case-insensitively, since only its content is compared
+MISTAKES_CLASS_SUBSTRING = "mistakes"
+
+# Timeouts for each wait. The waits return as soon as their condition holds.
+SECONDS_TO_WAIT_FOR_PAGE_LOAD = 10
+SECONDS_TO_WAIT_FOR_CLIENT_NAVIGATION = 5
+SECONDS_TO_WAIT_FOR_WORD_SELECTED = 0.3
+SECONDS_TO_WAIT_FOR_SUBMIT_OUTCOME = 0.5
+# Further wait when a submit showed no outcome, though mistakes are shown
+SECONDS_TO_WAIT_FOR_LATE_SUBMIT_OUTCOME = 2
+SECONDS_TO_WAIT_FOR_TOAST_HIDDEN = 5
+
+# Resolves once the condition, evaluated after every DOM mutation, is true or
+# resolves false when the timeout elapses.
+WAIT_FOR_CONDITION_SCRIPT = """
+const [conditionBody, timeoutMs, args] = arguments;
+const done = arguments[arguments.length - 1];
+const condition = new Function("args", conditionBody);
+const check = () => { try { return condition(args); } catch (e) { return false; } };
+if (check()) { done(true); return; }
+let timer = null;
+const observer = new MutationObserver(() => {
+    if (!check()) return;
+    observer.disconnect();
+    clearTimeout(timer);
+    done(true);
+});
+observer.observe(document, { childList: true, subtree: true, attributes: true });
+timer = setTimeout(() => { observer.disconnect(); done(check()); }, timeoutMs);
+"""
+WORD_BUTTONS_SELECTOR = f"div[class^='{VALID_WORDS_PARENT_CLASS_PREFIX}'] > button"
+WORD_BUTTONS_RENDERED_CONDITION = (
+    f"return document.querySelectorAll(\"{WORD_BUTTONS_SELECTOR}\").length > 0;"
+)
+CLASS_CHANGED_CONDITION = "return args[0].className !== args[1];"
+MISTAKES_SELECTOR = f"div[class*='{MISTAKES_CLASS_SUBSTRING}' i]"
+# Holds once a group was formed, a toast shows or the mistakes shown changed
+SUBMIT_OUTCOME_CONDITION = f"""
+const correct = document.querySelector("div[class*='{CORRECT_ANSWERS_CLASS_SUBSTRING}']");
+const toast = document.querySelector("div[class*='{TOASTIFY_CLASS_SUBSTRING}']");
+const mistakes = document.querySelector("{MISTAKES_SELECTOR}");
+return correct.children.length !== args[0] || toast.children.length > 0
+    || (mistakes ? mistakes.innerHTML : null) !== args[1];
+"""
+# Reads the word buttons, the number of correct groups, whether a toast is
+# showing and the mistakes shown in a single WebDriver round trip.
+SNAPSHOT_SCRIPT = f"""
+const buttons = document.querySelectorAll("{WORD_BUTTONS_SELECTOR}");
+const correct = document.querySelector("div[class*='{CORRECT_ANSWERS_CLASS_SUBSTRING}']");
+const toast = document.querySelector("div[class*='{TOASTIFY_CLASS_SUBSTRING}']");
+const mistakes = document.querySelector("{MISTAKES_SELECTOR}");
+return {{
+    words: Array.from(buttons, (button) => [button.innerText.trim(), button]),
+    correct: correct ? correct.children.length : 0,
+    toast: toast ? toast.children.length > 0 : false,
+    mistakes: mistakes ? mistakes.innerHTML : null,
+}};
+"""
+# Clicks the word buttons and submit inside the page, waits for the outcome
+# and resolves with a snapshot, so a whole attempt is one round trip. If the
+# page throws, resolves with the error instead, so the attempt fails at once
+# rather than when the script times out.
+BATCHED_ATTEMPT_SCRIPT = """
+const [buttons, submit, outcomeBody, snapshotBody, args, timeoutMs] = arguments;
+const done = arguments[arguments.length - 1];
+const outcome = new Function("args", outcomeBody);
+const snapshot = new Function(snapshotBody);
+const nextTick = () => new Promise((resolve) => setTimeout(resolve, 0));
+const waitForOutcome = () => new Promise((resolve, reject) => {
+    if (outcome(args)) { resolve(); return; }
+    let timer = null;
+    const observer = new MutationObserver(() => {
+        try {
+            if (!outcome(args)) return;
+        } catch (error) {
+            observer.disconnect();
+            clearTimeout(timer);
+            reject(error);
+            return;
+        }
+        observer.disconnect();
+        clearTimeout(timer);
+        resolve();
+    });
+    observer.observe(document, { childList: true, subtree: true, attributes: true });
+    timer = setTimeout(() => { observer.disconnect(); resolve(); }, timeoutMs);
+});
+(async () => {
+    for (const button of buttons) {
+        button.click();
+        await nextTick();
+    }
+    submit.click();
+    await waitForOutcome();
+    done(snapshot());
+})().catch((error) => done({ error: String(error) }));
+"""
+# Navigates the loaded Next.js app to another game without reloading the page.
+# Resolves true once that game's words have replaced the previous ones with no
+# groups solved, or false if the app could not be reused.
+CLIENT_NAVIGATION_SCRIPT = f"""
+const [path, timeoutMs] = arguments;
+const done = arguments[arguments.length - 1];
+const router = window.next && window.next.router;
+if (!router) {{ done(false); return; }}
+const getWords = () => Array.from(
+    document.querySelectorAll("{WORD_BUTTONS_SELECTOR}"),
+    (button) => button.innerText.trim(),
+).sort().join(",");
+const getCorrect = () => {{
+    const correct = document.querySelector("div[class*='{CORRECT_ANSWERS_CLASS_SUBSTRING}']");
+    return correct ? correct.children.length : -1;
+}};
+const previousWords = getWords();
+const isGameLoaded = () => location.pathname === path && getWords() !== ""
+    && getWords() !== previousWords && getCorrect() === 0;
+let timer = null;
+const finish = (loaded) => {{
+    observer.disconnect();
+    clearTimeout(timer);
+    done(loaded);
+}};
+const observer = new MutationObserver(() => {{ if (isGameLoaded()) finish(true); }});
+observer.observe(document, {{ childList: true, subtree: true, attributes: true }});
+timer = setTimeout(() => finish(isGameLoaded()), timeoutMs);
+router.push(path).catch(() => finish(false));
+"""
+# Returns the props of the page being shown as JSON. The router's copy follows
+# client side navigation, while __NEXT_DATA__ only holds the first page's.
+PAGE_DATA_SCRIPT = """
+const router = window.next && window.next.router;
+const component = router && router.components && router.components[router.route];
+if (component && component.props) return JSON.stringify(component.props);
+const data = document.getElementById("__NEXT_DATA__");
+return data ? data.textContent : null;
+"""
+TOAST_HIDDEN_CONDITION = f"""
+const toast = document.querySelector("div[class*='{TOASTIFY_CLASS_SUBSTRING}']");
+return toast.children.length === 0;
+"""
+
+
+class GameSnapshot:
+    """Class for representing the state of the game page at one moment."""
+
+    def __init__(
+        self,
+        words_to_button_elements: Dict[str, WebElement],
+        number_of_correct_groups: int,
+        is_toast_visible: bool,
+        mistakes: Optional[str] = None,
+    ):
+        self.words_to_button_elements = words_to_button_elements
+        self.number_of_correct_groups = number_of_correct_groups
+        self.is_toast_visible = is_toast_visible
+        # Markup of the mistakes remaining, or None if the page shows none
+        self.mistakes = mistakes
+
+    def has_outcome_since(self, before: "GameSnapshot") -> bool:
+        """Determine if the page shows the outcome of a submit made after before."""
+        return (
+            self.number_of_correct_groups != before.number_of_correct_groups
+            or self.is_toast_visible
+            or self.mistakes != before.mistakes
+        )
 
 
 class Connections:
     """Class for interacting with the Connections game via Selenium."""
 
-    def __init__(self, browser: WebDriver, game_id: int):
+    def __init__(
+        self,
+        browser: WebDriver,
+        game_id: int,
+        batch_attempts: bool = False,
+        client_side_navigation: bool = False,
+    ):
         self.browser = browser
+        self.game_id = game_id
+        # Select the words and submit in one in-page script instead of
+        # one WebDriver command per click
+        self.batch_attempts = batch_attempts
+        # Switch games inside the app already loaded in the tab, falling back
+        # to loading the page if that does not work
+        self.client_side_navigation = client_side_navigation
+        self.wait_latencies = LatencyRecorder()
+        self.page_load_seconds = 0.0
+        self.browser.set_script_timeout(SECONDS_TO_WAIT_FOR_PAGE_LOAD + 1)
         self.__navigate_to_game(game_id)
         self.__load_buttons()
 
+    @timed("connections.navigate")
     def __navigate_to_game(self, game_id: int):
-        url = get_game_url(game_id)
-        self.browser.get(url)
-        # TODO: replace this by a wait for the page to load
-        time.sleep(3)
+        start = time.perf_counter()
+        navigation = "client"
+        if not (self.client_side_navigation and self.__navigate_in_app(game_id)):
+            navigation = "full"
+            self.browser.get(get_game_url(game_id))
+            loaded = self.__wait_for(
+                "page_load",
+                WORD_BUTTONS_RENDERED_CONDITION,
+                SECONDS_TO_WAIT_FOR_PAGE_LOAD,
+            )
+            if not loaded:
+                raise TimeoutError(f"Game {game_id} did not load in time.")
+        self.page_load_seconds = time.perf_counter() - start
+        record_page_load(self.page_load_seconds, navigation)
+        print(
+            f"Game {game_id} loaded in {self.page_load_seconds:.2f}s "
+            f"({navigation} navigation)"
+        )
+
+    def __navigate_in_app(self, game_id: int) -> bool:
+        """Navigate the app loaded in the tab to the game, returning if it did."""
+        if not self.browser.current_url.startswith(URL_PREFIX):
+            return False
+        start = time.perf_counter()
+        try:
+            return bool(
+                self.browser.execute_async_script(
+                    CLIENT_NAVIGATION_SCRIPT,
+                    get_game_path(game_id),
+                    int(SECONDS_TO_WAIT_FOR_CLIENT_NAVIGATION * 1000),
+                )
+            )
+        finally:
+            self.__record_wait("client_navigation", time.perf_counter() - start)
+
+    def __wait_for(self, name: str, condition: str, timeout: float, *args) -> bool:
+        """Wait until the JS condition holds, recording how long it took."""
+        start = time.perf_counter()
+        try:
+            return bool(
+                self.browser.execute_async_script(
+                    WAIT_FOR_CONDITION_SCRIPT, condition, int(timeout * 1000), args
+                )
+            )
+        finally:
+            self.__record_wait(name, time.perf_counter() - start)
+
+    def __record_wait(self, name: str, seconds: float):
+        self.wait_latencies.record(name, seconds)
+        record_browser_wait(seconds)
 
     def __load_buttons(self):
         self.words_to_button_elements: Dict[str, WebElement] = {}
-        for button in self.browser.find_elements(By.CSS_SELECTOR, "button"):
-            if not is_button_word_for_game(button):
-                continue
-            self.words_to_button_elements[button.text] = button
+        self.__update_word_buttons(self.get_snapshot())
         self.submit_button = get_button_with_text(self.browser, "Submit")
-        self.clear_button = get_button_with_text(self.browser, "Clear")
-        self.toastify = get_div_with_class_substring(self.browser, "Toastify")
-
-    def __is_one_away_message_visible(self):
-        # return if toastify has children
-        is_visible = len(self.toastify.find_elements(By.XPATH, "./*")) > 0
-        # if its visible, wait for it to disappear
-        if not is_visible:
-            return False
-        while len(self.toastify.find_elements(By.XPATH, "./*")) > 0:
-            time.sleep(0.5)
-        return True
 
+    def __update_word_buttons(self, snapshot: GameSnapshot):
+        """Replace the word to button map with the snapshot's.
+
+        Every element is taken from the snapshot, since the grid is rendered
+        again after each attempt and earlier elements may be stale.
+        """
+        self.words_to_button_elements = dict(snapshot.words_to_button_elements)
+
+    def __wait_for_toast_to_hide(self):
+        self.__wait_for(
+            "toast_hidden", TOAST_HIDDEN_CONDITION, SECONDS_TO_WAIT_FOR_TOAST_HIDDEN
+        )
+
+    def get_snapshot(self) -> GameSnapshot:
+        """Read the words, correct groups and toast state in one round trip."""
+        return parse_snapshot(self.browser.execute_script(SNAPSHOT_SCRIPT))
+
+    def __attempt_group_batched(
+        self, words: Set[str], before: GameSnapshot
+    ) -> GameSnapshot:
+        """Click the words and submit in one script, returning the outcome."""
+        buttons = [self.words_to_button_elements[word] for word in words]
+        start = time.perf_counter()
+        try:
+            snapshot = self.browser.execute_async_script(
+                BATCHED_ATTEMPT_SCRIPT,
+                buttons,
+                self.submit_button,
+                SUBMIT_OUTCOME_CONDITION,
+                SNAPSHOT_SCRIPT,
+                [before.number_of_correct_groups, before.mistakes],
+                int(SECONDS_TO_WAIT_FOR_SUBMIT_OUTCOME * 1000),
+            )
+        finally:
+            self.__record_wait("batched_attempt", time.perf_counter() - start)
+        if "error" in snapshot:
+            raise RuntimeError(f"Batched attempt failed: {snapshot['error']}")
+        return parse_snapshot(snapshot)
+
+    def __attempt_group_by_clicking(
+        self, words: Set[str], before: GameSnapshot
+    ) -> GameSnapshot:
+        """Click the words and submit one WebDriver command at a time."""
+        for word in words:
+            self.__click_word(self.words_to_button_elements[word])
+        self.submit_button.click()
+        self.__wait_for_submit_outcome(
+            "submit_outcome", SECONDS_TO_WAIT_FOR_SUBMIT_OUTCOME, before
+        )
+        return self.get_snapshot()
+
+    def __click_word(self, word_button: WebElement):
+        class_before_click = word_button.get_attribute("class")
+        word_button.click()
+        self.__wait_for(
+            "word_selected",
+            CLASS_CHANGED_CONDITION,
+            SECONDS_TO_WAIT_FOR_WORD_SELECTED,
+            word_button,
+            class_before_click,
+        )
+
+    def __wait_for_submit_outcome(
+        self, name: str, timeout: float, before: GameSnapshot
+    ) -> bool:
+        return self.__wait_for(
+            name,
+            SUBMIT_OUTCOME_CONDITION,
+            timeout,
+            before.number_of_correct_groups,
+            before.mistakes,
+        )
+
+    def __get_late_outcome(self, before: GameSnapshot) -> GameSnapshot:
+        """Return a fresh snapshot after a submit that showed no outcome in time.
+
+        If the page shows mistakes, a wrong guess changes them, so no outcome
+        at all means the page is slow and is waited for a while longer.
+        """
+        if before.mistakes is not None:
+            self.__wait_for_submit_outcome(
+                "late_submit_outcome", SECONDS_TO_WAIT_FOR_LATE_SUBMIT_OUTCOME, before
+            )
+        return self.get_snapshot()
+
+    def read_puzzle(self) -> Optional[Puzzle]:
+        """Read the game's solution from the page data, without playing it.
+
+        Returns None if the page data has no groups matching the words shown.
+        """
+        page_data = self.browser.execute_script(PAGE_DATA_SCRIPT)
+        if page_data is None:
+            return None
+        groups = find_puzzle_groups(json.loads(page_data))
+        if groups is None:
+            return None
+        puzzle = Puzzle(self.game_id, groups)
+        if puzzle.get_words() != self.get_remaining_words():
+            return None
+        return puzzle
+
+    @timed("connections.get_remaining_words")
     def get_remaining_words(self) -> Set[str]:
         """Parse the webpage to get the remaining words in the game."""
-        buttons = self.browser.find_elements(By.CSS_SELECTOR, "button")
-
-        remaining_words = set()
-        for button in buttons:
-            if not is_button_word_for_game(button):
-                continue
-            remaining_words.add(button.text)
-            self.words_to_button_elements[button.text] = button
-        return remaining_words
+        snapshot = self.get_snapshot()
+        self.__update_word_buttons(snapshot)
+        return set(snapshot.words_to_button_elements)
 
     def get_number_of_correct_groups(self) -> int:
         """Parse the webpage to get the number of correct groups."""
-        correct_div = get_div_with_class_substring(
-            self.browser, "HomePage_correct-answers-wrap"
-        )
-        # return number of children of correct_div
-        return len(correct_div.find_elements(By.XPATH, "./*"))
+        return self.get_snapshot().number_of_correct_groups
 
+    @timed("connections.attempt_group")
     def attempt_group(self, words: Set[str]) -> AttemptResultStatus:
         """Attempt to group the given words."""
         if len(words) != 4:
             return AttemptResultStatus.FAILURE
-        current_number_of_correct_groups = self.get_number_of_correct_groups()
-        for word in words:
-            if word not in self.words_to_button_elements:
-                return AttemptResultStatus.FAILURE
-            word_button = self.words_to_button_elements[word]
-            word_button.click()
-            del self.words_to_button_elements[word]
-            wait_after_click()
-        self.submit_button.click()
-        wait_after_click()
-        if self.__is_one_away_message_visible():
+        if not words <= self.words_to_button_elements.keys():
+            return AttemptResultStatus.FAILURE
+        before = self.get_snapshot()
+        if self.batch_attempts:
+            snapshot = self.__attempt_group_batched(words, before)
+        else:
+            snapshot = self.__attempt_group_by_clicking(words, before)
+        if not snapshot.has_outcome_since(before):
+            snapshot = self.__get_late_outcome(before)
+        self.__update_word_buttons(snapshot)
+        if snapshot.is_toast_visible:
+            self.__wait_for_toast_to_hide()
             return AttemptResultStatus.ONE_AWAY
-        new_number_of_correct_groups = self.get_number_of_correct_groups()
         new_group_formed = (
-            new_number_of_correct_groups > current_number_of_correct_groups
+            snapshot.number_of_correct_groups > before.number_of_correct_groups
         )
         if new_group_formed:
             return AttemptResultStatus.SUCCESS
         return AttemptResultStatus.FAILURE
 
 
-def wait_after_click() -> None:
-    """Wait for a bit after clicking a button."""
-    time.sleep(SECONDS_TO_WAIT_AFTER_CLICK)
+def parse_snapshot(snapshot: dict) -> GameSnapshot:
+    """Convert the result of SNAPSHOT_SCRIPT into a GameSnapshot."""
+    return GameSnapshot(
+        {word: button for word, button in snapshot["words"]},
+        snapshot["correct"],
+        snapshot["toast"],
+        snapshot.get("mistakes"),
+    )
+
+
+def get_puzzle_group(value) -> Optional[PuzzleGroup]:
+    """Return the group if the value is an object with a theme and 4 words."""
+    if not isinstance(value, dict):
+        return None
+    words = next(
+        (
+            item
+            for item in value.values()
+            if isinstance(item, list)
+            and len(item) == 4
+            and all(isinstance(word, str) for word in item)
+        ),
+        None,
+    )
+    theme = next((item for item in value.values() if isinstance(item, str)), "")
+    if words is None:
+        return None
+    return PuzzleGroup(set(words), theme)
+
+
+def find_puzzle_groups(value) -> Optional[List[PuzzleGroup]]:
+    """Find the first list of 4 groups of 4 words anywhere in the page data."""
+    if isinstance(value, list):
+        groups = [get_puzzle_group(item) for item in value]
+        if len(groups) == 4 and all(group is not None for group in groups):
+            return groups  # type: ignore
+        items = value
+    elif isinstance(value, dict):
+        items = list(value.values())
+    else:
+        return None
+    for item in items:
+        groups = find_puzzle_groups(item)
+        if groups is not None:
+            return groups
+    return None
 
 
 def get_game_url(game_id: int) -> str:
@@ -101,13 +456,9 @@ def get_game_url(game_id: int) -> str:
     return f"{URL_PREFIX}{game_id}"
 
 
-def is_button_word_for_game(button: WebElement) -> bool:
-    """Return if the given button is a button for a word for the game."""
-    parent = button.find_element(By.XPATH, "..")
-    parent_class = parent.get_attribute("class")
-    if parent_class is None:
-        return False
-    return parent_class.startswith(VALID_WORDS_PARENT_CLASS_PREFIX)
+def get_game_path(game_id: int) -> str:
+    """Get the path of the game's url, as the app's router expects it."""
+    return urlparse(get_game_url(game_id)).path
 
 
 def get_button_with_text(browser: WebDriver, text: str):
@@ -115,10 +466,3 @@ def get_button_with_text(browser: WebDriver, text: str):
     text_div = browser.find_element(By.XPATH, f"//div[text()='{text}']")
     # get closest parent to this div that is a button
     return text_div.find_element(By.XPATH, "ancestor::button")
-
-
-def get_div_with_class_substring(browser: WebDriver, class_substring: str):
-    """Get the div with the given class substring."""
-    return browser.find_element(
-        By.XPATH, f"//div[contains(@class, '{class_substring}')]"
-    )
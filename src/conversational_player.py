@@ -0,0 +1,102 @@
+""" Player which keeps one chat with the AI for the whole game of Connections """
+
+import asyncio
+from typing import List, Set
+from game_types.game_types import AttemptResultStatus, ConnectionsBackend
+from game import Game
+from ai import AI, AIGuess, GuessResponseMode
+from prompts.prompts import DEFAULT_PROMPT
+from results_tracker import GameResult
+from utils.attempt_utils import get_game_over_message, get_number_of_correct_groups
+from utils.metrics import GameMetrics, record_game_result, track_game
+
+
+class ConversationalPlayer:
+    """Attempts the AI's groups until one is wrong, then reports back in the chat.
+
+    Every request starts with the same system prompt and word list, and only
+    appends the results of the attempts made since the previous response, so
+    the provider can reuse the cached prefix.
+    """
+
+    def __init__(
+        self,
+        game_id: int,
+        connections: ConnectionsBackend,
+        model: str,
+        response_mode: GuessResponseMode = GuessResponseMode.TEXT,
+        prompt: str = DEFAULT_PROMPT,
+    ):
+        self.game = Game(game_id, connections)
+        self.model = model
+        self.response_mode = response_mode
+        self.prompt = prompt
+        self.ai = AI(self.game.get_game_state(), model, response_mode, prompt)
+        self.ai_guesses: List[AIGuess] = []
+
+    def play_turn(self):
+        self.__print_turn_header()
+        if len(self.ai_guesses) == 0:
+            self.__set_guesses(self.ai.continue_conversation())
+        self.__attempt_guess(self.__get_guess())
+
+    async def play_turn_async(self):
+        self.__print_turn_header()
+        if len(self.ai_guesses) == 0:
+            self.__set_guesses(await self.ai.continue_conversation_async())
+        await asyncio.to_thread(self.__attempt_guess, self.__get_guess())
+
+    def __print_turn_header(self):
+        print(f"====Player turn {self.game.get_game_state().get_turn_number()}====")
+        print(self.game.get_game_state())
+
+    def __set_guesses(self, ai_guesses: List[AIGuess]):
+        print("==AI guess==")
+        for guess in ai_guesses:
+            print(guess)
+        self.ai_guesses = ai_guesses
+
+    def __get_guess(self) -> Set[str]:
+        ai_guess = self.ai_guesses[0]
+        self.ai_guesses = self.ai_guesses[1:]
+        return ai_guess.get_words()
+
+    def __attempt_guess(self, guess: Set[str]):
+        print("==Connections Result==")
+        result = self.game.attempt_group(guess)
+        print(result.pretty_str(), "\n\n")
+        # The rest of the response was made without knowing this was wrong
+        if result.result != AttemptResultStatus.SUCCESS:
+            self.ai_guesses = []
+
+    def play_game(self) -> GameResult:
+        game_state = self.game.get_game_state()
+        with track_game(type(self).__name__, self.model) as game_metrics:
+            while not game_state.is_game_over():
+                self.play_turn()
+        return self.__get_game_result(game_metrics)
+
+    async def play_game_async(self) -> GameResult:
+        game_state = self.game.get_game_state()
+        with track_game(type(self).__name__, self.model) as game_metrics:
+            while not game_state.is_game_over():
+                await self.play_turn_async()
+        return self.__get_game_result(game_metrics)
+
+    def __get_game_result(self, game_metrics: GameMetrics) -> GameResult:
+        game_state = self.game.get_game_state()
+        game_over_message = get_game_over_message(
+            game_state.get_game_id(),
+            game_state.get_attempts(),
+            game_state.get_game_status(),
+        )
+        print(game_over_message)
+        groups_identified = get_number_of_correct_groups(game_state.get_attempts())
+        total_attempts = len(game_state.get_attempts())
+        record_game_result(game_metrics, groups_identified, total_attempts)
+        return GameResult(
+            game_state.get_game_id(),
+            groups_identified,
+            total_attempts,
+            game_metrics.get_as_dict(),
+        )
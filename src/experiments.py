@@ -0,0 +1,355 @@
+"""Run an experiment matrix of models, prompts, players and response modes.
+
+A matrix file names the games to play and the values to try on each axis:
+
+    {
+        "name": "prompt_comparison",
+        "game_ids": "58-152",
+        "models": ["gpt-4", "gpt-4-1106-preview"],
+        "prompts": ["default", "v2"],
+        "players": ["player", "single"],
+        "response_modes": ["text"]
+    }
+
+Every combination is a cell, saved in the results database under the run
+`<name>_<player>_<response mode>` with its model and prompt. Work is
+scheduled a puzzle at a time across a pool of processes. The worker loads the
+puzzle once, from the site or the puzzles file, and plays every cell on it
+concurrently, so a live matrix costs one page load per puzzle, not per cell.
+
+    python src/cli.py matrix experiments/prompt_comparison.json --processes 4
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+from ai import GuessResponseMode
+from async_runner import AsyncGameRunner, ConnectionsFactory
+from cli import configure_api, get_backend_suffix, get_game_ids
+from offline_connections import PUZZLES_FILE, OfflineConnections, Puzzle, load_puzzle
+from players import PLAYER_CLASSES
+from prompts.prompts import DEFAULT_PROMPT, PROMPTS
+from results_store import RESULTS_DATABASE_FILE, ResultKey, ResultsStore
+from results_tracker import GameResult, ResultsTracker
+from utils.openai_wrapper import (
+    api_semaphore,
+    set_request_scheduler,
+    set_response_cache,
+)
+from utils.request_scheduler import add_arguments as add_request_arguments
+from utils.request_scheduler import get_request_scheduler
+from utils.response_cache import (
+    DEFAULT_CACHE_DIRECTORY,
+    MOCK_CACHE_DIRECTORY,
+    ResponseCache,
+)
+
+if TYPE_CHECKING:
+    from browser_pool import BrowserPool
+
+DEFAULT_GAME_CONCURRENCY = 16
+
+
+class ExperimentCell:
+    """Class for representing one combination of the matrix's values."""
+
+    def __init__(self, model: str, prompt: str, player: str, response_mode: str):
+        self.model = model
+        self.prompt = prompt
+        self.player = player
+        self.response_mode = response_mode
+
+    def get_result_key(self, name: str) -> ResultKey:
+        """Return the key the cell's results are saved under."""
+        run = f"{name}_{self.player}_{self.response_mode}"
+        return (run, self.model, self.prompt)
+
+    def __str__(self):
+        return f"{self.model}/{self.prompt}/{self.player}/{self.response_mode}"
+
+
+class ExperimentMatrix:
+    """Class for representing the values to try on each axis of an experiment."""
+
+    def __init__(
+        self,
+        name: str,
+        game_ids: str,
+        models: List[str],
+        prompts: List[str],
+        players: List[str],
+        response_modes: List[str],
+    ):
+        for values, choices in (
+            (prompts, PROMPTS),
+            (players, PLAYER_CLASSES),
+            (response_modes, [mode.value for mode in GuessResponseMode]),
+        ):
+            unknown = [value for value in values if value not in choices]
+            if unknown:
+                raise ValueError(
+                    f"Unknown values {unknown}, expected one of {list(choices)}."
+                )
+        self.name = name
+        self.game_ids = game_ids
+        self.models = models
+        self.prompts = prompts
+        self.players = players
+        self.response_modes = response_modes
+
+    @staticmethod
+    def from_file(file_name: str) -> "ExperimentMatrix":
+        """Load the matrix from a JSON file."""
+        with open(file_name, "r") as matrix_file:
+            json_object = json.load(matrix_file)
+        return ExperimentMatrix(
+            json_object["name"],
+            json_object["game_ids"],
+            json_object["models"],
+            json_object.get("prompts", [DEFAULT_PROMPT]),
+            json_object.get("players", ["single"]),
+            json_object.get("response_modes", [GuessResponseMode.TEXT.value]),
+        )
+
+    def get_cells(self) -> List[ExperimentCell]:
+        """Return every combination of the values."""
+        return [
+            ExperimentCell(*values)
+            for values in itertools.product(
+                self.models, self.prompts, self.players, self.response_modes
+            )
+        ]
+
+
+# Set in each worker process by init_worker
+worker_args: Optional[argparse.Namespace] = None
+worker_store: Optional[ResultsStore] = None
+worker_browser_pool: Optional["BrowserPool"] = None
+
+
+def init_worker(args: argparse.Namespace):
+    """Configure the API, the results store and the browser of a worker process.
+
+    The rate limits are split evenly between the processes.
+    """
+    global worker_args, worker_store, worker_browser_pool
+    args = argparse.Namespace(**vars(args))
+    if args.requests_per_minute is not None:
+        args.requests_per_minute /= args.processes
+    if args.tokens_per_minute is not None:
+        args.tokens_per_minute /= args.processes
+    configure_api(args)
+    set_request_scheduler(get_request_scheduler(args))
+    if not args.no_cache:
+        cache_directory = MOCK_CACHE_DIRECTORY if args.mock else DEFAULT_CACHE_DIRECTORY
+        set_response_cache(ResponseCache(cache_directory))
+    worker_args = args
+    worker_store = ResultsStore(args.database)
+    if not args.offline:
+        from browser_pool import BrowserPool
+
+        worker_browser_pool = BrowserPool(
+            1, args.games_per_session, fast=args.fast_browser
+        )
+
+
+def read_puzzle(game_id: int) -> Optional[Puzzle]:
+    """Load the puzzle and its solution, or None if the site does not show it."""
+    assert worker_args is not None
+    if worker_args.offline:
+        return load_puzzle(game_id, worker_args.puzzles_file)
+    assert worker_browser_pool is not None
+    with worker_browser_pool.connections(game_id) as connections:
+        return connections.read_puzzle()
+
+
+def get_connections_factory(puzzle: Optional[Puzzle]) -> ConnectionsFactory:
+    """Return a factory playing the puzzle in-process, or on the site if unknown."""
+    assert worker_args is not None
+    if puzzle is not None:
+        return lambda game_id: contextlib.nullcontext(
+            OfflineConnections(game_id, puzzle)
+        )
+    browser_pool = worker_browser_pool
+    assert browser_pool is not None
+    batch_attempts = worker_args.batch_attempts
+    return lambda game_id: browser_pool.connections(game_id, batch_attempts)
+
+
+async def play_cells(
+    name: str,
+    game_id: int,
+    cells: List[ExperimentCell],
+    create_connections: ConnectionsFactory,
+) -> List[Tuple[ExperimentCell, GameResult]]:
+    """Play the game once for every cell, saving each result under its cell."""
+    assert worker_args is not None
+    game_semaphore = asyncio.Semaphore(worker_args.concurrency)
+    preparation_semaphore = asyncio.Semaphore(worker_args.concurrency)
+    token = api_semaphore.set(asyncio.Semaphore(worker_args.api_concurrency))
+    runners = []
+    for cell in cells:
+        player_class = partial(
+            PLAYER_CLASSES[cell.player],
+            response_mode=GuessResponseMode(cell.response_mode),
+            prompt=cell.prompt,
+        )
+        if cell.player == "single":
+            player_class = partial(
+                player_class, stream_guesses=worker_args.stream
+            )
+        tracker = ResultsTracker(*cell.get_result_key(name), store=worker_store)
+        runners.append(
+            AsyncGameRunner(create_connections, player_class, cell.model, tracker)
+        )
+    try:
+        results = await asyncio.gather(
+            *(
+                runner.run_game(game_id, game_semaphore, preparation_semaphore)
+                for runner in runners
+            )
+        )
+    finally:
+        api_semaphore.reset(token)
+    return [
+        (cell, result) for cell, result in zip(cells, results) if result is not None
+    ]
+
+
+def play_puzzle(
+    name: str, game_id: int, cells: List[ExperimentCell]
+) -> Tuple[bool, List[Tuple[ExperimentCell, GameResult]]]:
+    """Load the puzzle once and play it for every cell, in a worker process.
+
+    Returns whether the cells shared the load, and the results of the cells.
+    """
+    assert worker_args is not None
+    output = contextlib.nullcontext() if worker_args.verbose else io.StringIO()
+    with contextlib.redirect_stdout(output):  # type: ignore
+        puzzle = read_puzzle(game_id)
+        create_connections = get_connections_factory(puzzle)
+        results = asyncio.run(play_cells(name, game_id, cells, create_connections))
+    return puzzle is not None, results
+
+
+def run_matrix(args: argparse.Namespace) -> ExperimentMatrix:
+    """Play every cell of the matrix that has no result yet."""
+    matrix = ExperimentMatrix.from_file(args.matrix)
+    # Offline and mock results are saved apart from live ones
+    matrix.name += get_backend_suffix(args)
+    store = ResultsStore(args.database)
+    cells = matrix.get_cells()
+    work: Dict[int, List[ExperimentCell]] = {}
+    for game_id in get_game_ids(args, matrix.game_ids):
+        remaining_cells = [
+            cell
+            for cell in cells
+            if not store.has_result(cell.get_result_key(matrix.name), game_id)
+        ]
+        if remaining_cells:
+            work[game_id] = remaining_cells
+    print(
+        f"{len(cells)} cells, {len(work)} puzzles to play"
+        f" across {args.processes} processes"
+    )
+    unshared_puzzles = 0
+    with ProcessPoolExecutor(
+        args.processes, initializer=init_worker, initargs=(args,)
+    ) as executor:
+        futures = {
+            executor.submit(play_puzzle, matrix.name, game_id, game_cells): game_id
+            for game_id, game_cells in work.items()
+        }
+        try:
+            for future in as_completed(futures):
+                game_id = futures[future]
+                shared, results = future.result()
+                if not shared:
+                    unshared_puzzles += 1
+                print(
+                    f"Game {game_id}: played {len(results)} of"
+                    f" {len(work[game_id])} cells"
+                    + ("" if shared else ", loading the page for each")
+                )
+        except BaseException:
+            executor.shutdown(cancel_futures=True)
+            raise
+    if unshared_puzzles > 0:
+        print(f"{unshared_puzzles} puzzles were not shown by the site in advance")
+    return matrix
+
+
+def print_summary(args: argparse.Namespace, matrix: ExperimentMatrix):
+    """Print games played, games solved and averages for each cell."""
+    store = ResultsStore(args.database)
+    game_ids = set(get_game_ids(args, matrix.game_ids))
+    print(f"{'cell':<50}{'games':>7}{'solved':>8}{'groups':>8}{'attempts':>10}")
+    for cell in matrix.get_cells():
+        results = [
+            result
+            for result in store.get_results(*cell.get_result_key(matrix.name))
+            if result.game_id in game_ids
+        ]
+        if not results:
+            print(f"{str(cell):<50}{0:>7}")
+            continue
+        solved = sum(result.groups_identified == 4 for result in results)
+        groups = sum(result.groups_identified for result in results) / len(results)
+        attempts = sum(result.total_attempts for result in results) / len(results)
+        print(
+            f"{str(cell):<50}{len(results):>7}{solved:>8}{groups:>8.2f}"
+            f"{attempts:>10.2f}"
+        )
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """Add the experiment matrix options to the parser."""
+    parser.add_argument("matrix", help="JSON file describing the matrix")
+    parser.add_argument("--game-ids", help="games to play instead of the matrix's")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_GAME_CONCURRENCY,
+        help="games played at once by each process",
+    )
+    parser.add_argument("--api-concurrency", type=int, default=8)
+    parser.add_argument(
+        "--offline", action="store_true", help="play the puzzles file, not the site"
+    )
+    parser.add_argument("--puzzles-file", default=PUZZLES_FILE)
+    parser.add_argument(
+        "--mock", action="store_true", help="answer requests with the mock API"
+    )
+    parser.add_argument("--mock-latency", type=float, default=2.0)
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="attempt each guess as soon as it is streamed in",
+    )
+    parser.add_argument("--games-per-session", type=int, default=25)
+    parser.add_argument(
+        "--fast-browser",
+        action="store_true",
+        help="block unneeded resources and switch games without reloading",
+    )
+    parser.add_argument(
+        "--batch-attempts",
+        action="store_true",
+        help="click every word of an attempt in one script",
+    )
+    add_request_arguments(parser)
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--database", default=RESULTS_DATABASE_FILE)
+    parser.add_argument("--verbose", action="store_true", help="show game output")
+
+
+def main(args: argparse.Namespace):
+    print_summary(args, run_matrix(args))
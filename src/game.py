@@ -1,21 +1,32 @@
 """Wrapper class for the Connections selenium class and the GameState class."""
 
 from typing import Set
-from connections import Connections
 from game_state import GameState, AttemptResult, AttemptResultStatus
+from game_types.game_types import ConnectionsBackend
+from utils.journal import current_game_journal
+from utils.transcripts import current_game_transcript
 
 
 class Game:
     """Wrapper class for the Connections selenium class and the GameState class."""
 
-    def __init__(self, game_id: int, connections: Connections):
+    def __init__(self, game_id: int, connections: ConnectionsBackend):
         self.connections = connections
         initial_words = self.connections.get_remaining_words()
+        game_transcript = current_game_transcript.get()
+        if game_transcript is not None:
+            game_transcript.record_words(initial_words)
         self.game_state = GameState(game_id, initial_words)
 
     def attempt_group(self, words: Set[str]) -> AttemptResult:
         """Attempt to group the given words."""
         result = self.connections.attempt_group(words)
+        game_journal = current_game_journal.get()
+        if game_journal is not None:
+            game_journal.record_attempt(words, result)
+        game_transcript = current_game_transcript.get()
+        if game_transcript is not None:
+            game_transcript.record_attempt(words, result)
         attempt_result = self.game_state.record_attempt(words, result)
         if attempt_result.result == AttemptResultStatus.SUCCESS:
             remaining_words = self.connections.get_remaining_words()
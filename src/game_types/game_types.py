@@ -1,5 +1,5 @@
 from enum import Enum
-from typing import Set
+from typing import Protocol, Set
 
 
 class GameStatus(Enum):
@@ -31,3 +31,19 @@ class AttemptResult:
     def pretty_str(self):
         """Return a pretty string representation of the attempt."""
         return f"{self.result}: {str(self.words)}"
+
+
+class ConnectionsBackend(Protocol):
+    """Interface shared by every backend a Game can be played against."""
+
+    def get_remaining_words(self) -> Set[str]:
+        """Return the words that have not been grouped yet."""
+        ...
+
+    def get_number_of_correct_groups(self) -> int:
+        """Return the number of groups that have been found."""
+        ...
+
+    def attempt_group(self, words: Set[str]) -> AttemptResultStatus:
+        """Attempt to group the given words."""
+        ...
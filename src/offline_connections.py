@@ -0,0 +1,102 @@
+"""Module for playing Connections games offline against a local puzzle file."""
+
+import json
+from typing import Dict, FrozenSet, List, Optional, Set
+from game_state import AttemptResultStatus
+from utils.timing import timed
+
+PUZZLES_FILE = "puzzles/puzzles.json"
+
+_loaded_puzzle_files: Dict[str, Dict[int, "Puzzle"]] = {}
+
+
+class PuzzleGroup:
+    """Class for representing one solution group of a puzzle."""
+
+    def __init__(self, words: Set[str], theme: str):
+        self.words: FrozenSet[str] = frozenset(word.upper() for word in words)
+        self.theme = theme
+
+    def __str__(self):
+        return f"{self.theme}: {str(sorted(self.words))}"
+
+
+class Puzzle:
+    """Class for representing a puzzle and its solution."""
+
+    def __init__(self, game_id: int, groups: List[PuzzleGroup]):
+        self.game_id = game_id
+        self.groups = groups
+
+    def get_words(self) -> Set[str]:
+        """Return all the words in the puzzle."""
+        return {word for group in self.groups for word in group.words}
+
+
+def load_puzzles(file_name: str = PUZZLES_FILE) -> Dict[int, Puzzle]:
+    """Load every puzzle in the given file, keyed by game id.
+
+    The file maps game ids to lists of `{"theme": str, "words": [str]}` groups.
+    """
+    if file_name not in _loaded_puzzle_files:
+        with open(file_name, "r") as puzzles_file:
+            json_object = json.load(puzzles_file)
+        puzzles: Dict[int, Puzzle] = {}
+        for game_id, groups in json_object.items():
+            puzzle_groups = [
+                PuzzleGroup(set(group["words"]), group["theme"]) for group in groups
+            ]
+            puzzles[int(game_id)] = Puzzle(int(game_id), puzzle_groups)
+        _loaded_puzzle_files[file_name] = puzzles
+    return _loaded_puzzle_files[file_name]
+
+
+def load_puzzle(game_id: int, file_name: str = PUZZLES_FILE) -> Puzzle:
+    """Load the puzzle with the given id."""
+    puzzles = load_puzzles(file_name)
+    if game_id not in puzzles:
+        raise KeyError(f"Game {game_id} not found in {file_name}.")
+    return puzzles[game_id]
+
+
+class OfflineConnections:
+    """Class for playing the Connections game in-process, without a browser."""
+
+    def __init__(
+        self,
+        game_id: int,
+        puzzle: Optional[Puzzle] = None,
+        puzzles_file: str = PUZZLES_FILE,
+    ):
+        self.puzzle = puzzle or load_puzzle(game_id, puzzles_file)
+        self.remaining_groups: List[PuzzleGroup] = list(self.puzzle.groups)
+        self.number_of_correct_groups = 0
+
+    @timed("connections.get_remaining_words")
+    def get_remaining_words(self) -> Set[str]:
+        """Return the remaining words in the game."""
+        return self.__get_remaining_words()
+
+    def __get_remaining_words(self) -> Set[str]:
+        return {word for group in self.remaining_groups for word in group.words}
+
+    def get_number_of_correct_groups(self) -> int:
+        """Return the number of correct groups."""
+        return self.number_of_correct_groups
+
+    @timed("connections.attempt_group")
+    def attempt_group(self, words: Set[str]) -> AttemptResultStatus:
+        """Attempt to group the given words."""
+        if len(words) != 4:
+            return AttemptResultStatus.FAILURE
+        if not words <= self.__get_remaining_words():
+            return AttemptResultStatus.FAILURE
+        for group in self.remaining_groups:
+            overlap = len(group.words & words)
+            if overlap == 4:
+                self.remaining_groups.remove(group)
+                self.number_of_correct_groups += 1
+                return AttemptResultStatus.SUCCESS
+            if overlap == 3:
+                return AttemptResultStatus.ONE_AWAY
+        return AttemptResultStatus.FAILURE
@@ -1,42 +1,96 @@
 """ Player class for playing a game of Connections. """
 
+import asyncio
 from typing import List, Set
-from connections import Connections
+from game_types.game_types import ConnectionsBackend
 from game import Game
-from ai import AI, AIGuess
-from utils.attempt_utils import get_game_over_message
+from ai import AI, AIGuess, GuessResponseMode
+from prompts.prompts import DEFAULT_PROMPT
+from results_tracker import GameResult
+from utils.attempt_utils import get_game_over_message, get_number_of_correct_groups
+from utils.metrics import GameMetrics, record_game_result, track_game
 
 
 class Player:
-    def __init__(self, game_id: int, connections: Connections, model: str):
+    def __init__(
+        self,
+        game_id: int,
+        connections: ConnectionsBackend,
+        model: str,
+        response_mode: GuessResponseMode = GuessResponseMode.TEXT,
+        prompt: str = DEFAULT_PROMPT,
+    ):
         self.game = Game(game_id, connections)
         self.model = model
+        self.response_mode = response_mode
+        self.prompt = prompt
 
     def play_turn(self):
+        self.__print_turn_header()
+        guess = self.__get_guess()
+        self.__attempt_guess(guess)
+
+    async def play_turn_async(self):
+        self.__print_turn_header()
+        ai = AI(
+            self.game.get_game_state(), self.model, self.response_mode, self.prompt
+        )
+        print("==AI guess==")
+        ai_guesses = await ai.get_initial_guesses_async()
+        guess = self.__pick_guess(ai_guesses)
+        await asyncio.to_thread(self.__attempt_guess, guess)
+
+    def __print_turn_header(self):
         print(f"====Player turn {self.game.get_game_state().get_turn_number()}====")
         print(self.game.get_game_state())
 
-        guess = self.__get_guess()
+    def __attempt_guess(self, guess: Set[str]):
         print("==Connections Result==")
         result = self.game.attempt_group(guess)
         print(result.pretty_str(), "\n\n")
 
     def __get_guess(self) -> Set[str]:
-        ai = AI(self.game.get_game_state(), self.model)
+        ai = AI(
+            self.game.get_game_state(), self.model, self.response_mode, self.prompt
+        )
         print("==AI guess==")
         ai_guesses: List[AIGuess] = ai.get_initial_guesses()
+        return self.__pick_guess(ai_guesses)
+
+    def __pick_guess(self, ai_guesses: List[AIGuess]) -> Set[str]:
         for guess in ai_guesses:
             print(guess)
         ai_guess = ai_guesses[0]
         return ai_guess.get_words()
 
-    def play_game(self):
+    def play_game(self) -> GameResult:
+        game_state = self.game.get_game_state()
+        with track_game(type(self).__name__, self.model) as game_metrics:
+            while not game_state.is_game_over():
+                self.play_turn()
+        return self.__get_game_result(game_metrics)
+
+    async def play_game_async(self) -> GameResult:
+        game_state = self.game.get_game_state()
+        with track_game(type(self).__name__, self.model) as game_metrics:
+            while not game_state.is_game_over():
+                await self.play_turn_async()
+        return self.__get_game_result(game_metrics)
+
+    def __get_game_result(self, game_metrics: GameMetrics) -> GameResult:
         game_state = self.game.get_game_state()
-        while not game_state.is_game_over():
-            self.play_turn()
         game_over_message = get_game_over_message(
             game_state.get_game_id(),
             game_state.get_attempts(),
             game_state.get_game_status(),
         )
         print(game_over_message)
+        groups_identified = get_number_of_correct_groups(game_state.get_attempts())
+        total_attempts = len(game_state.get_attempts())
+        record_game_result(game_metrics, groups_identified, total_attempts)
+        return GameResult(
+            game_state.get_game_id(),
+            groups_identified,
+            total_attempts,
+            game_metrics.get_as_dict(),
+        )
@@ -0,0 +1,13 @@
+"""The players that can play a game, by the name used on the command line."""
+
+from conversational_player import ConversationalPlayer
+from player import Player
+from single_ai_guess_player import SingleAiGuessPlayer
+from solver_player import SolverPlayer
+
+PLAYER_CLASSES = {
+    "single": SingleAiGuessPlayer,
+    "player": Player,
+    "solver": SolverPlayer,
+    "conversational": ConversationalPlayer,
+}
@@ -27,3 +27,10 @@ Examples of groupings:
 
 Each word can only be in one grouping, and each grouping must have 4 words exactly. The grouping cannot have a theme like "Random words", "General terms" or "Unrelated words", they must be connected in some way. 
 """
+
+DEFAULT_PROMPT = "default"
+# System messages by the name results are saved under
+PROMPTS = {
+    DEFAULT_PROMPT: SYSTEM_MESSAGE_BASE_V1,
+    "v2": SYSTEM_MESSAGE_BASE_V2,
+}
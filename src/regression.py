@@ -0,0 +1,149 @@
+"""Play recorded games again with the current code, as a regression benchmark.
+
+Games recorded with `cli.py run --record-transcripts` are replayed against
+their transcripts instead of the site and the API, so hundreds of games run
+in seconds. Games that ask for a response or an attempt result that was not
+recorded are reported as diverged.
+
+    python src/cli.py regress output/transcripts/gpt-4-1106-preview_single_guess.jsonl
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import time
+from functools import partial
+from typing import Dict, Iterator, List
+from ai import GuessResponseMode
+from async_runner import AsyncGameRunner
+from players import PLAYER_CLASSES
+from prompts.prompts import DEFAULT_PROMPT, PROMPTS
+from replay_connections import ReplayConnections
+from utils.openai_wrapper import (
+    set_chat_completion_backend,
+    set_request_scheduler,
+    set_response_cache,
+)
+from utils.request_scheduler import RequestScheduler
+from utils.transcripts import (
+    TranscriptChatCompletion,
+    TranscriptMissError,
+    load_transcripts,
+)
+
+DEFAULT_CONCURRENCY = 64
+
+
+def run_regression(args: argparse.Namespace) -> dict:
+    """Replay every recorded game and compare its result to the recording."""
+    transcripts = load_transcripts(args.transcripts)
+    set_chat_completion_backend(TranscriptChatCompletion(transcripts))
+    set_response_cache(None)
+    # A response missing from the transcripts will not appear on a retry
+    set_request_scheduler(RequestScheduler(max_retries=0))
+    diverged: Dict[int, str] = {}
+
+    @contextlib.contextmanager
+    def create_connections(game_id: int) -> Iterator[ReplayConnections]:
+        try:
+            yield ReplayConnections(transcripts[game_id])
+        except TranscriptMissError as error:
+            diverged[game_id] = str(error)
+
+    player_class = partial(
+        PLAYER_CLASSES[args.player],
+        response_mode=GuessResponseMode(args.response_mode),
+        prompt=args.prompt,
+    )
+    if args.player == "single":
+        player_class = partial(player_class, stream_guesses=args.stream)
+    if args.player == "solver":
+        player_class = partial(player_class, score_one_away=args.score_one_away)
+    model = args.model or next(iter(transcripts.values())).model
+    runner = AsyncGameRunner(
+        create_connections,
+        player_class,
+        model,
+        None,
+        game_concurrency=args.concurrency,
+        api_concurrency=args.concurrency,
+    )
+    start = time.perf_counter()
+    output = contextlib.nullcontext() if args.verbose else io.StringIO()
+    with contextlib.redirect_stdout(output):  # type: ignore
+        results = asyncio.run(runner.run_games(sorted(transcripts)))
+    diverged.update(runner.failed_games)
+    elapsed_seconds = time.perf_counter() - start
+    changed: List[dict] = []
+    for result in results:
+        transcript = transcripts[result.game_id]
+        if result.groups_identified != transcript.groups_identified:
+            changed.append(
+                {
+                    "game_id": result.game_id,
+                    "recorded_groups": transcript.groups_identified,
+                    "replayed_groups": result.groups_identified,
+                }
+            )
+    return {
+        "games": len(transcripts),
+        "replayed": len(results),
+        "diverged": diverged,
+        "changed": changed,
+        "recorded_groups": sum(
+            transcripts[result.game_id].groups_identified for result in results
+        ),
+        "replayed_groups": sum(result.groups_identified for result in results),
+        "elapsed_seconds": elapsed_seconds,
+    }
+
+
+def print_report(report: dict):
+    """Print the games whose outcome changed, then the totals."""
+    for game_id, reason in sorted(report["diverged"].items()):
+        print(f"Game {game_id} diverged: {reason}")
+    for change in report["changed"]:
+        print(
+            f"Game {change['game_id']}: {change['recorded_groups']} groups"
+            f" -> {change['replayed_groups']} groups"
+        )
+    print(
+        f"Replayed {report['replayed']} of {report['games']} games in"
+        f" {report['elapsed_seconds']:.2f}s, {len(report['diverged'])} diverged,"
+        f" {len(report['changed'])} changed"
+    )
+    print(
+        f"Groups identified: {report['recorded_groups']} recorded,"
+        f" {report['replayed_groups']} replayed"
+    )
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """Add the regression options to the parser."""
+    parser.add_argument("transcripts", help="transcript file to replay")
+    parser.add_argument("--player", choices=PLAYER_CLASSES, default="single")
+    parser.add_argument("--prompt", choices=PROMPTS, default=DEFAULT_PROMPT)
+    parser.add_argument(
+        "--response-mode",
+        choices=[mode.value for mode in GuessResponseMode],
+        default=GuessResponseMode.TEXT.value,
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="attempt each guess as soon as it is streamed in",
+    )
+    parser.add_argument(
+        "--score-one-away",
+        action="store_true",
+        help="have the solver player score every one-swap neighbour of a one away"
+        " attempt in one request",
+    )
+    parser.add_argument("--model", help="by default the model that was recorded")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--verbose", action="store_true", help="show game output")
+
+
+def main(args: argparse.Namespace):
+    print_report(run_regression(args))
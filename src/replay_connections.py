@@ -0,0 +1,66 @@
+"""Module for playing a recorded game again from its transcript."""
+
+from typing import FrozenSet, List, Set
+from game_state import AttemptResultStatus
+from utils.transcripts import GameTranscript, TranscriptMissError
+
+GROUP_SIZE = 4
+NUMBER_OF_GROUPS = 4
+
+
+class ReplayConnections:
+    """Class for answering attempts the way the recorded game did.
+
+    An attempt that was recorded gets its recorded result. Any other attempt
+    is answered from the groups the recording proves correct, and raises
+    TranscriptMissError if those are not enough to tell its result.
+    """
+
+    def __init__(self, transcript: GameTranscript):
+        self.words: Set[str] = set(transcript.words)
+        self.remaining_words: Set[str] = set(transcript.words)
+        self.recorded_results = {
+            frozenset(words): result for words, result in transcript.attempts
+        }
+        self.known_groups: List[FrozenSet[str]] = [
+            words
+            for words, result in self.recorded_results.items()
+            if result == AttemptResultStatus.SUCCESS
+        ]
+        if len(self.known_groups) == NUMBER_OF_GROUPS - 1:
+            self.known_groups.append(
+                frozenset(self.words.difference(*self.known_groups))
+            )
+        self.number_of_correct_groups = 0
+
+    def get_remaining_words(self) -> Set[str]:
+        """Return the remaining words in the game."""
+        return set(self.remaining_words)
+
+    def get_number_of_correct_groups(self) -> int:
+        """Return the number of correct groups."""
+        return self.number_of_correct_groups
+
+    def attempt_group(self, words: Set[str]) -> AttemptResultStatus:
+        """Attempt to group the given words."""
+        attempt = frozenset(word.upper() for word in words)
+        result = self.__get_result(attempt)
+        if result == AttemptResultStatus.SUCCESS:
+            self.remaining_words -= attempt
+            self.number_of_correct_groups += 1
+        return result
+
+    def __get_result(self, attempt: FrozenSet[str]) -> AttemptResultStatus:
+        if len(attempt) != GROUP_SIZE or not attempt <= self.remaining_words:
+            return AttemptResultStatus.FAILURE
+        if attempt in self.recorded_results:
+            return self.recorded_results[attempt]
+        if attempt in self.known_groups:
+            return AttemptResultStatus.SUCCESS
+        if any(len(attempt & group) == GROUP_SIZE - 1 for group in self.known_groups):
+            return AttemptResultStatus.ONE_AWAY
+        if len(self.known_groups) == NUMBER_OF_GROUPS:
+            return AttemptResultStatus.FAILURE
+        raise TranscriptMissError(
+            f"The result of attempting {sorted(attempt)} was not recorded."
+        )
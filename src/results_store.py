@@ -0,0 +1,251 @@
+"""Store game results from every run in a single SQLite database.
+
+Results are keyed by run, model, prompt and game id. The database is opened
+in WAL mode so that several processes can write to it at once, and the
+summary view replaces combining per-game CSV files by hand.
+
+    PYTHONPATH=src python src/results_store.py import output
+    PYTHONPATH=src python src/results_store.py summary
+"""
+
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+from prompts.prompts import DEFAULT_PROMPT, PROMPTS
+from results_tracker import GameResult
+
+RESULTS_DATABASE_FILE = "output/results.db"
+SECONDS_TO_WAIT_FOR_LOCK = 30
+
+CREATE_RESULTS_TABLE = """
+CREATE TABLE IF NOT EXISTS results (
+    run TEXT NOT NULL,
+    model TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    game_id INTEGER NOT NULL,
+    groups_identified INTEGER NOT NULL,
+    total_attempts INTEGER NOT NULL,
+    metrics TEXT NOT NULL DEFAULT '{}',
+    created_at REAL NOT NULL,
+    PRIMARY KEY (run, model, prompt, game_id)
+)
+"""
+CREATE_SUMMARY_VIEW = """
+CREATE VIEW IF NOT EXISTS summary AS
+SELECT
+    run,
+    model,
+    prompt,
+    COUNT(*) AS games,
+    SUM(groups_identified = 4) AS games_solved,
+    AVG(groups_identified) AS average_groups_identified,
+    AVG(total_attempts) AS average_total_attempts
+FROM results
+GROUP BY run, model, prompt
+"""
+
+ResultKey = Tuple[str, str, str]
+
+
+def connect(file_name: str) -> sqlite3.Connection:
+    """Open the database in WAL mode, creating its folder if needed."""
+    directory = os.path.dirname(file_name)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    connection = sqlite3.connect(file_name, timeout=SECONDS_TO_WAIT_FOR_LOCK)
+    connection.row_factory = sqlite3.Row
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
+
+
+def insert_result(connection: sqlite3.Connection, key: ResultKey, result: GameResult):
+    """Insert the result, replacing any earlier result for the same game."""
+    run, model, prompt = key
+    connection.execute(
+        "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            run,
+            model,
+            prompt,
+            result.game_id,
+            result.groups_identified,
+            result.total_attempts,
+            json.dumps(result.metrics),
+            time.time(),
+        ),
+    )
+
+
+class ResultsStore:
+    """Class for saving and querying game results in SQLite.
+
+    Each thread gets its own connection, since sqlite3 connections cannot be
+    shared between threads.
+    """
+
+    def __init__(self, file_name: str = RESULTS_DATABASE_FILE):
+        self.file_name = file_name
+        self.local = threading.local()
+        connection = self.__get_connection()
+        with connection:
+            connection.execute(CREATE_RESULTS_TABLE)
+            connection.execute(CREATE_SUMMARY_VIEW)
+
+    def __get_connection(self) -> sqlite3.Connection:
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = connect(self.file_name)
+            self.local.connection = connection
+        return connection
+
+    def save_result(self, key: ResultKey, result: GameResult):
+        """Save the result, replacing any earlier result for the same game."""
+        connection = self.__get_connection()
+        with connection:
+            insert_result(connection, key, result)
+
+    def has_result(self, key: ResultKey, game_id: int) -> bool:
+        """Determine if a result has already been saved for the game."""
+        run, model, prompt = key
+        row = (
+            self.__get_connection()
+            .execute(
+                "SELECT 1 FROM results"
+                " WHERE run = ? AND model = ? AND prompt = ? AND game_id = ?",
+                (run, model, prompt, game_id),
+            )
+            .fetchone()
+        )
+        return row is not None
+
+    def get_results(
+        self,
+        run: Optional[str] = None,
+        model: Optional[str] = None,
+        prompt: Optional[str] = None,
+    ) -> List[GameResult]:
+        """Return the results matching the given run, model and prompt."""
+        conditions = []
+        parameters = []
+        for column, value in (("run", run), ("model", model), ("prompt", prompt)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                parameters.append(value)
+        query = "SELECT * FROM results"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        rows = self.__get_connection().execute(query + " ORDER BY game_id", parameters)
+        return [
+            GameResult(
+                row["game_id"],
+                row["groups_identified"],
+                row["total_attempts"],
+                json.loads(row["metrics"]),
+            )
+            for row in rows
+        ]
+
+    def get_rows(self, query: str, parameters: Sequence = ()) -> List[Tuple]:
+        """Run a query against the store and return every row as a tuple."""
+        cursor = self.__get_connection().cursor()
+        cursor.row_factory = None
+        return cursor.execute(query, parameters).fetchall()
+
+    def get_summary(self) -> List[Dict]:
+        """Return games played, games solved and averages for each run."""
+        rows = self.__get_connection().execute(
+            "SELECT * FROM summary ORDER BY run, model, prompt"
+        )
+        return [dict(row) for row in rows]
+
+    def import_folder(self, folder: str, key: ResultKey) -> int:
+        """Import a folder of per-game CSV files, returning how many were read.
+
+        Files are named `<game_id>.csv` and hold a tab-delimited header row
+        and a row of groups identified and total attempts.
+        """
+        imported = 0
+        for file_name in sorted(os.listdir(folder)):
+            game_id, extension = os.path.splitext(file_name)
+            if extension != ".csv" or not game_id.isdigit():
+                continue
+            with open(os.path.join(folder, file_name), "r", newline="") as csvfile:
+                rows = list(csv.reader(csvfile, delimiter="\t"))
+            if len(rows) < 2:
+                continue
+            groups_identified, total_attempts = rows[1]
+            result = GameResult(
+                int(game_id), int(groups_identified), int(total_attempts)
+            )
+            self.save_result(key, result)
+            imported += 1
+        return imported
+
+    def import_output(self, output_folder: str = "output") -> Dict[str, int]:
+        """Import every results folder under `output_folder`.
+
+        Folders are named `<model>_<run>`, as ResultsTracker used to name them,
+        with the prompt as a suffix of the run when it was not the default.
+        """
+        imported = {}
+        for folder_name in sorted(os.listdir(output_folder)):
+            folder = os.path.join(output_folder, folder_name)
+            if not os.path.isdir(folder) or "_" not in folder_name:
+                continue
+            count = self.import_folder(folder, get_output_folder_key(folder_name))
+            if count > 0:
+                imported[folder_name] = count
+        return imported
+
+
+def get_output_folder_key(folder_name: str) -> ResultKey:
+    """Return the key of a `<model>_<run>` folder.
+
+    A run ending in `_<prompt>`, for a prompt other than the default, was
+    played with that prompt.
+    """
+    model, run = folder_name.split("_", 1)
+    for prompt in PROMPTS:
+        suffix = f"_{prompt}"
+        if prompt != DEFAULT_PROMPT and run.endswith(suffix):
+            return (run[: -len(suffix)], model, prompt)
+    return (run, model, DEFAULT_PROMPT)
+
+
+def print_summary(store: ResultsStore):
+    """Print the summary of every run."""
+    print(
+        f"{'run':<30}{'model':<22}{'prompt':<12}{'games':>7}{'solved':>8}"
+        f"{'groups':>8}{'attempts':>10}"
+    )
+    for row in store.get_summary():
+        print(
+            f"{row['run']:<30}{row['model']:<22}{row['prompt']:<12}"
+            f"{row['games']:>7}{row['games_solved']:>8}"
+            f"{row['average_groups_identified']:>8.2f}"
+            f"{row['average_total_attempts']:>10.2f}"
+        )
+
+
+def main(args: argparse.Namespace):
+    store = ResultsStore(args.database)
+    if args.command == "import":
+        for folder_name, count in store.import_output(args.folder).items():
+            print(f"Imported {count} results from {folder_name}")
+    print_summary(store)
+
+
+if __name__ == "__main__":
+    argument_parser = argparse.ArgumentParser(description=__doc__)
+    argument_parser.add_argument("command", choices=["import", "summary"])
+    argument_parser.add_argument(
+        "folder", nargs="?", default="output", help="folder to import"
+    )
+    argument_parser.add_argument("--database", default=RESULTS_DATABASE_FILE)
+    main(argument_parser.parse_args())
@@ -1,36 +1,47 @@
-"""Track results and output to CSV file"""
+"""Track results and save them to the results store"""
 
-import csv
-from typing import List
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    from results_store import ResultsStore
 
 
 class GameResult:
-    def __init__(self, game_id: int, groups_identified: int, total_attempts: int):
+    def __init__(
+        self,
+        game_id: int,
+        groups_identified: int,
+        total_attempts: int,
+        metrics: Optional[dict] = None,
+    ):
         self.game_id = game_id
         self.groups_identified = groups_identified
         self.total_attempts = total_attempts
+        # Tokens, cost, latencies and retries of the game, from GameMetrics
+        self.metrics = metrics or {}
 
 
 class ResultsTracker:
-    def __init__(self, file_name_prefix: str):
-        self.file_name_prefix = file_name_prefix
+    """Saves the results of one run, model and prompt to a ResultsStore."""
+
+    def __init__(
+        self,
+        run: str,
+        model: str,
+        prompt: str = "default",
+        store: Optional["ResultsStore"] = None,
+    ):
+        if store is None:
+            from results_store import ResultsStore
+
+            store = ResultsStore()
+        self.store = store
+        self.key = (run, model, prompt)
 
     def save_result(self, result: GameResult):
-        """Save result as CSV file"""
-        file_name = self.__get_file_name(result.game_id)
-        with open(file_name, "w", newline="") as csvfile:
-            writer = csv.writer(csvfile, delimiter="\t")
-            writer.writerow(["Groups Identified", "Total Attempts"])
-            writer.writerow([result.groups_identified, result.total_attempts])
+        """Save result to the store"""
+        self.store.save_result(self.key, result)
 
     def already_has_result(self, game_id: int) -> bool:
         """Determine if result has already been saved"""
-        file_name = self.__get_file_name(game_id)
-        try:
-            with open(file_name, "r") as csvfile:
-                return True
-        except FileNotFoundError:
-            return False
-
-    def __get_file_name(self, game_id: int) -> str:
-        return f"output/{self.file_name_prefix}/{game_id}.csv"
+        return self.store.has_result(self.key, game_id)
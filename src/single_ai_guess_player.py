@@ -1,35 +1,107 @@
 """ Player which attempts a single AI guess for playing a game of Connections """
 
-from typing import List, Set
-from connections import Connections
+import asyncio
+from typing import AsyncGenerator, Generator, List, Optional, Set
+from game_types.game_types import ConnectionsBackend
 from game import Game
-from ai import AI, AIGuess
+from ai import AI, AIGuess, GuessResponseMode
+from prompts.prompts import DEFAULT_PROMPT
 from results_tracker import GameResult
 from utils.attempt_utils import get_game_over_message, get_number_of_correct_groups
+from utils.metrics import GameMetrics, record_game_result, track_game
 
 
 class SingleAiGuessPlayer:
-    def __init__(self, game_id: int, connections: Connections, model: str):
+    def __init__(
+        self,
+        game_id: int,
+        connections: ConnectionsBackend,
+        model: str,
+        response_mode: GuessResponseMode = GuessResponseMode.TEXT,
+        prompt: str = DEFAULT_PROMPT,
+        stream_guesses: bool = False,
+    ):
         self.game = Game(game_id, connections)
         self.model = model
+        self.response_mode = response_mode
+        self.prompt = prompt
+        # Attempt each guess as soon as it is streamed in, instead of waiting
+        # for the whole response
+        self.stream_guesses = stream_guesses
+        self.ai_guesses: List[AIGuess] = []
+        self.ai_guess_stream: Optional[Generator[AIGuess, None, None]] = None
+        self.ai_guess_stream_async: Optional[AsyncGenerator[AIGuess, None]] = None
+        self.has_requested_guesses = False
 
     def play_turn(self):
+        self.__print_turn_header()
+        self.__load_guesses()
+        guess = self.__get_guess()
+        self.__attempt_guess(guess)
+        if not self.game.get_game_state().is_game_over():
+            self.__load_guesses()
+            self.__quit_if_out_of_guesses()
+
+    async def play_turn_async(self):
+        self.__print_turn_header()
+        await self.__load_guesses_async()
+        guess = self.__get_guess()
+        await asyncio.to_thread(self.__attempt_guess, guess)
+        if not self.game.get_game_state().is_game_over():
+            await self.__load_guesses_async()
+            self.__quit_if_out_of_guesses()
+
+    def __load_guesses(self):
+        """Request the guesses once, then pull the next streamed guess if needed."""
+        if not self.has_requested_guesses:
+            self.has_requested_guesses = True
+            ai = AI(
+                self.game.get_game_state(), self.model, self.response_mode, self.prompt
+            )
+            if self.stream_guesses:
+                self.ai_guess_stream = ai.stream_initial_guesses()
+            else:
+                self.ai_guesses = ai.get_initial_guesses()
+        if len(self.ai_guesses) == 0 and self.ai_guess_stream is not None:
+            next_guess = next(self.ai_guess_stream, None)
+            if next_guess is None:
+                self.ai_guess_stream = None
+            else:
+                self.ai_guesses.append(next_guess)
+
+    async def __load_guesses_async(self):
+        """Async version of __load_guesses."""
+        if not self.has_requested_guesses:
+            self.has_requested_guesses = True
+            ai = AI(
+                self.game.get_game_state(), self.model, self.response_mode, self.prompt
+            )
+            if self.stream_guesses:
+                self.ai_guess_stream_async = ai.stream_initial_guesses_async()
+            else:
+                self.ai_guesses = await ai.get_initial_guesses_async()
+        if len(self.ai_guesses) == 0 and self.ai_guess_stream_async is not None:
+            next_guess = await anext(self.ai_guess_stream_async, None)
+            if next_guess is None:
+                self.ai_guess_stream_async = None
+            else:
+                self.ai_guesses.append(next_guess)
+
+    def __quit_if_out_of_guesses(self):
+        if len(self.ai_guesses) == 0:
+            self.game.get_game_state().quit()
+
+    def __print_turn_header(self):
         print(f"====Player turn {self.game.get_game_state().get_turn_number()}====")
         print(self.game.get_game_state())
 
-        guess = self.__get_guess()
+    def __attempt_guess(self, guess: Set[str]):
         print("==Connections Result==")
         result = self.game.attempt_group(guess)
         print(result.pretty_str(), "\n\n")
-        if len(self.ai_guesses) == 0 and not self.game.get_game_state().is_game_over():
-            self.game.get_game_state().quit()
 
     def __get_guess(self) -> Set[str]:
         print("==AI guess==")
-        if not hasattr(self, "ai_guesses"):
-            ai = AI(self.game.get_game_state(), self.model)
-            self.ai_guesses: List[AIGuess] = ai.get_initial_guesses()
-
         for guess in self.ai_guesses:
             print(guess)
         ai_guess = self.ai_guesses[0]
@@ -39,16 +111,36 @@ class SingleAiGuessPlayer:
 
     def play_game(self) -> GameResult:
         game_state = self.game.get_game_state()
-        while not game_state.is_game_over():
-            self.play_turn()
+        with track_game(type(self).__name__, self.model) as game_metrics:
+            while not game_state.is_game_over():
+                self.play_turn()
+            if self.ai_guess_stream is not None:
+                self.ai_guess_stream.close()
+        return self.__get_game_result(game_metrics)
+
+    async def play_game_async(self) -> GameResult:
+        game_state = self.game.get_game_state()
+        with track_game(type(self).__name__, self.model) as game_metrics:
+            while not game_state.is_game_over():
+                await self.play_turn_async()
+            if self.ai_guess_stream_async is not None:
+                await self.ai_guess_stream_async.aclose()
+        return self.__get_game_result(game_metrics)
+
+    def __get_game_result(self, game_metrics: GameMetrics) -> GameResult:
+        game_state = self.game.get_game_state()
         game_over_message = get_game_over_message(
             game_state.get_game_id(),
             game_state.get_attempts(),
             game_state.get_game_status(),
         )
         print(game_over_message)
+        groups_identified = get_number_of_correct_groups(game_state.get_attempts())
+        total_attempts = len(game_state.get_attempts())
+        record_game_result(game_metrics, groups_identified, total_attempts)
         return GameResult(
             game_state.get_game_id(),
-            get_number_of_correct_groups(game_state.get_attempts()),
-            len(game_state.get_attempts()),
+            groups_identified,
+            total_attempts,
+            game_metrics.get_as_dict(),
         )
@@ -0,0 +1,222 @@
+"""Pick the next attempt from the model's candidate groups without asking again.
+
+Words are represented as bits of an int, so a group is a 4-bit mask. Every
+partition of the remaining words into candidate groups is enumerated by
+exact cover, and partitions that contradict an earlier attempt are dropped:
+after a FAILURE no group shares 3 or more words with the attempt, and after a
+ONE_AWAY exactly one group shares 3. Groups the model scored directly, such as
+the one-swap neighbours of a ONE_AWAY attempt, are added as candidates with
+their score as confidence.
+"""
+
+from typing import Dict, List, Optional, Set, Tuple
+from game_types.game_types import AttemptResult, AttemptResultStatus
+
+GROUP_SIZE = 4
+# Confidence in the first group of a response, each later group is less likely
+RANK_DECAY = 0.8
+# Confidence in a group made of the words no candidate group covers
+LEFTOVER_CONFIDENCE = 0.25
+# Stop enumerating after this many partitions
+MAX_PARTITIONS = 10000
+# Scored groups below this confidence are not worth enumerating
+MIN_SCORED_CONFIDENCE = 0.1
+
+
+def is_consistent(
+    mask: int, failed_masks: List[int], one_away_masks: List[int]
+) -> bool:
+    """Determine if the group could be correct given the failed attempts."""
+    if any((mask & failed).bit_count() >= 3 for failed in failed_masks):
+        return False
+    return all((mask & one_away).bit_count() < 4 for one_away in one_away_masks)
+
+
+class GroupSolver:
+    """Class for ranking candidate groups by the partitions they appear in.
+
+    Candidates are added from one or more model responses. The confidence of a
+    candidate decays with its rank in the response, and a candidate proposed
+    by several responses is more likely than by any one of them.
+    """
+
+    def __init__(self, words: Set[str]):
+        self.words = sorted(words)
+        self.word_to_bit: Dict[str, int] = {
+            word: 1 << i for i, word in enumerate(self.words)
+        }
+        self.candidates: Dict[int, float] = {}
+
+    def get_mask(self, words: Set[str]) -> Optional[int]:
+        """Return the mask of the words, or None if any is not in the game."""
+        mask = 0
+        for word in words:
+            bit = self.word_to_bit.get(word.upper())
+            if bit is None:
+                return None
+            mask |= bit
+        return mask
+
+    def get_words(self, mask: int) -> Set[str]:
+        """Return the words of the mask."""
+        return {word for word, bit in self.word_to_bit.items() if mask & bit}
+
+    def add_candidates(self, groups: List[Set[str]]):
+        """Add the groups of one response, in the order the model gave them."""
+        for rank, words in enumerate(groups):
+            mask = self.get_mask(words)
+            if mask is None or mask.bit_count() != GROUP_SIZE:
+                continue
+            confidence = RANK_DECAY**rank
+            previous_confidence = self.candidates.get(mask, 0.0)
+            self.candidates[mask] = 1 - (1 - previous_confidence) * (1 - confidence)
+
+    def add_scored_candidates(self, groups: List[Set[str]], scores: List[float]):
+        """Add groups the model scored, with their score as confidence."""
+        for words, score in zip(groups, scores):
+            mask = self.get_mask(words)
+            if mask is None or mask.bit_count() != GROUP_SIZE:
+                continue
+            if score < MIN_SCORED_CONFIDENCE:
+                continue
+            previous_confidence = self.candidates.get(mask, 0.0)
+            self.candidates[mask] = 1 - (1 - previous_confidence) * (1 - score)
+
+    def get_one_swap_neighbours(
+        self, words: Set[str], attempts: List[AttemptResult]
+    ) -> List[Set[str]]:
+        """Return the groups made by swapping one of the words for another.
+
+        Only groups of unsolved words that are consistent with the attempts
+        are returned, so after a ONE_AWAY one of them is the correct group.
+        """
+        attempt_mask = self.get_mask(words)
+        if attempt_mask is None:
+            return []
+        solved_masks, failed_masks, one_away_masks = self.__get_attempt_masks(
+            attempts
+        )
+        remaining_mask = (1 << len(self.words)) - 1
+        for mask in solved_masks:
+            remaining_mask &= ~mask
+        neighbours = []
+        for bit in self.word_to_bit.values():
+            if not bit & attempt_mask:
+                continue
+            for other_bit in self.word_to_bit.values():
+                if other_bit & attempt_mask or not other_bit & remaining_mask:
+                    continue
+                mask = attempt_mask & ~bit | other_bit
+                if is_consistent(mask, failed_masks, one_away_masks):
+                    neighbours.append(self.get_words(mask))
+        return neighbours
+
+    def get_partitions(
+        self, attempts: List[AttemptResult]
+    ) -> List[Tuple[List[int], float]]:
+        """Return every partition consistent with the attempts, with its weight.
+
+        A partition's weight is the product of its groups' confidences. At most
+        one group of a partition may be the leftover words, which no candidate
+        covers.
+        """
+        solved_masks, failed_masks, one_away_masks = self.__get_attempt_masks(
+            attempts
+        )
+
+        def count_one_away_matches(mask: int, matches: List[int]) -> List[int]:
+            return [
+                count + ((mask & one_away).bit_count() == 3)
+                for count, one_away in zip(matches, one_away_masks)
+            ]
+
+        remaining_mask = (1 << len(self.words)) - 1
+        # One-away attempts must be matched by exactly one group, which may
+        # also be a solved one
+        one_away_matches = [0] * len(one_away_masks)
+        for mask in solved_masks:
+            remaining_mask &= ~mask
+            one_away_matches = count_one_away_matches(mask, one_away_matches)
+        candidates = [
+            (mask, confidence)
+            for mask, confidence in self.candidates.items()
+            if mask & remaining_mask == mask
+            and is_consistent(mask, failed_masks, one_away_masks)
+        ]
+        partitions: List[Tuple[List[int], float]] = []
+        groups: List[int] = []
+
+        def search(uncovered_mask: int, matches: List[int], weight: float):
+            """Cover the lowest uncovered word with each candidate in turn."""
+            if len(partitions) >= MAX_PARTITIONS:
+                return
+            if uncovered_mask == 0:
+                if all(count == 1 for count in matches):
+                    partitions.append((list(groups), weight))
+                return
+            options = candidates
+            if (
+                uncovered_mask.bit_count() == GROUP_SIZE
+                and uncovered_mask not in self.candidates
+                and is_consistent(uncovered_mask, failed_masks, one_away_masks)
+            ):
+                options = candidates + [(uncovered_mask, LEFTOVER_CONFIDENCE)]
+            lowest_bit = uncovered_mask & -uncovered_mask
+            for mask, confidence in options:
+                if not mask & lowest_bit or mask & uncovered_mask != mask:
+                    continue
+                next_matches = count_one_away_matches(mask, matches)
+                if any(count > 1 for count in next_matches):
+                    continue
+                groups.append(mask)
+                search(uncovered_mask & ~mask, next_matches, weight * confidence)
+                groups.pop()
+
+        search(remaining_mask, one_away_matches, 1.0)
+        return partitions
+
+    def __get_attempt_masks(
+        self, attempts: List[AttemptResult]
+    ) -> Tuple[List[int], List[int], List[int]]:
+        masks: Dict[AttemptResultStatus, List[int]] = {
+            status: [] for status in AttemptResultStatus
+        }
+        for attempt in attempts:
+            mask = self.get_mask(attempt.words)
+            if mask is not None:
+                masks[attempt.result].append(mask)
+        return (
+            masks[AttemptResultStatus.SUCCESS],
+            masks[AttemptResultStatus.FAILURE],
+            masks[AttemptResultStatus.ONE_AWAY],
+        )
+
+    def get_ranked_groups(
+        self, attempts: List[AttemptResult]
+    ) -> List[Tuple[Set[str], float]]:
+        """Return the groups of consistent partitions, most likely first.
+
+        A group's likelihood is the share of the total partition weight held by
+        the partitions it appears in.
+        """
+        partitions = self.get_partitions(attempts)
+        total_weight = sum(weight for _, weight in partitions)
+        group_weights: Dict[int, float] = {}
+        for groups, weight in partitions:
+            for mask in groups:
+                group_weights[mask] = group_weights.get(mask, 0.0) + weight
+        ranked = sorted(
+            group_weights.items(),
+            key=lambda item: (item[1], self.candidates.get(item[0], 0.0)),
+            reverse=True,
+        )
+        return [
+            (self.get_words(mask), weight / total_weight) for mask, weight in ranked
+        ]
+
+    def get_next_attempt(self, attempts: List[AttemptResult]) -> Optional[Set[str]]:
+        """Return the most likely group, or None if no partition is consistent."""
+        ranked_groups = self.get_ranked_groups(attempts)
+        if len(ranked_groups) == 0:
+            return None
+        return ranked_groups[0][0]
@@ -0,0 +1,141 @@
+""" Player which picks each attempt with the solver, asking the AI only when stuck """
+
+import asyncio
+from typing import List, Optional, Set
+from game_types.game_types import AttemptResultStatus, ConnectionsBackend
+from game import Game
+from ai import AI, AIGuess, GuessResponseMode
+from prompts.prompts import DEFAULT_PROMPT
+from results_tracker import GameResult
+from solver import GroupSolver
+from utils.attempt_utils import get_game_over_message, get_number_of_correct_groups
+from utils.metrics import GameMetrics, record_game_result, track_game
+
+# Responses requested per game before giving up
+MAX_AI_REQUESTS = 3
+
+
+class SolverPlayer:
+    """Attempts the group the solver ranks first given every response so far.
+
+    The AI is asked again only when no partition of the remaining words into
+    its candidate groups is consistent with the attempts made. With
+    `score_one_away`, every one-swap neighbour of a one away attempt is
+    scored by the AI in a single request and added to the candidates.
+    """
+
+    def __init__(
+        self,
+        game_id: int,
+        connections: ConnectionsBackend,
+        model: str,
+        response_mode: GuessResponseMode = GuessResponseMode.TEXT,
+        prompt: str = DEFAULT_PROMPT,
+        score_one_away: bool = False,
+    ):
+        self.game = Game(game_id, connections)
+        self.model = model
+        self.response_mode = response_mode
+        self.prompt = prompt
+        self.score_one_away = score_one_away
+        self.solver = GroupSolver(self.game.get_game_state().get_remaining_words())
+        self.ai_requests = 0
+
+    def play_turn(self):
+        self.__print_turn_header()
+        neighbours = self.__get_one_away_neighbours()
+        if neighbours:
+            scores = self.__get_ai().score_candidate_groups(neighbours)
+            self.__add_scores(neighbours, scores)
+        guess = self.__get_next_attempt()
+        while guess is None and self.ai_requests < MAX_AI_REQUESTS:
+            self.__add_guesses(self.__get_ai().get_initial_guesses())
+            guess = self.__get_next_attempt()
+        self.__attempt_or_quit(guess)
+
+    async def play_turn_async(self):
+        self.__print_turn_header()
+        neighbours = self.__get_one_away_neighbours()
+        if neighbours:
+            scores = await self.__get_ai().score_candidate_groups_async(neighbours)
+            self.__add_scores(neighbours, scores)
+        guess = self.__get_next_attempt()
+        while guess is None and self.ai_requests < MAX_AI_REQUESTS:
+            self.__add_guesses(await self.__get_ai().get_initial_guesses_async())
+            guess = self.__get_next_attempt()
+        await asyncio.to_thread(self.__attempt_or_quit, guess)
+
+    def __get_ai(self) -> AI:
+        return AI(
+            self.game.get_game_state(), self.model, self.response_mode, self.prompt
+        )
+
+    def __get_one_away_neighbours(self) -> List[Set[str]]:
+        """Return the groups to score if the latest attempt was one away."""
+        attempts = self.game.get_game_state().get_attempts()
+        if not self.score_one_away or len(attempts) == 0:
+            return []
+        if attempts[-1].result != AttemptResultStatus.ONE_AWAY:
+            return []
+        return self.solver.get_one_swap_neighbours(attempts[-1].words, attempts)
+
+    def __print_turn_header(self):
+        print(f"====Player turn {self.game.get_game_state().get_turn_number()}====")
+        print(self.game.get_game_state())
+
+    def __add_guesses(self, ai_guesses: List[AIGuess]):
+        self.ai_requests += 1
+        print("==AI guess==")
+        for guess in ai_guesses:
+            print(guess)
+        self.solver.add_candidates([guess.get_words() for guess in ai_guesses])
+
+    def __add_scores(self, groups: List[Set[str]], scores: List[float]):
+        print("==AI scores==")
+        ranked = sorted(zip(scores, groups), key=lambda item: item[0], reverse=True)
+        for score, words in ranked[:3]:
+            print(f"{score:.2f}: {sorted(words)}")
+        self.solver.add_scored_candidates(groups, scores)
+
+    def __get_next_attempt(self) -> Optional[Set[str]]:
+        return self.solver.get_next_attempt(self.game.get_game_state().get_attempts())
+
+    def __attempt_or_quit(self, guess: Optional[Set[str]]):
+        if guess is None:
+            self.game.get_game_state().quit()
+            return
+        print("==Connections Result==")
+        result = self.game.attempt_group(guess)
+        print(result.pretty_str(), "\n\n")
+
+    def play_game(self) -> GameResult:
+        game_state = self.game.get_game_state()
+        with track_game(type(self).__name__, self.model) as game_metrics:
+            while not game_state.is_game_over():
+                self.play_turn()
+        return self.__get_game_result(game_metrics)
+
+    async def play_game_async(self) -> GameResult:
+        game_state = self.game.get_game_state()
+        with track_game(type(self).__name__, self.model) as game_metrics:
+            while not game_state.is_game_over():
+                await self.play_turn_async()
+        return self.__get_game_result(game_metrics)
+
+    def __get_game_result(self, game_metrics: GameMetrics) -> GameResult:
+        game_state = self.game.get_game_state()
+        game_over_message = get_game_over_message(
+            game_state.get_game_id(),
+            game_state.get_attempts(),
+            game_state.get_game_status(),
+        )
+        print(game_over_message)
+        groups_identified = get_number_of_correct_groups(game_state.get_attempts())
+        total_attempts = len(game_state.get_attempts())
+        record_game_result(game_metrics, groups_identified, total_attempts)
+        return GameResult(
+            game_state.get_game_id(),
+            groups_identified,
+            total_attempts,
+            game_metrics.get_as_dict(),
+        )
@@ -0,0 +1,62 @@
+"""Format requests to score candidate groups, and parse the model's scores."""
+
+import json
+from typing import List, Optional, Set
+
+CANDIDATE_GROUPS_HEADING = "Candidate groups:"
+REMAINING_WORDS_HEADING = "Remaining words:"
+
+
+def get_candidate_groups_content(
+    candidates: List[Set[str]], remaining_words: Set[str]
+) -> str:
+    """Return the candidates and the remaining words, one JSON list per line.
+
+    Words are sorted, so the same candidates always make the same request.
+    """
+    lines = [CANDIDATE_GROUPS_HEADING]
+    lines.extend(json.dumps(sorted(candidate)) for candidate in candidates)
+    lines.append(REMAINING_WORDS_HEADING)
+    lines.append(json.dumps(sorted(remaining_words)))
+    return "\n".join(lines)
+
+
+def parse_candidate_groups(content: str) -> Optional[List[Set[str]]]:
+    """Return the candidates in the content, or None if it has none."""
+    lines = content.splitlines()
+    if CANDIDATE_GROUPS_HEADING not in lines:
+        return None
+    start = lines.index(CANDIDATE_GROUPS_HEADING) + 1
+    candidates = []
+    for line in lines[start:]:
+        if line == REMAINING_WORDS_HEADING:
+            break
+        candidates.append({word.upper() for word in json.loads(line)})
+    return candidates
+
+
+def parse_candidate_scores(json_string: str, number_of_candidates: int) -> List[float]:
+    """Parse the `{scores: number[]}` response into one score per candidate.
+
+    A bare list of scores is accepted too. Scores are clamped to between 0 and
+    1, and a candidate without a score gets 0, as does every candidate if the
+    response is neither.
+    """
+    try:
+        data = json.loads(json_string)
+    except json.JSONDecodeError:
+        data = None
+    if isinstance(data, dict):
+        scores = data.get("scores", [])
+    elif isinstance(data, list):
+        scores = data
+    else:
+        scores = []
+    parsed_scores: List[float] = []
+    for i in range(number_of_candidates):
+        try:
+            score = float(scores[i])
+        except (IndexError, TypeError, ValueError):
+            score = 0.0
+        parsed_scores.append(min(max(score, 0.0), 1.0))
+    return parsed_scores
@@ -0,0 +1,94 @@
+"""Parse the model's free-text groupings without another model call."""
+
+import re
+from typing import List, Optional, Set, Tuple
+
+# Matches list markers such as "-", "*", "1." or "2)" at the start of a line
+LIST_MARKER_PATTERN = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s*")
+WORD_STRIP_CHARACTERS = " \t\"'`*.;()[]"
+
+
+def parse_group_line(
+    line: str, remaining_words: Set[str]
+) -> Optional[Tuple[str, Set[str]]]:
+    """Parse a `Theme: Word, Word, Word, Word` line into its theme and words.
+
+    Returns None if the line is not a group of 4 of the remaining words.
+    """
+    line = LIST_MARKER_PATTERN.sub("", line.replace("**", ""))
+    if ":" not in line:
+        return None
+    theme, words_string = line.split(":", 1)
+    words: Set[str] = set()
+    for word in words_string.split(","):
+        word = word.strip(WORD_STRIP_CHARACTERS)
+        if word.lower().startswith("and "):
+            word = word[len("and ") :].strip(WORD_STRIP_CHARACTERS)
+        word = word.upper()
+        if word not in remaining_words:
+            return None
+        words.add(word)
+    if len(words) != 4:
+        return None
+    return theme.strip(WORD_STRIP_CHARACTERS), words
+
+
+def parse_text_groups(
+    text: str, remaining_words: Set[str]
+) -> Optional[List[Tuple[str, Set[str]]]]:
+    """Parse every group in the response, in the order they were given.
+
+    Returns None unless the response has exactly one group for every 4
+    remaining words and no word is used twice, so that anything unusual falls
+    back to asking the model to convert its response to JSON.
+    """
+    upper_remaining_words = {word.upper() for word in remaining_words}
+    groups: List[Tuple[str, Set[str]]] = []
+    used_words: Set[str] = set()
+    for line in text.splitlines():
+        group = parse_group_line(line, upper_remaining_words)
+        if group is None:
+            continue
+        if used_words & group[1]:
+            return None
+        used_words |= group[1]
+        groups.append(group)
+    if len(groups) != len(upper_remaining_words) // 4:
+        return None
+    return groups
+
+
+class IncrementalGuessParser:
+    """Parses groups out of a response as it streams in, line by line."""
+
+    def __init__(self, remaining_words: Set[str]):
+        self.remaining_words = {word.upper() for word in remaining_words}
+        self.used_words: Set[str] = set()
+        self.buffer = ""
+        self.text = ""
+
+    def __parse_line(self, line: str) -> List[Tuple[str, Set[str]]]:
+        group = parse_group_line(line, self.remaining_words)
+        if group is None or self.used_words & group[1]:
+            return []
+        self.used_words |= group[1]
+        return [group]
+
+    def feed(self, content: str) -> List[Tuple[str, Set[str]]]:
+        """Add streamed content and return the groups completed by it."""
+        self.text += content
+        self.buffer += content
+        groups: List[Tuple[str, Set[str]]] = []
+        while "\n" in self.buffer:
+            line, self.buffer = self.buffer.split("\n", 1)
+            groups += self.__parse_line(line)
+        return groups
+
+    def finish(self) -> List[Tuple[str, Set[str]]]:
+        """Return the group on the final line, once the stream has ended."""
+        line, self.buffer = self.buffer, ""
+        return self.__parse_line(line)
+
+    def get_number_of_missing_groups(self) -> int:
+        """Return how many groups the response has yet to provide."""
+        return (len(self.remaining_words) - len(self.used_words)) // 4
@@ -0,0 +1,218 @@
+"""Write-ahead journal of every turn, for resuming games after a crash.
+
+Each model response and each attempt is appended to a JSON lines file as it
+happens. Writes go to the file's buffer and a background thread flushes and
+fsyncs them in batches, so journaling never waits on the disk. A crash loses
+at most the last `seconds_between_fsyncs` of records.
+
+A game that was journaled but not finished is resumed by playing it again
+from the start with its journaled responses served in order in place of
+model requests. The attempts are submitted again as well, which rebuilds the
+GameState and brings a fresh browser session back in sync with the game.
+"""
+
+import atexit
+import json
+import os
+import threading
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Deque, Dict, Iterator, List, Optional, Set
+from game_types.game_types import AttemptResultStatus
+from results_tracker import GameResult
+
+JOURNAL_FOLDER = "output/journals"
+DEFAULT_SECONDS_BETWEEN_FSYNCS = 0.05
+
+
+class Journal:
+    """Class for appending turn records to a journal file and reading them back."""
+
+    def __init__(
+        self,
+        file_name: str,
+        seconds_between_fsyncs: float = DEFAULT_SECONDS_BETWEEN_FSYNCS,
+    ):
+        self.file_name = file_name
+        self.seconds_between_fsyncs = seconds_between_fsyncs
+        self.records: Dict[int, List[dict]] = defaultdict(list)
+        # The finished record of each game journaled through to its end
+        self.finished_records: Dict[int, dict] = {}
+        self.__load()
+        directory = os.path.dirname(file_name)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Kept open for appending until close
+        self.file = open(  # pylint: disable=consider-using-with
+            file_name, "a", encoding="utf-8"
+        )
+        self.lock = threading.Lock()
+        self.has_unsynced_records = False
+        self.closed = threading.Event()
+        self.sync_thread = threading.Thread(
+            target=self.__sync_periodically, daemon=True
+        )
+        self.sync_thread.start()
+        atexit.register(self.close)
+
+    def __load(self):
+        """Read the records of every game, ignoring a torn last line."""
+        try:
+            with open(self.file_name, "r", encoding="utf-8") as journal_file:
+                lines = journal_file.read().split("\n")
+        except FileNotFoundError:
+            return
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            game_id = record["game_id"]
+            if record["type"] == "restart":
+                self.records[game_id] = []
+                self.finished_records.pop(game_id, None)
+            elif record["type"] == "finished":
+                self.finished_records[game_id] = record
+            else:
+                self.records[game_id].append(record)
+
+    def append(self, record: dict):
+        """Append the record. It is written to disk by the next batched fsync."""
+        line = json.dumps(record, separators=(",", ":"))
+        with self.lock:
+            # Start on a new line in case a crash left the last one torn
+            self.file.write(f"\n{line}")
+            self.has_unsynced_records = True
+
+    def sync(self):
+        """Flush and fsync every record appended so far."""
+        with self.lock:
+            if not self.has_unsynced_records or self.file.closed:
+                return
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.has_unsynced_records = False
+
+    def __sync_periodically(self):
+        while not self.closed.wait(self.seconds_between_fsyncs):
+            self.sync()
+
+    def close(self):
+        """Sync the remaining records and close the file."""
+        if self.closed.is_set():
+            return
+        self.closed.set()
+        self.sync_thread.join()
+        self.sync()
+        with self.lock:
+            self.file.close()
+
+    def get_finished_result(self, game_id: int) -> Optional[GameResult]:
+        """Return the result of the game if it was journaled through to its end."""
+        record = self.finished_records.get(game_id)
+        if record is None:
+            return None
+        return GameResult(
+            game_id, record["groups_identified"], record["total_attempts"]
+        )
+
+    @contextmanager
+    def track_game(self, game_id: int) -> Iterator["GameJournal"]:
+        """Journal the game played in the with block, resuming it if journaled."""
+        game_journal = GameJournal(self, game_id, self.records.pop(game_id, []))
+        token = current_game_journal.set(game_journal)
+        try:
+            yield game_journal
+        finally:
+            current_game_journal.reset(token)
+
+
+class GameJournal:
+    """Class for journaling one game and replaying what was journaled before.
+
+    If the replay diverges from the journal, for example because the live game
+    answered an attempt differently, the journaled records are discarded and
+    the game carries on live from there.
+    """
+
+    def __init__(self, journal: Journal, game_id: int, records: List[dict]):
+        self.journal = journal
+        self.game_id = game_id
+        self.replayed_responses: Deque[dict] = deque(
+            record for record in records if record["type"] == "response"
+        )
+        self.replayed_attempts: Deque[dict] = deque(
+            record for record in records if record["type"] == "attempt"
+        )
+        # Journaled records this run has repeated so far
+        self.repeated_records: List[dict] = []
+        if len(records) > 0:
+            print(f"Resuming game {game_id} from {len(records)} journaled records")
+
+    def is_resuming(self) -> bool:
+        """Determine if journaled responses are still to be replayed."""
+        return len(self.replayed_responses) > 0
+
+    def get_replayed_response(self, response_format: str) -> Optional[str]:
+        """Return the content of the next journaled response, if there is one."""
+        if len(self.replayed_responses) == 0:
+            return None
+        if self.replayed_responses[0]["response_format"] != response_format:
+            self.__stop_replaying()
+            return None
+        record = self.replayed_responses.popleft()
+        self.repeated_records.append(record)
+        return record["content"]
+
+    def record_response(self, response_format: str, content: str):
+        """Journal a response received from the model."""
+        self.journal.append(
+            {
+                "type": "response",
+                "game_id": self.game_id,
+                "response_format": response_format,
+                "content": content,
+            }
+        )
+
+    def record_attempt(self, words: Set[str], result: AttemptResultStatus):
+        """Journal an attempt, unless it repeats a journaled one."""
+        record = {
+            "type": "attempt",
+            "game_id": self.game_id,
+            "words": sorted(words),
+            "result": result.name,
+        }
+        if len(self.replayed_attempts) > 0:
+            if self.replayed_attempts[0] == record:
+                self.repeated_records.append(self.replayed_attempts.popleft())
+                return
+            self.__stop_replaying()
+        self.journal.append(record)
+
+    def record_finished(self, groups_identified: int, total_attempts: int):
+        """Journal that the game is over."""
+        self.journal.append(
+            {
+                "type": "finished",
+                "game_id": self.game_id,
+                "groups_identified": groups_identified,
+                "total_attempts": total_attempts,
+            }
+        )
+
+    def __stop_replaying(self):
+        """Replace the journaled game with what this run has played so far."""
+        print(f"Game {self.game_id} diverged from its journal, playing it live")
+        self.replayed_responses.clear()
+        self.replayed_attempts.clear()
+        self.journal.append({"type": "restart", "game_id": self.game_id})
+        for record in self.repeated_records:
+            self.journal.append(record)
+        self.repeated_records = []
+
+
+current_game_journal: ContextVar[Optional[GameJournal]] = ContextVar(
+    "current_game_journal", default=None
+)
@@ -0,0 +1,317 @@
+"""Runtime metrics: tokens, cost, latencies and attempts per game.
+
+Metrics are recorded in the process-wide `metrics` registry, labelled by model
+and player class, and exported as Prometheus text or a JSON snapshot. The
+metrics of the game being played in the current thread or task are also
+collected in a GameMetrics attached to its GameResult.
+"""
+
+import json
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Dollars per 1,000 prompt and completion tokens
+MODEL_PRICES_PER_1K_TOKENS: Dict[str, Tuple[float, float]] = {
+    "gpt-4": (0.03, 0.06),
+    "gpt-4-32k": (0.06, 0.12),
+    "gpt-4-1106-preview": (0.01, 0.03),
+    "gpt-3.5-turbo": (0.001, 0.002),
+    "gpt-3.5-turbo-1106": (0.001, 0.002),
+}
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+ATTEMPT_BUCKETS = (4, 5, 6, 7, 8)
+METRIC_NAME_PREFIX = "connections_"
+CHARACTERS_PER_TOKEN = 4
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def get_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """Return the dollar cost of the tokens, or 0 for a model without a price."""
+    prompt_price, completion_price = MODEL_PRICES_PER_1K_TOKENS.get(model, (0, 0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+
+
+def estimate_tokens(text: str) -> int:
+    """Roughly estimate how many tokens the text is."""
+    return max(1, len(text) // CHARACTERS_PER_TOKEN)
+
+
+def estimate_usage(messages: List[dict], completion: str) -> dict:
+    """Estimate the usage block of a request that did not report one."""
+    prompt_tokens = sum(estimate_tokens(message["content"]) for message in messages)
+    completion_tokens = estimate_tokens(completion)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+class Histogram:
+    """Class for representing a cumulative Prometheus-style histogram."""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = list(buckets)
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        """Add a value to the histogram."""
+        self.bucket_counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def get_cumulative_counts(self) -> List[Tuple[str, int]]:
+        """Return the count of values at or below each bucket bound."""
+        cumulative_counts = []
+        running_count = 0
+        bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+        for bound, bucket_count in zip(bounds, self.bucket_counts):
+            running_count += bucket_count
+            cumulative_counts.append((bound, running_count))
+        return cumulative_counts
+
+
+def format_labels(labels: Labels, extra: str = "") -> str:
+    """Format labels the way Prometheus text exposition does."""
+    parts = [f'{name}="{value}"' for name, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class MetricsRegistry:
+    """Class for recording labelled counters and histograms."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+
+    def increment(
+        self, name: str, value: float = 1, labels: Optional[Dict[str, str]] = None
+    ):
+        """Add the value to the counter."""
+        key = tuple(sorted((labels or {}).items()))
+        with self.lock:
+            counter = self.counters.setdefault(name, {})
+            counter[key] = counter.get(key, 0) + value
+
+    def observe(
+        self,
+        name: str,
+        value: float,
+        labels: Optional[Dict[str, str]] = None,
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        """Add the value to the histogram."""
+        key = tuple(sorted((labels or {}).items()))
+        with self.lock:
+            histogram = self.histograms.setdefault(name, {})
+            if key not in histogram:
+                histogram[key] = Histogram(buckets)
+            histogram[key].observe(value)
+
+    def get_counter_total(self, name: str) -> float:
+        """Return the counter summed over every label set."""
+        with self.lock:
+            return sum(self.counters.get(name, {}).values())
+
+    def get_snapshot(self) -> dict:
+        """Return every metric, plus derived throughput and cost figures."""
+        with self.lock:
+            counters = {
+                name: [
+                    {"labels": dict(labels), "value": value}
+                    for labels, value in series.items()
+                ]
+                for name, series in self.counters.items()
+            }
+            histograms = {
+                name: [
+                    {
+                        "labels": dict(labels),
+                        "count": histogram.count,
+                        "sum": histogram.sum,
+                        "buckets": dict(histogram.get_cumulative_counts()),
+                    }
+                    for labels, histogram in series.items()
+                ]
+                for name, series in self.histograms.items()
+            }
+        tokens = self.get_counter_total("prompt_tokens") + self.get_counter_total(
+            "completion_tokens"
+        )
+        solved_groups = self.get_counter_total("groups_identified")
+        elapsed_hours = (time.time() - self.start_time) / 3600
+        return {
+            "counters": counters,
+            "histograms": histograms,
+            "tokens_per_solved_group": tokens / solved_groups if solved_groups else None,
+            "dollars_per_hour": self.get_counter_total("cost_dollars") / elapsed_hours,
+        }
+
+    def to_prometheus_text(self) -> str:
+        """Return every metric in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            for name, series in sorted(self.counters.items()):
+                metric_name = f"{METRIC_NAME_PREFIX}{name}_total"
+                lines.append(f"# TYPE {metric_name} counter")
+                for labels, value in series.items():
+                    lines.append(f"{metric_name}{format_labels(labels)} {value}")
+            for name, series in sorted(self.histograms.items()):
+                metric_name = f"{METRIC_NAME_PREFIX}{name}"
+                lines.append(f"# TYPE {metric_name} histogram")
+                for labels, histogram in series.items():
+                    for bound, count in histogram.get_cumulative_counts():
+                        bucket_labels = format_labels(labels, f'le="{bound}"')
+                        lines.append(f"{metric_name}_bucket{bucket_labels} {count}")
+                    lines.append(
+                        f"{metric_name}_sum{format_labels(labels)} {histogram.sum}"
+                    )
+                    lines.append(
+                        f"{metric_name}_count{format_labels(labels)} {histogram.count}"
+                    )
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, file_name: str):
+        """Write the metrics as a Prometheus text file."""
+        with open(file_name, "w") as metrics_file:
+            metrics_file.write(self.to_prometheus_text())
+
+    def write_json(self, file_name: str):
+        """Write a JSON snapshot of the metrics."""
+        with open(file_name, "w") as metrics_file:
+            json.dump(self.get_snapshot(), metrics_file, indent=2)
+
+
+metrics = MetricsRegistry()
+
+
+class GameMetrics:
+    """Class for collecting the metrics of a single game."""
+
+    def __init__(self, player_class: str, model: str):
+        self.player_class = player_class
+        self.model = model
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost_dollars = 0.0
+        self.requests = 0
+        self.request_seconds = 0.0
+        self.retries = 0
+        self.browser_wait_seconds = 0.0
+
+    def get_labels(self) -> Dict[str, str]:
+        """Return the labels for metrics recorded during this game."""
+        return {"player": self.player_class, "model": self.model}
+
+    def get_as_dict(self) -> dict:
+        """Return the metrics as a dictionary."""
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cost_dollars": self.cost_dollars,
+            "requests": self.requests,
+            "request_seconds": self.request_seconds,
+            "retries": self.retries,
+            "browser_wait_seconds": self.browser_wait_seconds,
+        }
+
+
+current_game_metrics: ContextVar[Optional[GameMetrics]] = ContextVar(
+    "current_game_metrics", default=None
+)
+
+
+@contextmanager
+def track_game(player_class: str, model: str) -> Iterator[GameMetrics]:
+    """Collect the metrics of the game played in the with block."""
+    game_metrics = GameMetrics(player_class, model)
+    token = current_game_metrics.set(game_metrics)
+    try:
+        yield game_metrics
+    finally:
+        current_game_metrics.reset(token)
+
+
+def record_game_result(
+    game_metrics: GameMetrics, groups_identified: int, total_attempts: int
+):
+    """Record the outcome of a finished game."""
+    labels = game_metrics.get_labels()
+    metrics.increment("games", labels=labels)
+    metrics.increment("groups_identified", groups_identified, labels)
+    metrics.observe("attempts_per_game", total_attempts, labels, ATTEMPT_BUCKETS)
+
+
+def record_request(model: str, seconds: float, usage: Optional[dict], status: str):
+    """Record an API request, its latency and the tokens it used."""
+    game_metrics = current_game_metrics.get()
+    labels = {"model": model}
+    if game_metrics is not None:
+        labels["player"] = game_metrics.player_class
+    metrics.increment("requests", labels={**labels, "status": status})
+    metrics.observe("request_seconds", seconds, labels)
+    prompt_tokens = usage.get("prompt_tokens", 0) if usage else 0
+    completion_tokens = usage.get("completion_tokens", 0) if usage else 0
+    cost = get_cost(model, prompt_tokens, completion_tokens)
+    metrics.increment("prompt_tokens", prompt_tokens, labels)
+    metrics.increment("completion_tokens", completion_tokens, labels)
+    metrics.increment("cost_dollars", cost, labels)
+    if game_metrics is not None:
+        game_metrics.requests += 1
+        game_metrics.request_seconds += seconds
+        game_metrics.prompt_tokens += prompt_tokens
+        game_metrics.completion_tokens += completion_tokens
+        game_metrics.cost_dollars += cost
+
+
+def record_retry(model: str):
+    """Record that a request is being retried."""
+    metrics.increment("retries", labels={"model": model})
+    game_metrics = current_game_metrics.get()
+    if game_metrics is not None:
+        game_metrics.retries += 1
+
+
+def record_rate_limit_wait(model: str, seconds: float):
+    """Record time a request waited for the model's rate limit budget."""
+    metrics.observe("rate_limit_wait_seconds", seconds, {"model": model})
+
+
+def record_hedged_request(model: str, winner: str):
+    """Record a request that was sent twice, and which attempt answered first."""
+    metrics.increment("hedged_requests", labels={"model": model, "winner": winner})
+
+
+def record_browser_wait(seconds: float):
+    """Record time spent waiting on the browser."""
+    game_metrics = current_game_metrics.get()
+    labels = {} if game_metrics is None else {"player": game_metrics.player_class}
+    metrics.observe("browser_wait_seconds", seconds, labels)
+    if game_metrics is not None:
+        game_metrics.browser_wait_seconds += seconds
+
+
+def record_page_load(seconds: float, navigation: str):
+    """Record how long a game took to load, by full or client-side navigation."""
+    metrics.observe("page_load_seconds", seconds, {"navigation": navigation})
+
+
+def record_failed_game(error: BaseException):
+    """Record a game that was abandoned because it raised."""
+    metrics.increment("failed_games", labels={"error": type(error).__name__})
+
+
+def record_prefetched_response(status: str):
+    """Record whether a response requested ahead of its game was used."""
+    metrics.increment("prefetched_responses", labels={"status": status})
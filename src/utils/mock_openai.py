@@ -0,0 +1,246 @@
+"""In-process stand-in for OpenAI's chat completions API, for benchmarking.
+
+Install it with `set_chat_completion_backend(MockChatCompletion(...))` so that
+every request made through utils.openai_wrapper is answered locally, with
+configurable latency, errors and rate limiting.
+"""
+
+import asyncio
+import json
+import random
+import threading
+import time
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Set
+from offline_connections import Puzzle, PuzzleGroup
+from utils.candidate_scoring import parse_candidate_groups
+from utils.guess_parser import parse_text_groups
+from utils.metrics import estimate_usage
+
+SECONDS_TO_FIRST_TOKEN_FRACTION = 0.3
+CHARACTERS_PER_CHUNK = 8
+# Scores given to correct and incorrect candidate groups when accurate
+CORRECT_GROUP_SCORE = 0.9
+INCORRECT_GROUP_SCORE = 0.05
+
+LatencyDistribution = Callable[[random.Random], float]
+
+
+def constant_latency(seconds: float) -> LatencyDistribution:
+    """Every request takes the given number of seconds."""
+    return lambda _: seconds
+
+
+def uniform_latency(
+    minimum_seconds: float, maximum_seconds: float
+) -> LatencyDistribution:
+    """Request latency is uniformly distributed between the bounds."""
+    return lambda rng: rng.uniform(minimum_seconds, maximum_seconds)
+
+
+def lognormal_latency(
+    median_seconds: float, sigma: float = 0.5
+) -> LatencyDistribution:
+    """Request latency has a long tail, like the real API."""
+    return lambda rng: rng.lognormvariate(0, sigma) * median_seconds
+
+
+def get_prompt_words(messages: List[dict]) -> Optional[Set[str]]:
+    """Return the words from the latest line that is a JSON list of words."""
+    for message in reversed(messages):
+        for line in reversed(message["content"].splitlines()):
+            try:
+                words = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(words, list) and all(isinstance(w, str) for w in words):
+                return {word.upper() for word in words}
+    return None
+
+
+def format_groups(groups: List[PuzzleGroup], response_format: str) -> str:
+    """Format the groups the way the model answers in the given format."""
+    if response_format == "json_object":
+        json_groups = [
+            {"words": sorted(group.words), "theme": group.theme} for group in groups
+        ]
+        return json.dumps({"groups": json_groups})
+    return "\n".join(
+        f"- {group.theme}: {', '.join(sorted(group.words))}" for group in groups
+    )
+
+
+class MockChatCompletion:
+    """Fake `openai.ChatCompletion` answering from puzzles or a script.
+
+    With `puzzles`, the answer is the solution of the puzzle whose words were
+    sent, with each group kept intact with probability `accuracy` and
+    otherwise given a word from another group. Candidate groups sent to be
+    scored are scored correctly with probability `accuracy`, and otherwise an
+    incorrect candidate gets the score of a correct one. With `script`, the given
+    contents are returned in order, cycling. `error_rate` and
+    `rate_limit_rate` are the probabilities of a request failing with an API
+    error or a 429.
+    """
+
+    def __init__(
+        self,
+        puzzles: Optional[Dict[int, Puzzle]] = None,
+        script: Optional[List[str]] = None,
+        latency: LatencyDistribution = constant_latency(0),
+        accuracy: float = 1.0,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        if puzzles is None and script is None:
+            raise ValueError("MockChatCompletion needs puzzles or a script.")
+        self.puzzles = puzzles or {}
+        self.script = script or []
+        self.latency = latency
+        self.accuracy = accuracy
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.words_to_puzzle: Dict[frozenset, Puzzle] = {}
+        for puzzle in self.puzzles.values():
+            self.words_to_puzzle[frozenset(puzzle.get_words())] = puzzle
+
+    def __find_groups(self, words: Set[str]) -> List[PuzzleGroup]:
+        for puzzle_words, puzzle in self.words_to_puzzle.items():
+            if words <= puzzle_words:
+                return [group for group in puzzle.groups if group.words <= words]
+        raise ValueError(f"No puzzle has the words {sorted(words)}.")
+
+    def __guess_groups(self, words: Set[str]) -> List[PuzzleGroup]:
+        """Return the solution groups, swapping words out of inaccurate ones."""
+        groups = [
+            PuzzleGroup(set(group.words), group.theme)
+            for group in self.__find_groups(words)
+        ]
+        self.rng.shuffle(groups)
+        for i, group in enumerate(groups[:-1]):
+            if self.rng.random() < self.accuracy:
+                continue
+            other_group = groups[self.rng.randrange(i + 1, len(groups))]
+            word = self.rng.choice(sorted(group.words))
+            other_word = self.rng.choice(sorted(other_group.words))
+            group.words = frozenset((group.words - {word}) | {other_word})
+            other_group.words = frozenset((other_group.words - {other_word}) | {word})
+        return groups
+
+    def __score_candidates(self, candidates: List[Set[str]], words: Set[str]) -> str:
+        """Return the scores of the candidates, as the model would give them."""
+        groups = [group.words for group in self.__find_groups(words)]
+        is_correct = [candidate in groups for candidate in candidates]
+        if self.rng.random() >= self.accuracy:
+            # Confidently wrong, like a guess with a word from another group
+            is_correct = [False] * len(candidates)
+            is_correct[self.rng.randrange(len(candidates))] = True
+        scores = [
+            CORRECT_GROUP_SCORE if correct else INCORRECT_GROUP_SCORE
+            for correct in is_correct
+        ]
+        return json.dumps({"scores": scores})
+
+    def __get_content(self, messages: List[dict], response_format: str) -> str:
+        with self.lock:
+            request_number = self.requests
+            self.requests += 1
+            if self.script:
+                return self.script[request_number % len(self.script)]
+            words = get_prompt_words(messages)
+            if words is None:
+                raise ValueError("No list of words found in the messages.")
+            candidates = parse_candidate_groups(messages[-1]["content"])
+            if candidates is not None:
+                return self.__score_candidates(candidates, words)
+            # Asked to convert an earlier answer, so repeat its groups
+            is_conversion = len(messages) > 1 and messages[-1]["role"] == "system"
+            if is_conversion and messages[-2]["role"] == "assistant":
+                earlier_groups = parse_text_groups(messages[-2]["content"], words)
+                if earlier_groups is not None:
+                    groups = [
+                        PuzzleGroup(group_words, theme)
+                        for theme, group_words in earlier_groups
+                    ]
+                    return format_groups(groups, response_format)
+            groups = self.__guess_groups(words)
+        return format_groups(groups, response_format)
+
+    def __sample_request(self):
+        """Return the latency of a request, or raise the error it fails with."""
+        with self.lock:
+            latency = self.latency(self.rng)
+            outcome = self.rng.random()
+        if outcome >= self.rate_limit_rate + self.error_rate:
+            return latency
+        # Only imported when a request fails, since openai is slow to import
+        # pylint: disable-next=import-outside-toplevel
+        from openai.error import APIError, RateLimitError
+
+        if outcome < self.rate_limit_rate:
+            raise RateLimitError("Rate limit reached.", http_status=429)
+        raise APIError("The server had an error.", http_status=500)
+
+    def __get_response(self, messages: List[dict], content: str) -> dict:
+        return {
+            "object": "chat.completion",
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": estimate_usage(messages, content),
+        }
+
+    def __get_chunks(self, content: str) -> List[dict]:
+        chunks = []
+        for i in range(0, len(content), CHARACTERS_PER_CHUNK):
+            delta = {"content": content[i : i + CHARACTERS_PER_CHUNK]}
+            chunks.append({"choices": [{"index": 0, "delta": delta}]})
+        return chunks
+
+    def __get_seconds_per_chunk(self, latency: float, chunks: List[dict]) -> float:
+        return latency * (1 - SECONDS_TO_FIRST_TOKEN_FRACTION) / len(chunks)
+
+    def create(self, stream: bool = False, **params):
+        """Answer a chat completion request, blocking for its latency."""
+        latency = self.__sample_request()
+        content = self.__get_content(
+            params["messages"], params["response_format"]["type"]
+        )
+        if not stream:
+            time.sleep(latency)
+            return self.__get_response(params["messages"], content)
+        return self.__stream(content, latency)
+
+    def __stream(self, content: str, latency: float) -> Iterator[dict]:
+        chunks = self.__get_chunks(content)
+        time.sleep(latency * SECONDS_TO_FIRST_TOKEN_FRACTION)
+        for chunk in chunks:
+            yield chunk
+            time.sleep(self.__get_seconds_per_chunk(latency, chunks))
+
+    async def acreate(self, stream: bool = False, **params):
+        """Answer a chat completion request without blocking the event loop."""
+        latency = self.__sample_request()
+        content = self.__get_content(
+            params["messages"], params["response_format"]["type"]
+        )
+        if not stream:
+            await asyncio.sleep(latency)
+            return self.__get_response(params["messages"], content)
+        return self.__stream_async(content, latency)
+
+    async def __stream_async(
+        self, content: str, latency: float
+    ) -> AsyncIterator[dict]:
+        chunks = self.__get_chunks(content)
+        await asyncio.sleep(latency * SECONDS_TO_FIRST_TOKEN_FRACTION)
+        for chunk in chunks:
+            yield chunk
+            await asyncio.sleep(self.__get_seconds_per_chunk(latency, chunks))
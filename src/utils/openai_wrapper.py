@@ -1,8 +1,16 @@
 """Helper classes and types for interacting with OpenAI's API."""
 
+import asyncio
+import time
+from contextvars import ContextVar
 from enum import Enum
-from typing import List, Union
-import openai
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Union
+from utils.journal import current_game_journal
+from utils.transcripts import current_game_transcript
+from utils.response_cache import ResponseCache, get_cache_key
+from utils.metrics import estimate_usage, record_prefetched_response, record_request
+from utils.request_scheduler import RequestScheduler
+from utils.timing import phase_timings
 
 
 class OpenAIMessageType(Enum):
@@ -55,25 +63,50 @@ class OpenAIMessageFactory:
         return OpenAIMessage(OpenAIMessageType.ASSISTANT, content)
 
 
+class MessageNode:
+    """Class for representing a message and the messages before it."""
+
+    def __init__(self, message: OpenAIMessage, parent: Optional["MessageNode"]):
+        self.message = message
+        self.parent = parent
+        self.length = 1 if parent is None else parent.length + 1
+
+
 class OpenAIChatBuilder:
-    """Class for building a chat with OpenAI's API."""
+    """Class for building a chat with OpenAI's API.
+
+    Builders are immutable linked lists of messages, so `with_message` shares
+    every earlier message instead of copying them.
+    """
 
     def __init__(
         self, messages: Union[List[OpenAIMessage], "OpenAIChatBuilder", None] = None
     ):
+        self.last_node: Optional[MessageNode] = None
         if isinstance(messages, OpenAIChatBuilder):
-            self.messages = messages.get_messages()
+            self.last_node = messages.last_node
         else:
-            self.messages = messages or []
+            for message in messages or []:
+                self.last_node = MessageNode(message, self.last_node)
 
     def with_message(self, message: OpenAIMessage) -> "OpenAIChatBuilder":
         """Add the given message to the chat."""
-        new_messages = self.messages + [message]
-        return OpenAIChatBuilder(new_messages)
+        chat_builder = OpenAIChatBuilder()
+        chat_builder.last_node = MessageNode(message, self.last_node)
+        return chat_builder
 
     def get_messages(self) -> List[OpenAIMessage]:
         """Return the messages in the chat."""
-        return self.messages
+        messages = []
+        node = self.last_node
+        while node is not None:
+            messages.append(node.message)
+            node = node.parent
+        messages.reverse()
+        return messages
+
+    def __len__(self):
+        return 0 if self.last_node is None else self.last_node.length
 
 
 class ResponseFormat(Enum):
@@ -85,6 +118,125 @@ class ResponseFormat(Enum):
 
 JSON_MODEL_TO_USE = "gpt-4-1106-preview"
 
+# Limits how many async requests are in flight at once. Set per run by the
+# async game runner; tasks inherit it through their context.
+api_semaphore: ContextVar[Optional[asyncio.Semaphore]] = ContextVar(
+    "api_semaphore", default=None
+)
+
+# Object whose create / acreate make chat completion requests. Swapped for a
+# fake, such as utils.mock_openai.MockChatCompletion, to run without the API.
+# None means openai.ChatCompletion, imported on first use since openai is slow
+# to import.
+chat_completion_backend = None
+
+
+def set_chat_completion_backend(backend):
+    """Send chat completion requests to the given backend."""
+    global chat_completion_backend  # pylint: disable=global-statement
+    chat_completion_backend = backend
+
+
+def get_chat_completion_backend() -> Any:
+    """Return the backend requests are sent to."""
+    if chat_completion_backend is None:
+        import openai  # pylint: disable=import-outside-toplevel
+
+        set_chat_completion_backend(openai.ChatCompletion)
+    return chat_completion_backend
+
+
+# Cache shared by every request, if enabled
+response_cache: Optional[ResponseCache] = None
+
+
+def set_response_cache(cache: Optional[ResponseCache]):
+    """Cache responses in the given cache, or stop caching if None."""
+    global response_cache  # pylint: disable=global-statement
+    response_cache = cache
+
+
+# Budgets, retries and hedges every request
+request_scheduler = RequestScheduler()
+
+
+def set_request_scheduler(scheduler: RequestScheduler):
+    """Send requests through the given scheduler."""
+    global request_scheduler  # pylint: disable=global-statement
+    request_scheduler = scheduler
+
+
+def get_request_params(
+    messages: List[OpenAIMessage],
+    response_format: ResponseFormat,
+    model: str,
+) -> dict:
+    """Return the parameters for a chat completion request."""
+    return {
+        "model": model,
+        "messages": [message.get_as_dict() for message in messages],
+        "temperature": 1,
+        "max_tokens": 256,
+        "top_p": 1,
+        "frequency_penalty": 0,
+        "presence_penalty": 0,
+        "response_format": {"type": response_format.value},
+    }
+
+
+def get_response_from_content(content: str) -> dict:
+    """Return a chat completion response holding the given content."""
+    return {"choices": [{"message": {"role": "assistant", "content": content}}]}
+
+
+def get_chunk_content(chunk) -> str:
+    """Return the content delta of a streamed chat completion chunk."""
+    return chunk["choices"][0]["delta"].get("content") or ""  # type: ignore
+
+
+def get_response_message(response) -> OpenAIMessage:
+    """Return the assistant message of a chat completion response."""
+    response_content: str = response["choices"][0]["message"]["content"]  # type: ignore
+    return OpenAIMessageFactory.get_assistant_message(response_content)
+
+
+def get_replayed_content(
+    params: dict, response_format: ResponseFormat
+) -> Optional[str]:
+    """Return the next journaled response of the game being resumed, if any.
+
+    The response is recorded in the game's transcript, if it has one.
+    """
+    game_journal = current_game_journal.get()
+    if game_journal is None:
+        return None
+    content = game_journal.get_replayed_response(response_format.value)
+    if content is not None:
+        transcribe_content(params, response_format, content)
+    return content
+
+
+def record_content(params: dict, response_format: ResponseFormat, content: str):
+    """Journal and transcribe the response for the game being played."""
+    game_journal = current_game_journal.get()
+    if game_journal is not None:
+        game_journal.record_response(response_format.value, content)
+    transcribe_content(params, response_format, content)
+
+
+def transcribe_content(
+    params: dict,
+    response_format: ResponseFormat,
+    content: str,
+    complete: bool = True,
+):
+    """Record the response in the game's transcript, if it is being recorded."""
+    game_transcript = current_game_transcript.get()
+    if game_transcript is not None:
+        game_transcript.record_response(
+            params, response_format.value, content, complete
+        )
+
 
 def getOpenAiResponse(
     messages: List[OpenAIMessage],
@@ -92,18 +244,335 @@ def getOpenAiResponse(
     model: str = JSON_MODEL_TO_USE,
 ) -> OpenAIMessage:
     """Get a response from OpenAI's API."""
-    response = openai.ChatCompletion.create(
-        model=model,
-        messages=[message.get_as_dict() for message in messages],
-        temperature=1,
-        max_tokens=256,
-        top_p=1,
-        frequency_penalty=0,
-        presence_penalty=0,
-        response_format={"type": response_format.value},
+    params = get_request_params(messages, response_format, model)
+    replayed_content = get_replayed_content(params, response_format)
+    if replayed_content is not None:
+        return OpenAIMessageFactory.get_assistant_message(replayed_content)
+    with phase_timings.time(f"openai.{response_format.value}"):
+        if response_cache is None:
+            response = create_chat_completion(params)
+        else:
+            response = response_cache.get_or_create(
+                params, lambda: create_chat_completion(params)
+            )
+    response_message = get_response_message(response)
+    record_content(params, response_format, response_message.get_content())
+    return response_message
+
+
+def create_chat_completion(params: dict):
+    """Call the API through the request scheduler."""
+    return request_scheduler.request(params, create_chat_completion_attempt)
+
+
+def create_chat_completion_attempt(params: dict, timeout_seconds: float):
+    """Call the API once, recording the request's latency and token usage."""
+    start = time.perf_counter()
+    try:
+        response = get_chat_completion_backend().create(
+            request_timeout=timeout_seconds, **params
+        )
+    except Exception:
+        record_request(params["model"], time.perf_counter() - start, None, "error")
+        raise
+    seconds = time.perf_counter() - start
+    record_request(params["model"], seconds, response.get("usage"), "ok")
+    return response
+
+
+async def create_chat_completion_async(params: dict):
+    """Async version of create_chat_completion."""
+    return await request_scheduler.request_async(
+        params, create_chat_completion_attempt_async
     )
-    response_content: str = response["choices"][0]["message"]["content"]  # type: ignore
-    return OpenAIMessageFactory.get_assistant_message(response_content)
+
+
+async def create_chat_completion_attempt_async(params: dict):
+    """Call the API once, waiting for a slot if the run limits concurrency."""
+    semaphore = api_semaphore.get()
+    if semaphore is None:
+        return await create_chat_completion_recorded_async(params)
+    async with semaphore:
+        return await create_chat_completion_recorded_async(params)
+
+
+async def create_chat_completion_recorded_async(params: dict):
+    """Async version of create_chat_completion_attempt."""
+    start = time.perf_counter()
+    try:
+        response = await get_chat_completion_backend().acreate(**params)
+    except asyncio.CancelledError:
+        # Timed out, lost a hedge, or the game was cancelled
+        seconds = time.perf_counter() - start
+        record_request(params["model"], seconds, None, "cancelled")
+        raise
+    except Exception:
+        record_request(params["model"], time.perf_counter() - start, None, "error")
+        raise
+    seconds = time.perf_counter() - start
+    record_request(params["model"], seconds, response.get("usage"), "ok")
+    return response
+
+
+def record_streamed_request(
+    params: dict, start: float, content_parts: List[str], status: str
+):
+    """Record a finished stream. Streams report no usage, so it is estimated."""
+    usage = estimate_usage(params["messages"], "".join(content_parts))
+    record_request(params["model"], time.perf_counter() - start, usage, status)
+
+
+def getOpenAiResponseStream(
+    messages: List[OpenAIMessage],
+    response_format: ResponseFormat,
+    model: str = JSON_MODEL_TO_USE,
+) -> Iterator[str]:
+    """Get a response from OpenAI's API, yielding the content as it arrives."""
+    params = get_request_params(messages, response_format, model)
+    replayed_content = get_replayed_content(params, response_format)
+    if replayed_content is not None:
+        yield replayed_content
+        return
+    cache_key = None
+    if response_cache is not None:
+        cache_key = response_cache.get_sample_key(params)
+        cached_response = response_cache.lookup(cache_key)
+        if cached_response is not None:
+            content = get_response_message(cached_response).get_content()
+            record_content(params, response_format, content)
+            yield content
+            return
+    content_parts: List[str] = []
+    start = time.perf_counter()
+    status = "error"
+    try:
+        chunks = request_scheduler.request(
+            params,
+            lambda params, timeout_seconds: get_chat_completion_backend().create(
+                stream=True, request_timeout=timeout_seconds, **params
+            ),
+            stream=True,
+        )
+        for chunk in chunks:
+            content = get_chunk_content(chunk)
+            if content:
+                if len(content_parts) == 0:
+                    phase_timings.record(
+                        f"openai.stream.first_token.{response_format.value}",
+                        time.perf_counter() - start,
+                    )
+                content_parts.append(content)
+                yield content
+        status = "ok"
+    except GeneratorExit:
+        status = "closed"
+        transcribe_content(params, response_format, "".join(content_parts), False)
+        raise
+    finally:
+        record_streamed_request(params, start, content_parts, status)
+    record_content(params, response_format, "".join(content_parts))
+    if response_cache is not None and cache_key is not None:
+        response_cache.put(cache_key, get_response_from_content("".join(content_parts)))
+
+
+class PrefetchedResponses:
+    """Class for holding the requests sent before the game that needs them.
+
+    Each prefetched response is served once, to the first request of the game
+    with the same parameters. Requests still unused when the game ends are
+    cancelled. A prefetched request is made before the game tracks its
+    metrics, so it counts towards the run's metrics but not the game's.
+    """
+
+    def __init__(self):
+        self.tasks: Dict[str, "asyncio.Task[OpenAIMessage]"] = {}
+
+    def prefetch(self, params: dict, response_format: ResponseFormat):
+        """Send the request now, unless the same one was already sent."""
+        key = get_cache_key(params)
+        if key not in self.tasks:
+            self.tasks[key] = asyncio.ensure_future(
+                request_response_message_async(params, response_format)
+            )
+
+    def pop(self, params: dict) -> Optional["asyncio.Task[OpenAIMessage]"]:
+        """Return the prefetched request with the given parameters, if any."""
+        task = self.tasks.pop(get_cache_key(params), None)
+        if task is not None:
+            record_prefetched_response("used")
+        return task
+
+    def cancel(self):
+        """Cancel every request that was not used."""
+        for task in self.tasks.values():
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                # Retrieve the error so asyncio does not log it as unhandled
+                task.exception()
+            record_prefetched_response("unused")
+        self.tasks.clear()
+
+
+# Prefetched responses of the game being prepared or played. Set per game by
+# the async game runner.
+current_prefetched_responses: ContextVar[Optional[PrefetchedResponses]] = (
+    ContextVar("current_prefetched_responses", default=None)
+)
+
+
+def prefetch_response(
+    messages: List[OpenAIMessage],
+    response_format: ResponseFormat,
+    model: str = JSON_MODEL_TO_USE,
+):
+    """Send the request ahead of time, if the current game takes prefetches."""
+    prefetched_responses = current_prefetched_responses.get()
+    if prefetched_responses is not None:
+        params = get_request_params(messages, response_format, model)
+        prefetched_responses.prefetch(params, response_format)
+
+
+def pop_prefetched_response(
+    params: dict,
+) -> Optional["asyncio.Task[OpenAIMessage]"]:
+    """Return the prefetched request with the given parameters, if any."""
+    prefetched_responses = current_prefetched_responses.get()
+    if prefetched_responses is None:
+        return None
+    return prefetched_responses.pop(params)
+
+
+async def getOpenAiResponseStreamAsync(
+    messages: List[OpenAIMessage],
+    response_format: ResponseFormat,
+    model: str = JSON_MODEL_TO_USE,
+) -> AsyncIterator[str]:
+    """Async version of getOpenAiResponseStream."""
+    params = get_request_params(messages, response_format, model)
+    replayed_content = get_replayed_content(params, response_format)
+    if replayed_content is not None:
+        yield replayed_content
+        return
+    # A prefetched response arrives whole, which beats streaming once it is in
+    prefetched_response = pop_prefetched_response(params)
+    if prefetched_response is not None:
+        content = (await prefetched_response).get_content()
+        record_content(params, response_format, content)
+        yield content
+        return
+    cache_key = None
+    if response_cache is not None:
+        cache_key = response_cache.get_sample_key(params)
+        cached_response = response_cache.lookup(cache_key)
+        if cached_response is not None:
+            content = get_response_message(cached_response).get_content()
+            record_content(params, response_format, content)
+            yield content
+            return
+    content_parts: List[str] = []
+    queue: "asyncio.Queue[Optional[str]]" = asyncio.Queue()
+    reader = asyncio.ensure_future(
+        read_response_stream_async(params, response_format, queue)
+    )
+    try:
+        while True:
+            content = await queue.get()
+            if content is None:
+                break
+            content_parts.append(content)
+            yield content
+        # Raise the error the stream failed with, if any
+        await reader
+    except GeneratorExit:
+        reader.cancel()
+        transcribe_content(params, response_format, "".join(content_parts), False)
+        raise
+    except BaseException:
+        reader.cancel()
+        raise
+    record_content(params, response_format, "".join(content_parts))
+    if response_cache is not None and cache_key is not None:
+        response_cache.put(cache_key, get_response_from_content("".join(content_parts)))
+
+
+async def read_response_stream_async(
+    params: dict,
+    response_format: ResponseFormat,
+    queue: "asyncio.Queue[Optional[str]]",
+):
+    """Put each streamed piece of content in the queue, then None once it ends.
+
+    An API slot is held only while the response streams, not while the caller
+    plays the guesses already streamed, so a slow game can't hold up others.
+    """
+    content_parts: List[str] = []
+    semaphore = api_semaphore.get()
+    if semaphore is not None:
+        await semaphore.acquire()
+    start = time.perf_counter()
+    status = "error"
+    try:
+        # Only opening the stream is retried, and never hedged
+        chunks = await request_scheduler.request_async(
+            params,
+            lambda params: get_chat_completion_backend().acreate(stream=True, **params),
+            stream=True,
+        )
+        async for chunk in chunks:  # type: ignore
+            content = get_chunk_content(chunk)
+            if content:
+                if len(content_parts) == 0:
+                    phase_timings.record(
+                        f"openai.stream.first_token.{response_format.value}",
+                        time.perf_counter() - start,
+                    )
+                content_parts.append(content)
+                queue.put_nowait(content)
+        status = "ok"
+    except asyncio.CancelledError:
+        status = "closed"
+        raise
+    finally:
+        if semaphore is not None:
+            semaphore.release()
+        record_streamed_request(params, start, content_parts, status)
+        queue.put_nowait(None)
+
+
+async def getOpenAiResponseAsync(
+    messages: List[OpenAIMessage],
+    response_format: ResponseFormat,
+    model: str = JSON_MODEL_TO_USE,
+) -> OpenAIMessage:
+    """Get a response from OpenAI's API without blocking the event loop."""
+    params = get_request_params(messages, response_format, model)
+    replayed_content = get_replayed_content(params, response_format)
+    if replayed_content is not None:
+        return OpenAIMessageFactory.get_assistant_message(replayed_content)
+    prefetched_response = pop_prefetched_response(params)
+    if prefetched_response is None:
+        response_message = await request_response_message_async(
+            params, response_format
+        )
+    else:
+        response_message = await prefetched_response
+    record_content(params, response_format, response_message.get_content())
+    return response_message
+
+
+async def request_response_message_async(
+    params: dict, response_format: ResponseFormat
+) -> OpenAIMessage:
+    """Get the response from the cache, or from the API if it is not cached."""
+    with phase_timings.time(f"openai.{response_format.value}"):
+        if response_cache is None:
+            response = await create_chat_completion_async(params)
+        else:
+            response = await response_cache.get_or_create_async(
+                params, lambda: create_chat_completion_async(params)
+            )
+    return get_response_message(response)
 
 
 class OpenAIChat:
@@ -121,6 +590,28 @@ class OpenAIChat:
         """Get a response from OpenAI's API."""
         return getOpenAiResponse(self.messages, ResponseFormat.TEXT, model)
 
-    def get_json_response(self) -> OpenAIMessage:
+    def get_json_response(self, model: str = JSON_MODEL_TO_USE) -> OpenAIMessage:
         """Get a JSON response from OpenAI's API."""
-        return getOpenAiResponse(self.messages, ResponseFormat.JSON)
+        return getOpenAiResponse(self.messages, ResponseFormat.JSON, model)
+
+    def get_response_stream(self, model: str) -> Iterator[str]:
+        """Get a response from OpenAI's API as a stream of content deltas."""
+        return getOpenAiResponseStream(self.messages, ResponseFormat.TEXT, model)
+
+    def get_response_stream_async(self, model: str) -> AsyncIterator[str]:
+        """Get a response from OpenAI's API as an async stream of content deltas."""
+        return getOpenAiResponseStreamAsync(self.messages, ResponseFormat.TEXT, model)
+
+    async def get_response_async(self, model: str) -> OpenAIMessage:
+        """Get a response from OpenAI's API asynchronously."""
+        return await getOpenAiResponseAsync(self.messages, ResponseFormat.TEXT, model)
+
+    async def get_json_response_async(
+        self, model: str = JSON_MODEL_TO_USE
+    ) -> OpenAIMessage:
+        """Get a JSON response from OpenAI's API asynchronously."""
+        return await getOpenAiResponseAsync(self.messages, ResponseFormat.JSON, model)
+
+    def prefetch_response(self, response_format: ResponseFormat, model: str):
+        """Send the request for a later response ahead of time."""
+        prefetch_response(self.messages, response_format, model)
@@ -0,0 +1,407 @@
+"""Send chat completion requests within rate limits, retrying and hedging them.
+
+Each model has a token bucket for requests per minute and one for tokens per
+minute. A request reserves one request and its estimated tokens, then waits
+until the buckets have refilled enough to pay for them, so a run slows down
+instead of being answered with 429s. Once the response reports its usage, the
+difference from the estimate is given back.
+
+Failed attempts are retried with jittered exponential backoff if the error is
+transient: a timeout, a connection error, a 429 or a 5xx. Every attempt has a
+timeout, and the request as a whole has a deadline after which it is not
+retried again.
+
+With hedging, an async request still running after the model's observed p95
+latency is sent a second time, and whichever answer arrives first is used.
+"""
+
+import argparse
+import asyncio
+import random
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, TypeVar
+from utils.metrics import (
+    estimate_usage,
+    record_hedged_request,
+    record_rate_limit_wait,
+    record_retry,
+)
+from utils.timing import percentile
+
+ResponseT = TypeVar("ResponseT")
+
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_ATTEMPT_TIMEOUT_SECONDS = 60.0
+DEFAULT_DEADLINE_SECONDS = 300.0
+BASE_BACKOFF_SECONDS = 0.5
+MAX_BACKOFF_SECONDS = 30.0
+# Latencies kept per model to estimate the p95 from, and how many are needed
+# before requests are hedged
+LATENCY_WINDOW = 200
+MIN_LATENCIES_TO_HEDGE = 20
+HEDGE_PERCENTILE = 95
+
+
+class RateLimits:
+    """Class for representing the requests and tokens a model allows a minute.
+
+    None means the model has no limit on that.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+
+
+class TokenBucket:
+    """Class for budgeting an amount that refills continuously each minute.
+
+    Reservations may overdraw the bucket, with the caller waiting until the
+    balance is paid back, so callers are served in the order they reserve.
+    Not thread safe on its own.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.refill_per_second = per_minute / 60
+        self.balance = per_minute
+        self.updated = time.monotonic()
+
+    def __refill(self):
+        now = time.monotonic()
+        refill = (now - self.updated) * self.refill_per_second
+        self.balance = min(self.capacity, self.balance + refill)
+        self.updated = now
+
+    def get_seconds_until(self, amount: float) -> float:
+        """Return how long until the balance covers the amount."""
+        self.__refill()
+        shortfall = min(amount, self.capacity) - self.balance
+        return max(0.0, shortfall / self.refill_per_second)
+
+    def reserve(self, amount: float) -> float:
+        """Take the amount, returning the seconds to wait before using it."""
+        self.__refill()
+        self.balance -= min(amount, self.capacity)
+        return max(0.0, -self.balance / self.refill_per_second)
+
+    def refund(self, amount: float):
+        """Give back part of a reservation, or take more if negative."""
+        self.balance = min(self.capacity, self.balance + amount)
+
+
+class ModelBudget:
+    """Class for budgeting the requests and tokens of one model."""
+
+    def __init__(self, rate_limits: RateLimits):
+        self.requests: Optional[TokenBucket] = None
+        if rate_limits.requests_per_minute is not None:
+            self.requests = TokenBucket(rate_limits.requests_per_minute)
+        self.tokens: Optional[TokenBucket] = None
+        if rate_limits.tokens_per_minute is not None:
+            self.tokens = TokenBucket(rate_limits.tokens_per_minute)
+        self.lock = threading.Lock()
+
+    def reserve(self, tokens: int) -> float:
+        """Reserve a request, returning the seconds to wait before sending it."""
+        with self.lock:
+            seconds = 0.0
+            if self.requests is not None:
+                seconds = self.requests.reserve(1)
+            if self.tokens is not None:
+                seconds = max(seconds, self.tokens.reserve(tokens))
+            return seconds
+
+    def try_reserve(self, tokens: int) -> bool:
+        """Reserve a request only if it can be sent right away."""
+        with self.lock:
+            if self.requests is not None and self.requests.get_seconds_until(1) > 0:
+                return False
+            if self.tokens is not None and self.tokens.get_seconds_until(tokens) > 0:
+                return False
+            if self.requests is not None:
+                self.requests.reserve(1)
+            if self.tokens is not None:
+                self.tokens.reserve(tokens)
+            return True
+
+    def refund_tokens(self, tokens: int):
+        """Correct the tokens reserved for a request by its actual usage."""
+        with self.lock:
+            if self.tokens is not None:
+                self.tokens.refund(tokens)
+
+
+def estimate_request_tokens(params: dict) -> int:
+    """Estimate the most tokens a request can use: its prompt and max_tokens."""
+    usage = estimate_usage(params["messages"], "")
+    return usage["prompt_tokens"] + params.get("max_tokens", 0)
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Determine if the error is transient, so the request may succeed again."""
+    # asyncio.TimeoutError is only the builtin TimeoutError from Python 3.11
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError)):
+        return True
+    # Only check openai's errors if it was imported, since it is slow to import
+    openai = sys.modules.get("openai")
+    if openai is not None and isinstance(
+        error,
+        (
+            openai.error.APIConnectionError,
+            openai.error.Timeout,
+            openai.error.ServiceUnavailableError,
+            openai.error.TryAgain,
+        ),
+    ):
+        return True
+    http_status = getattr(error, "http_status", None)
+    return http_status is not None and (http_status == 429 or http_status >= 500)
+
+
+def get_retry_after_seconds(error: BaseException) -> float:
+    """Return the wait the API asked for in a Retry-After header, or 0."""
+    headers = getattr(error, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after", 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class RequestScheduler:
+    """Class for sending requests within rate limits, retrying and hedging them.
+
+    Each model gets its own budget under the same rate limits. Hedging only
+    applies to async requests, since a blocking request can't be raced.
+    """
+
+    def __init__(
+        self,
+        rate_limits: Optional[RateLimits] = None,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        attempt_timeout_seconds: float = DEFAULT_ATTEMPT_TIMEOUT_SECONDS,
+        deadline_seconds: float = DEFAULT_DEADLINE_SECONDS,
+        hedge: bool = False,
+        seed: Optional[int] = None,
+    ):
+        self.rate_limits = rate_limits or RateLimits()
+        self.max_retries = max_retries
+        self.attempt_timeout_seconds = attempt_timeout_seconds
+        self.deadline_seconds = deadline_seconds
+        self.hedge = hedge
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.budgets: Dict[str, ModelBudget] = {}
+        self.latencies: Dict[str, Deque[float]] = defaultdict(
+            lambda: deque(maxlen=LATENCY_WINDOW)
+        )
+
+    def __get_budget(self, model: str) -> ModelBudget:
+        with self.lock:
+            if model not in self.budgets:
+                self.budgets[model] = ModelBudget(self.rate_limits)
+            return self.budgets[model]
+
+    def __reserve(self, params: dict) -> float:
+        """Reserve budget for the request, returning the seconds to wait."""
+        budget = self.__get_budget(params["model"])
+        seconds = budget.reserve(estimate_request_tokens(params))
+        if seconds > 0:
+            record_rate_limit_wait(params["model"], seconds)
+        return seconds
+
+    def __try_reserve(self, params: dict) -> bool:
+        budget = self.__get_budget(params["model"])
+        return budget.try_reserve(estimate_request_tokens(params))
+
+    def __record_success(self, params: dict, response, seconds: Optional[float]):
+        """Remember the latency, and give back the tokens the estimate overran.
+
+        Stream attempts pass no latency, since opening a stream takes much less
+        time than a whole response and would lower the hedge delay.
+        """
+        if seconds is not None:
+            with self.lock:
+                self.latencies[params["model"]].append(seconds)
+        usage = response.get("usage") if isinstance(response, dict) else None
+        if usage:
+            self.__get_budget(params["model"]).refund_tokens(
+                estimate_request_tokens(params) - usage.get("total_tokens", 0)
+            )
+
+    def get_hedge_delay(self, model: str) -> Optional[float]:
+        """Return the observed p95 latency, or None if too few are observed."""
+        with self.lock:
+            latencies = list(self.latencies[model])
+        if len(latencies) < MIN_LATENCIES_TO_HEDGE:
+            return None
+        return percentile(latencies, HEDGE_PERCENTILE)
+
+    def __get_backoff_seconds(
+        self, error: BaseException, retry: int, deadline: float
+    ) -> Optional[float]:
+        """Return how long to wait before retrying, or None to give up."""
+        if retry >= self.max_retries or not is_retryable(error):
+            return None
+        backoff = min(MAX_BACKOFF_SECONDS, BASE_BACKOFF_SECONDS * 2**retry)
+        with self.lock:
+            seconds = backoff * self.rng.random()
+        seconds = max(seconds, get_retry_after_seconds(error))
+        if time.monotonic() + seconds >= deadline:
+            return None
+        return seconds
+
+    def request(
+        self,
+        params: dict,
+        attempt: Callable[[dict, float], ResponseT],
+        stream: bool = False,
+    ) -> ResponseT:
+        """Send the request with `attempt(params, timeout_seconds)`, retrying it.
+
+        If `stream` is True the attempt only opens a stream.
+        """
+        deadline = time.monotonic() + self.deadline_seconds
+        retry = 0
+        while True:
+            time.sleep(self.__reserve(params))
+            timeout = min(self.attempt_timeout_seconds, deadline - time.monotonic())
+            start = time.monotonic()
+            try:
+                response = attempt(params, max(timeout, 0.0))
+            except Exception as error:  # pylint: disable=broad-except
+                backoff_seconds = self.__get_backoff_seconds(error, retry, deadline)
+                if backoff_seconds is None:
+                    raise
+                record_retry(params["model"])
+                time.sleep(backoff_seconds)
+                retry += 1
+                continue
+            seconds = None if stream else time.monotonic() - start
+            self.__record_success(params, response, seconds)
+            return response
+
+    async def request_async(
+        self,
+        params: dict,
+        attempt: Callable[[dict], Awaitable[ResponseT]],
+        stream: bool = False,
+    ) -> ResponseT:
+        """Async version of request, hedging requests that are not streams.
+
+        Attempts are cancelled when they time out.
+        """
+        deadline = time.monotonic() + self.deadline_seconds
+        retry = 0
+        while True:
+            await asyncio.sleep(self.__reserve(params))
+            timeout = min(self.attempt_timeout_seconds, deadline - time.monotonic())
+            try:
+                return await self.__attempt_async(
+                    params, attempt, max(timeout, 0.0), stream
+                )
+            except Exception as error:  # pylint: disable=broad-except
+                backoff_seconds = self.__get_backoff_seconds(error, retry, deadline)
+                if backoff_seconds is None:
+                    raise
+                record_retry(params["model"])
+                await asyncio.sleep(backoff_seconds)
+                retry += 1
+
+    async def __attempt_async(
+        self,
+        params: dict,
+        attempt: Callable[[dict], Awaitable[ResponseT]],
+        timeout: float,
+        stream: bool,
+    ) -> ResponseT:
+        start = time.monotonic()
+        if stream:
+            response = await asyncio.wait_for(attempt(params), timeout)
+            self.__record_success(params, response, None)
+            return response
+        hedge_delay = self.get_hedge_delay(params["model"]) if self.hedge else None
+        if hedge_delay is None or hedge_delay >= timeout:
+            response = await asyncio.wait_for(attempt(params), timeout)
+            self.__record_success(params, response, time.monotonic() - start)
+            return response
+        primary = asyncio.ensure_future(asyncio.wait_for(attempt(params), timeout))
+        tasks = {primary}
+        hedge_start = start
+        try:
+            await asyncio.wait(tasks, timeout=hedge_delay)
+            # Hedge only with budget to spare, so hedging can't cause 429s
+            if not primary.done() and self.__try_reserve(params):
+                hedge_start = time.monotonic()
+                hedge_task = asyncio.ensure_future(
+                    asyncio.wait_for(attempt(params), timeout - hedge_delay)
+                )
+                tasks.add(hedge_task)
+            pending = set(tasks)
+            while len(pending) > 0:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is not None:
+                        continue
+                    if task is primary:
+                        seconds = time.monotonic() - start
+                    else:
+                        seconds = time.monotonic() - hedge_start
+                    if len(tasks) > 1:
+                        winner = "primary" if task is primary else "hedge"
+                        record_hedged_request(params["model"], winner)
+                    self.__record_success(params, task.result(), seconds)
+                    return task.result()
+            # Every attempt failed, so raise the first one's error
+            return primary.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """Add the options for the request scheduler to the parser."""
+    parser.add_argument(
+        "--requests-per-minute",
+        type=float,
+        help="per model, with --tokens-per-minute, to stay within rate limits",
+    )
+    parser.add_argument("--tokens-per-minute", type=float)
+    parser.add_argument("--max-retries", type=int, default=DEFAULT_MAX_RETRIES)
+    parser.add_argument(
+        "--request-timeout",
+        type=float,
+        default=DEFAULT_ATTEMPT_TIMEOUT_SECONDS,
+        help="seconds before an attempt is abandoned and retried",
+    )
+    parser.add_argument(
+        "--request-deadline",
+        type=float,
+        default=DEFAULT_DEADLINE_SECONDS,
+        help="seconds after which a request is no longer retried",
+    )
+    parser.add_argument(
+        "--hedge",
+        action="store_true",
+        help="send a request again once it is slower than the observed p95",
+    )
+
+
+def get_request_scheduler(args: argparse.Namespace) -> RequestScheduler:
+    """Return the request scheduler configured by the options."""
+    return RequestScheduler(
+        RateLimits(args.requests_per_minute, args.tokens_per_minute),
+        max_retries=args.max_retries,
+        attempt_timeout_seconds=args.request_timeout,
+        deadline_seconds=args.request_deadline,
+        hedge=args.hedge,
+    )
@@ -0,0 +1,190 @@
+"""On-disk cache of OpenAI responses keyed by a hash of the request."""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Awaitable, Callable, Dict, Optional
+
+DEFAULT_CACHE_DIRECTORY = ".cache/openai"
+# Mock responses are kept apart, so a live run is never answered by the mock
+MOCK_CACHE_DIRECTORY = ".cache/openai_mock"
+DEFAULT_MAX_CACHE_BYTES = 512 * 1024 * 1024
+
+
+class CacheMissError(Exception):
+    """Raised in replay mode when a request has no cached response."""
+
+
+def get_cache_key(params: dict) -> str:
+    """Return the content hash of the request parameters.
+
+    The parameters include the model, messages, response format and sampling
+    parameters, so changing any of them produces a different key.
+    """
+    canonical_params = json.dumps(params, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical_params.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Class for caching responses on disk with least recently used eviction.
+
+    A request repeated within a run gets the next cached sample, not the
+    first one again. Concurrent requests with the same sample key share a
+    single API call. In replay mode a request without a cached response
+    raises CacheMissError instead of calling the API.
+    """
+
+    def __init__(
+        self,
+        directory: str = DEFAULT_CACHE_DIRECTORY,
+        max_bytes: int = DEFAULT_MAX_CACHE_BYTES,
+        replay: bool = False,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.replay = replay
+        self.lock = threading.Lock()
+        # Times each request was made in this run
+        self.sample_counts: Dict[str, int] = {}
+        self.in_flight: Dict[str, Future] = {}
+        self.in_flight_async: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        # Cached keys and their sizes, least recently used first
+        self.entry_sizes: "OrderedDict[str, int]" = OrderedDict()
+        entries = [
+            entry for entry in os.scandir(directory) if entry.name.endswith(".json")
+        ]
+        for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime):
+            self.entry_sizes[entry.name[: -len(".json")]] = entry.stat().st_size
+        self.total_bytes = sum(self.entry_sizes.values())
+
+    def __get_file_name(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str) -> Optional[dict]:
+        """Return the cached response for the key, if there is one."""
+        with self.lock:
+            if key not in self.entry_sizes:
+                return None
+            self.entry_sizes.move_to_end(key)
+        file_name = self.__get_file_name(key)
+        try:
+            with open(file_name, "r") as cache_file:
+                response = json.load(cache_file)
+            os.utime(file_name)
+        except FileNotFoundError:
+            return None
+        return response
+
+    def put(self, key: str, response: dict):
+        """Cache the response, evicting the least recently used entries."""
+        file_name = self.__get_file_name(key)
+        temporary_file_name = f"{file_name}.{threading.get_ident()}.tmp"
+        with open(temporary_file_name, "w") as cache_file:
+            json.dump(response, cache_file)
+        size = os.path.getsize(temporary_file_name)
+        os.replace(temporary_file_name, file_name)
+        with self.lock:
+            self.total_bytes += size - self.entry_sizes.pop(key, 0)
+            self.entry_sizes[key] = size
+            evicted_keys = []
+            while self.total_bytes > self.max_bytes and len(self.entry_sizes) > 1:
+                evicted_key, evicted_size = self.entry_sizes.popitem(last=False)
+                self.total_bytes -= evicted_size
+                evicted_keys.append(evicted_key)
+        for evicted_key in evicted_keys:
+            try:
+                os.remove(self.__get_file_name(evicted_key))
+            except FileNotFoundError:
+                pass
+
+    def get_sample_key(self, params: dict) -> str:
+        """Return the key of the next response to the request in this run.
+
+        Responses are sampled, so asking the same thing again, as players do
+        after a wrong attempt, must get a new sample rather than the cached
+        one. Each repeat of a request within a run is keyed by how many times
+        it was made before, so a re-run is served the same responses in order.
+        The key hashes the request's content, so requests must list their words
+        in a fixed order, not in the order of a set, which changes with the
+        process's hash seed.
+        """
+        key = get_cache_key(params)
+        if params.get("temperature", 1) == 0:
+            return key
+        with self.lock:
+            sample_index = self.sample_counts.get(key, 0)
+            self.sample_counts[key] = sample_index + 1
+        return key if sample_index == 0 else f"{key}-{sample_index}"
+
+    def lookup(self, key: str) -> Optional[dict]:
+        """Return the cached response for the sample key, counting hits and misses.
+
+        Raises CacheMissError on a miss in replay mode.
+        """
+        response = self.get(key)
+        if response is not None:
+            self.hits += 1
+            return response
+        self.misses += 1
+        if self.replay:
+            raise CacheMissError(f"No cached response for request {key}.")
+        return None
+
+    def get_or_create(self, params: dict, create: Callable[[], dict]) -> dict:
+        """Return the cached response, calling `create` on a cache miss."""
+        key = self.get_sample_key(params)
+        response = self.lookup(key)
+        if response is not None:
+            return response
+        with self.lock:
+            future = self.in_flight.get(key)
+            is_owner = future is None
+            if future is None:
+                future = Future()
+                self.in_flight[key] = future
+        if not is_owner:
+            return future.result()
+        try:
+            response = create()
+            self.put(key, response)
+            future.set_result(response)
+            return response
+        except BaseException as exception:
+            future.set_exception(exception)
+            raise
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+
+    async def get_or_create_async(
+        self, params: dict, create: Callable[[], Awaitable[dict]]
+    ) -> dict:
+        """Async version of get_or_create."""
+        key = self.get_sample_key(params)
+        response = self.lookup(key)
+        if response is not None:
+            return response
+        future = self.in_flight_async.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+        future = asyncio.get_running_loop().create_future()
+        self.in_flight_async[key] = future
+        try:
+            response = await create()
+            self.put(key, response)
+            future.set_result(response)
+            return response
+        except BaseException as exception:
+            future.set_exception(exception)
+            # Retrieve the exception so it is not reported as never retrieved
+            future.exception()
+            raise
+        finally:
+            del self.in_flight_async[key]
@@ -0,0 +1,97 @@
+"""Helpers for recording how long things take."""
+
+import functools
+import math
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, TypeVar
+
+CallableT = TypeVar("CallableT", bound=Callable)
+
+
+def percentile(samples: List[float], percent: float) -> float:
+    """Return the nearest-rank percentile of the given samples."""
+    if len(samples) == 0:
+        return 0.0
+    ordered = sorted(samples)
+    rank = math.ceil(percent / 100 * len(ordered))
+    return ordered[max(rank, 1) - 1]
+
+
+class LatencyRecorder:
+    """Class for recording latency samples by name."""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.lock = threading.Lock()
+
+    def record(self, name: str, seconds: float):
+        """Record a latency sample."""
+        with self.lock:
+            self.samples[name].append(seconds)
+
+    def reset(self):
+        """Forget every sample."""
+        with self.lock:
+            self.samples = defaultdict(list)
+
+    @contextmanager
+    def time(self, name: str) -> Iterator[None]:
+        """Record how long the with block takes."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def get_samples(self, name: str) -> List[float]:
+        """Return the samples recorded under the given name."""
+        return self.samples.get(name, [])
+
+    def get_total(self) -> float:
+        """Return the sum of every sample."""
+        return sum(sum(samples) for samples in self.samples.values())
+
+    def get_summary(self) -> Dict[str, Dict[str, float]]:
+        """Return count, total and percentiles of the samples for each name."""
+        summary: Dict[str, Dict[str, float]] = {}
+        with self.lock:
+            samples_by_name = sorted(self.samples.items())
+        for name, samples in samples_by_name:
+            summary[name] = {
+                "count": len(samples),
+                "total": sum(samples),
+                "p50": percentile(samples, 50),
+                "p95": percentile(samples, 95),
+                "p99": percentile(samples, 99),
+            }
+        return summary
+
+    def __str__(self):
+        lines = []
+        for name, stats in self.get_summary().items():
+            lines.append(
+                f"{name}: n={stats['count']} total={stats['total']:.3f}s "
+                f"p50={stats['p50']:.3f}s p95={stats['p95']:.3f}s"
+            )
+        return "\n".join(lines)
+
+
+# Time spent in each phase of a game, across every game in the process
+phase_timings = LatencyRecorder()
+
+
+def timed(name: str) -> Callable[[CallableT], CallableT]:
+    """Decorator recording each call's duration under `name` in phase_timings."""
+
+    def decorator(function: CallableT) -> CallableT:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with phase_timings.time(name):
+                return function(*args, **kwargs)
+
+        return wrapper  # type: ignore
+
+    return decorator
@@ -0,0 +1,234 @@
+"""Record full game transcripts and replay them without the site or the API.
+
+A transcript holds a game's initial words, every model response keyed by its
+request, and every attempt with its result, as one JSON line per game. With
+ReplayConnections in place of the site and TranscriptChatCompletion in place
+of the API, recorded games are played again at CPU speed, so a change to a
+player or to parsing can be checked against hundreds of real games.
+
+Requests are keyed by the response cache key of their parameters, with every
+JSON list of words sorted first. The words are sent in set order, which
+differs between processes, so the key would otherwise not match on replay.
+"""
+
+import json
+import os
+import threading
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Deque, Dict, Iterator, List, Optional, Set, Tuple
+from game_types.game_types import AttemptResultStatus
+from utils.metrics import estimate_usage
+from utils.response_cache import get_cache_key
+
+TRANSCRIPT_FOLDER = "output/transcripts"
+
+
+class TranscriptMissError(Exception):
+    """Raised when a replayed game asks for something its transcript lacks."""
+
+
+def get_canonical_content(content: str) -> str:
+    """Return the message content with every JSON list of words sorted."""
+    lines = []
+    for line in content.split("\n"):
+        try:
+            value = json.loads(line)
+        except json.JSONDecodeError:
+            lines.append(line)
+            continue
+        if isinstance(value, list) and all(isinstance(item, str) for item in value):
+            line = json.dumps(sorted(value))
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def get_request_key(params: dict) -> str:
+    """Return the key of the request, the same whatever order words are in."""
+    messages = [
+        {**message, "content": get_canonical_content(message["content"])}
+        for message in params["messages"]
+    ]
+    return get_cache_key({**params, "messages": messages})
+
+
+class GameTranscript:
+    """Class for representing the recording of a single game."""
+
+    def __init__(self, game_id: int, model: str = ""):
+        self.game_id = game_id
+        self.model = model
+        self.words: List[str] = []
+        # Request key, response format, content, and if the content is whole
+        self.responses: List[Tuple[str, str, str, bool]] = []
+        self.attempts: List[Tuple[List[str], AttemptResultStatus]] = []
+        self.groups_identified = 0
+        self.total_attempts = 0
+
+    def record_words(self, words: Set[str]):
+        """Record the words the game started with."""
+        self.words = sorted(words)
+
+    def record_response(
+        self, params: dict, response_format: str, content: str, complete: bool
+    ):
+        """Record a response, which is not complete if its stream was closed."""
+        self.model = params["model"]
+        self.responses.append(
+            (get_request_key(params), response_format, content, complete)
+        )
+
+    def record_attempt(self, words: Set[str], result: AttemptResultStatus):
+        """Record an attempt and its result."""
+        self.attempts.append((sorted(words), result))
+
+    def get_as_dict(self) -> dict:
+        """Return the transcript as a dictionary."""
+        return {
+            "game_id": self.game_id,
+            "model": self.model,
+            "words": self.words,
+            "responses": [
+                {"key": key, "format": response_format, "content": content}
+                if complete
+                else {
+                    "key": key,
+                    "format": response_format,
+                    "content": content,
+                    "complete": False,
+                }
+                for key, response_format, content, complete in self.responses
+            ],
+            "attempts": [
+                {"words": words, "result": result.name}
+                for words, result in self.attempts
+            ],
+            "groups_identified": self.groups_identified,
+            "total_attempts": self.total_attempts,
+        }
+
+    @staticmethod
+    def from_dict(transcript_dict: dict) -> "GameTranscript":
+        """Return the transcript stored in the dictionary."""
+        transcript = GameTranscript(
+            transcript_dict["game_id"], transcript_dict["model"]
+        )
+        transcript.words = transcript_dict["words"]
+        transcript.responses = [
+            (
+                response["key"],
+                response["format"],
+                response["content"],
+                response.get("complete", True),
+            )
+            for response in transcript_dict["responses"]
+        ]
+        transcript.attempts = [
+            (attempt["words"], AttemptResultStatus[attempt["result"]])
+            for attempt in transcript_dict["attempts"]
+        ]
+        transcript.groups_identified = transcript_dict["groups_identified"]
+        transcript.total_attempts = transcript_dict["total_attempts"]
+        return transcript
+
+
+current_game_transcript: ContextVar[Optional[GameTranscript]] = ContextVar(
+    "current_game_transcript", default=None
+)
+
+
+class TranscriptRecorder:
+    """Class for appending the transcripts of finished games to a file."""
+
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        self.lock = threading.Lock()
+        directory = os.path.dirname(file_name)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @contextmanager
+    def track_game(self, game_id: int) -> Iterator[GameTranscript]:
+        """Record the game played in the with block."""
+        transcript = GameTranscript(game_id)
+        token = current_game_transcript.set(transcript)
+        try:
+            yield transcript
+        finally:
+            current_game_transcript.reset(token)
+
+    def save(
+        self, transcript: GameTranscript, groups_identified: int, total_attempts: int
+    ):
+        """Append the transcript of the finished game to the file."""
+        transcript.groups_identified = groups_identified
+        transcript.total_attempts = total_attempts
+        line = json.dumps(transcript.get_as_dict(), separators=(",", ":"))
+        with self.lock:
+            with open(self.file_name, "a", encoding="utf-8") as transcript_file:
+                transcript_file.write(line + "\n")
+
+
+def load_transcripts(file_name: str) -> Dict[int, GameTranscript]:
+    """Load the transcripts in the file, keeping the latest of each game."""
+    transcripts: Dict[int, GameTranscript] = {}
+    with open(file_name, "r", encoding="utf-8") as transcript_file:
+        for line in transcript_file:
+            if line.strip():
+                transcript = GameTranscript.from_dict(json.loads(line))
+                transcripts[transcript.game_id] = transcript
+    return transcripts
+
+
+class TranscriptChatCompletion:
+    """Fake `openai.ChatCompletion` answering with the recorded responses.
+
+    Identical requests get their recorded responses in the order they were
+    made. A request that was not recorded raises TranscriptMissError.
+    """
+
+    def __init__(self, transcripts: Dict[int, GameTranscript]):
+        self.lock = threading.Lock()
+        self.responses: Dict[str, Deque[Tuple[str, bool]]] = defaultdict(deque)
+        for transcript in transcripts.values():
+            for key, _, content, complete in transcript.responses:
+                self.responses[key].append((content, complete))
+
+    def __pop_response(self, params: dict) -> Tuple[str, bool]:
+        with self.lock:
+            responses = self.responses.get(get_request_key(params))
+            if not responses:
+                raise TranscriptMissError("The request was not recorded.")
+            return responses.popleft()
+
+    def __get_response(self, params: dict) -> dict:
+        content, complete = self.__pop_response(params)
+        if not complete:
+            raise TranscriptMissError("Only part of the response was recorded.")
+        return {
+            "choices": [{"message": {"role": "assistant", "content": content}}],
+            "usage": estimate_usage(params["messages"], content),
+        }
+
+    def create(self, stream: bool = False, request_timeout=None, **params):
+        """Answer a chat completion request from the transcripts."""
+        if not stream:
+            return self.__get_response(params)
+        return self.__stream(*self.__pop_response(params))
+
+    def __stream(self, content: str, complete: bool) -> Iterator[dict]:
+        yield {"choices": [{"index": 0, "delta": {"content": content}}]}
+        if not complete:
+            raise TranscriptMissError("The recorded stream was closed here.")
+
+    async def acreate(self, stream: bool = False, request_timeout=None, **params):
+        """Async version of create."""
+        if not stream:
+            return self.__get_response(params)
+        return self.__stream_async(*self.__pop_response(params))
+
+    async def __stream_async(self, content: str, complete: bool) -> AsyncIterator[dict]:
+        yield {"choices": [{"index": 0, "delta": {"content": content}}]}
+        if not complete:
+            raise TranscriptMissError("The recorded stream was closed here.")
@@ -0,0 +1,223 @@
+"""Queue of games to play, shared by every worker playing the same sweep.
+
+Work items are the games of a run, model and prompt, kept in the results
+database so that every worker process on the host can take part. The database
+is in WAL mode, which does not work on a network filesystem, so workers on
+other hosts cannot share it. A worker claims a game atomically, which leases
+it for `lease_seconds`, and heartbeats to extend the lease while playing. A
+game whose lease expires, because its worker crashed or hung, is claimed
+again by the next worker to ask, unless it was already claimed MAX_ATTEMPTS
+times.
+
+A result is only saved if the worker still holds the game's lease, in the
+same transaction that marks the game done, so each game gets exactly one
+result however many workers take part.
+
+    PYTHONPATH=src python src/work_queue.py status
+"""
+
+import argparse
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, Optional
+from results_store import (
+    CREATE_RESULTS_TABLE,
+    RESULTS_DATABASE_FILE,
+    ResultKey,
+    connect,
+    insert_result,
+)
+from results_tracker import GameResult
+
+DEFAULT_LEASE_SECONDS = 120.0
+# Games that fail this many times are marked failed instead of played again
+MAX_ATTEMPTS = 3
+
+CREATE_WORK_ITEMS_TABLE = """
+CREATE TABLE IF NOT EXISTS work_items (
+    run TEXT NOT NULL,
+    model TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    game_id INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_expires_at REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (run, model, prompt, game_id)
+)
+"""
+KEY_CONDITION = "run = ? AND model = ? AND prompt = ?"
+
+
+def get_worker_id() -> str:
+    """Return an id unique to this process, naming its host and pid."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class WorkQueue:
+    """Class for claiming the games of one run, model and prompt to play.
+
+    Each thread gets its own connection, since sqlite3 connections cannot be
+    shared between threads.
+    """
+
+    def __init__(
+        self,
+        key: ResultKey,
+        file_name: str = RESULTS_DATABASE_FILE,
+        lease_seconds: float = DEFAULT_LEASE_SECONDS,
+        worker_id: Optional[str] = None,
+    ):
+        self.key = key
+        self.file_name = file_name
+        self.lease_seconds = lease_seconds
+        self.worker_id = worker_id or get_worker_id()
+        self.local = threading.local()
+        with self.__transaction() as connection:
+            connection.execute(CREATE_RESULTS_TABLE)
+            connection.execute(CREATE_WORK_ITEMS_TABLE)
+
+    def __get_connection(self) -> sqlite3.Connection:
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = connect(self.file_name)
+            # Transactions are begun explicitly, so claims can take the lock
+            connection.isolation_level = None
+            self.local.connection = connection
+        return connection
+
+    @contextmanager
+    def __transaction(self) -> Iterator[sqlite3.Connection]:
+        """Run the with block in a transaction holding the write lock."""
+        connection = self.__get_connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def add_games(self, game_ids: Iterable[int]):
+        """Queue the games, unless they are queued already.
+
+        Games that already have a result are added as done.
+        """
+        with self.__transaction() as connection:
+            connection.executemany(
+                "INSERT OR IGNORE INTO work_items (run, model, prompt, game_id, status)"
+                " SELECT ?, ?, ?, ?, CASE WHEN EXISTS ("
+                f"    SELECT 1 FROM results WHERE {KEY_CONDITION} AND game_id = ?"
+                " ) THEN 'done' ELSE 'pending' END",
+                [(*self.key, game_id, *self.key, game_id) for game_id in game_ids],
+            )
+
+    def claim(self) -> Optional[int]:
+        """Lease the next game nobody is playing, or return None if none is left."""
+        now = time.time()
+        with self.__transaction() as connection:
+            connection.execute(
+                "UPDATE work_items SET status = 'failed', worker = NULL,"
+                " lease_expires_at = NULL"
+                f" WHERE {KEY_CONDITION} AND status = 'leased'"
+                " AND lease_expires_at < ? AND attempts >= ?",
+                (*self.key, now, MAX_ATTEMPTS),
+            )
+            row = connection.execute(
+                f"SELECT game_id FROM work_items WHERE {KEY_CONDITION}"
+                " AND (status = 'pending'"
+                " OR (status = 'leased' AND lease_expires_at < ?))"
+                " ORDER BY attempts, game_id LIMIT 1",
+                (*self.key, now),
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE work_items SET status = 'leased', worker = ?,"
+                " lease_expires_at = ?, attempts = attempts + 1"
+                f" WHERE {KEY_CONDITION} AND game_id = ?",
+                (self.worker_id, now + self.lease_seconds, *self.key, row["game_id"]),
+            )
+        return row["game_id"]
+
+    def __update_leased(
+        self, connection: sqlite3.Connection, game_id: int, assignments: str, values
+    ) -> bool:
+        """Update the game if this worker holds its lease, returning if it did."""
+        cursor = connection.execute(
+            f"UPDATE work_items SET {assignments}"
+            f" WHERE {KEY_CONDITION} AND game_id = ?"
+            " AND status = 'leased' AND worker = ?",
+            (*values, *self.key, game_id, self.worker_id),
+        )
+        return cursor.rowcount == 1
+
+    def heartbeat(self, game_id: int) -> bool:
+        """Extend the lease on the game, returning False if it was lost."""
+        with self.__transaction() as connection:
+            return self.__update_leased(
+                connection,
+                game_id,
+                "lease_expires_at = ?",
+                (time.time() + self.lease_seconds,),
+            )
+
+    def complete(self, result: GameResult) -> bool:
+        """Save the result and mark the game done, if the lease is still held."""
+        with self.__transaction() as connection:
+            if not self.__update_leased(
+                connection,
+                result.game_id,
+                "status = 'done', worker = NULL, lease_expires_at = NULL",
+                (),
+            ):
+                return False
+            insert_result(connection, self.key, result)
+        return True
+
+    def release(self, game_id: int):
+        """Give up the game so another worker plays it, or fail it for good."""
+        with self.__transaction() as connection:
+            self.__update_leased(
+                connection,
+                game_id,
+                "status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,"
+                " worker = NULL, lease_expires_at = NULL",
+                (MAX_ATTEMPTS,),
+            )
+
+    def get_counts(self) -> Dict[str, int]:
+        """Return how many games are pending, leased, done and failed."""
+        rows = self.__get_connection().execute(
+            "SELECT status, COUNT(*) AS games FROM work_items"
+            f" WHERE {KEY_CONDITION} GROUP BY status",
+            self.key,
+        )
+        return {row["status"]: row["games"] for row in rows}
+
+
+def main(args: argparse.Namespace):
+    connection = connect(args.database)
+    connection.execute(CREATE_WORK_ITEMS_TABLE)
+    rows = connection.execute(
+        "SELECT run, model, prompt, status, COUNT(*) AS games FROM work_items"
+        " GROUP BY run, model, prompt, status ORDER BY run, model, prompt, status"
+    )
+    print(f"{'run':<25}{'model':<22}{'prompt':<12}{'status':<10}{'games':>7}")
+    for row in rows:
+        print(
+            f"{row['run']:<25}{row['model']:<22}{row['prompt']:<12}"
+            f"{row['status']:<10}{row['games']:>7}"
+        )
+
+
+if __name__ == "__main__":
+    argument_parser = argparse.ArgumentParser(description=__doc__)
+    argument_parser.add_argument("command", choices=["status"])
+    argument_parser.add_argument("--database", default=RESULTS_DATABASE_FILE)
+    main(argument_parser.parse_args())
@@ -0,0 +1,47 @@
+import asyncio
+from utils.openai_wrapper import (
+    OpenAIMessageFactory,
+    ResponseFormat,
+    api_semaphore,
+    getOpenAiResponseStreamAsync,
+    set_chat_completion_backend,
+    set_response_cache,
+)
+
+
+class StreamingBackend:
+    """Streams two pieces of content for every request."""
+
+    @staticmethod
+    async def acreate(stream: bool = True, **params):
+        async def chunks():
+            for content in ("first\n", "second\n"):
+                await asyncio.sleep(0)
+                yield {"choices": [{"delta": {"content": content}}]}
+
+        return chunks()
+
+
+def test_stream_releases_api_slot_before_caller_is_done():
+    set_chat_completion_backend(StreamingBackend())
+    set_response_cache(None)
+
+    async def stream_two_at_once():
+        token = api_semaphore.set(asyncio.Semaphore(1))
+        try:
+            messages = [OpenAIMessageFactory.get_user_message("words")]
+            first_stream = getOpenAiResponseStreamAsync(messages, ResponseFormat.TEXT)
+            await anext(first_stream)
+            # The first caller has not finished reading, but its stream has
+            second_stream = getOpenAiResponseStreamAsync(messages, ResponseFormat.TEXT)
+            contents = [content async for content in second_stream]
+            await first_stream.aclose()
+            return contents
+        finally:
+            api_semaphore.reset(token)
+
+    try:
+        contents = asyncio.run(asyncio.wait_for(stream_two_at_once(), 5))
+    finally:
+        set_chat_completion_backend(None)
+    assert contents == ["first\n", "second\n"]
@@ -0,0 +1,23 @@
+import asyncio
+from utils.request_scheduler import RequestScheduler, is_retryable
+
+
+def test_async_timeouts_are_retryable():
+    assert is_retryable(asyncio.TimeoutError())
+    assert is_retryable(TimeoutError())
+    assert not is_retryable(ValueError())
+
+
+def test_timed_out_async_attempt_is_retried():
+    scheduler = RequestScheduler(attempt_timeout_seconds=0.01, seed=0)
+    attempts = []
+
+    async def attempt(params):
+        attempts.append(params)
+        if len(attempts) == 1:
+            await asyncio.sleep(1)
+        return {}
+
+    params = {"model": "gpt-4", "messages": []}
+    assert asyncio.run(scheduler.request_async(params, attempt)) == {}
+    assert len(attempts) == 2
@@ -0,0 +1,56 @@
+import asyncio
+import os
+import subprocess
+import sys
+from utils.response_cache import ResponseCache
+
+SOURCE_FOLDER = os.path.join(os.path.dirname(__file__), "..", "src")
+GET_KEY_SCRIPT = """
+from ai import get_initial_user_message_content
+from utils.response_cache import get_cache_key
+
+words = {f"WORD{i}" for i in range(16)}
+params = {
+    "model": "gpt-4",
+    "messages": [{"role": "user", "content": get_initial_user_message_content(words)}],
+    "temperature": 1,
+}
+print(get_cache_key(params))
+"""
+
+
+def get_key_in_process(hash_seed: str) -> str:
+    environment = dict(os.environ, PYTHONHASHSEED=hash_seed, PYTHONPATH=SOURCE_FOLDER)
+    return subprocess.run(
+        [sys.executable, "-c", GET_KEY_SCRIPT],
+        env=environment,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.strip()
+
+
+def test_cache_key_does_not_depend_on_hash_seed():
+    assert get_key_in_process("1") == get_key_in_process("2")
+
+
+def test_concurrent_identical_requests_share_one_call(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    calls = []
+
+    async def create():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"content": "response"}
+
+    async def request_twice(temperature: float):
+        params = {"model": "gpt-4", "messages": [], "temperature": temperature}
+        return await asyncio.gather(
+            cache.get_or_create_async(params, create),
+            cache.get_or_create_async(params, create),
+        )
+
+    asyncio.run(request_twice(0))
+    assert len(calls) == 1
+    asyncio.run(request_twice(1))
+    assert len(calls) == 3